@@ -0,0 +1,37 @@
+"""
+angstrom_estimator.py
+=====================
+
+Author: Mattia Mancini
+Created: 20-June-2023
+-----------------------
+
+DESCRIPTION
+Script that estimates the Angstrom A and B coefficients of every
+land 1km cell from the Chess-Scape shortwave radiation and the
+theoretical top-of-atmosphere radiation, with the same method used
+by the NASAPowerWeatherDataProvider of PCSE, without downloading
+any data (see angstrom_downloader.py). The coefficients are stored
+by cell in 'angst_coefficients_cells.csv' in the utils directory,
+from which they are used by the NetCDFWeatherDataProvider for the
+parcels that are not in 'angst_coefficients.csv'.
+
+Example:
+    python angstrom_estimator.py --rcp rcp26 --ensemble 1 --start-year 1981 --end-year 2010
+"""
+import argparse
+from cropyields.angstrom import estimate_angstrom_coefficients
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Estimate the Angstrom coefficients of every 1km cell')
+    parser.add_argument('--rcp', default='rcp26', help='rcp of the Chess-Scape tiles to use')
+    parser.add_argument('--ensemble', type=int, default=1, help='ensemble of the Chess-Scape tiles to use')
+    parser.add_argument('--start-year', type=int, default=None, help='first year of radiation data to use')
+    parser.add_argument('--end-year', type=int, default=None, help='last year of radiation data to use')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    df = estimate_angstrom_coefficients(args.rcp, args.ensemble, start_year=args.start_year,
+                                        end_year=args.end_year, processes=args.processes)
+    print(f'Angstrom coefficients estimated for {len(df)} cells')
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Convert the 10km OSGB Chess-Scape tiles of the chosen rcps and ensembles
+into national stores laid out for point time-series reads (see
+cropyields.chess_scape_store). The reference ET depends on the parcel and is
+computed by the weather provider, hence it is not stored.
+
+Example:
+    python build_chess_scape_store.py --rcp rcp26 rcp85 --ensemble 1 4 --processes 8
+
+The stores are then used by the weather provider with:
+    NetCDFWeatherDataProvider(osgrid_code, rcp, ensemble, backend='store')
+"""
+import argparse
+from cropyields.chess_scape_store import build_chess_scape_store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the national Chess-Scape stores')
+    parser.add_argument('--rcp', nargs='+', default=['rcp26'], help='rcp scenarios, e.g. rcp26 rcp85')
+    parser.add_argument('--ensemble', nargs='+', type=int, default=[1], help='ensemble numbers, e.g. 1 4')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    for rcp in args.rcp:
+        for ensemble in args.ensemble:
+            print(f'Building the national store of {rcp}, ensemble {ensemble}')
+            store_dir = build_chess_scape_store(rcp, ensemble, processes=args.processes)
+            print(f'Store written to {store_dir}')
@@ -0,0 +1,36 @@
+"""
+build_soil_hydraulics.py
+========================
+
+Author: Mattia Mancini
+Created: 26-June-2023
+-----------------------
+
+DESCRIPTION
+Script that computes the soil parameters (SOLNAM, SMW, SMFCF, SM0,
+K0, SMTAB and CONTAB) of every 250m British National Grid cell of GB
+from the SoilGrids data retrieved with 'bulk_SoilGrids_downloader.py',
+and stores them as a raster in the soils directory. The raster is
+read by the SoilHydraulicsDataProvider, which then needs no Rosetta
+run at simulation time (see cropyields.soil_hydraulics).
+
+Example:
+    python build_soil_hydraulics.py --texture-resolution 1 --processes 8
+"""
+import argparse
+from cropyields.soil_hydraulics import build_soil_hydraulic_raster
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute the soil parameters of every 250m BNG cell')
+    parser.add_argument('--texture-resolution', type=float, default=1.,
+                        help='resolution (%%) to which sand, silt and clay are rounded')
+    parser.add_argument('--window-rows', type=int, default=100, help='number of grid rows read by each task')
+    parser.add_argument('--chunk-size', type=int, default=5000,
+                        help='number of distinct textures passed to Rosetta by each task')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    raster = build_soil_hydraulic_raster(texture_resolution=args.texture_resolution, window_rows=args.window_rows,
+                                         chunk_size=args.chunk_size, processes=args.processes)
+    print(f'Soil hydraulic raster written to {raster.header_fname}')
@@ -6,14 +6,51 @@
 SOIL MANAGER
 """
 
+import json
+import os
+import threading
+import warnings
 from math import log10
 import numpy as np
+import pandas as pd
 import xarray as xr
+from pyproj import Transformer
 from rosetta import rosetta, SoilData
 from soiltexture import getTexture
 from cropyields import data_dirs
-from cropyields.utils import osgrid2lonlat, water_retention, water_conductivity, nearest
-from cropyields.db_manager import get_whsd_data
+from cropyields.utils import osgrid2lonlat, hydraulic_tables, nearest
+from cropyields.seer import seer_soil_table
+from cropyields.weather_cache import source_identity, data_file, write_header_and_data, write_header_and_files
+from cropyields.soil_cache import soil_parameter_cache
+
+# Version of the layout of the SoilGrids texture files (see SoilGridsRaster)
+RASTER_FORMAT_VERSION = 2
+
+# Version of the layout of the soil hydraulic raster files (see SoilHydraulicRaster)
+HYDRAULIC_FORMAT_VERSION = 2
+
+
+def rosetta_parameters(textures, rosetta_version=3):
+    """
+    Run the Rosetta pedotransfer functions once on the soil textures of many
+    parcels and return the van Genuchten parameters of each of them.
+
+    :param textures: array of shape (N, 3) of sand, silt and clay (%). Further
+           columns (bulk density, th33, th1500) are passed to Rosetta too
+    :param rosetta_version: version of the Rosetta models
+
+    Returns a tuple of arrays of length N (theta_r, theta_s, alpha, npar, K0),
+    with NaN for the parcels with no (or invalid) texture data.
+    """
+    textures = np.asarray(textures, dtype=float)
+    if textures.ndim != 2 or textures.shape[1] < 3:
+        msg = "Soil textures must be an array of shape (N, 3), got shape %s" % (textures.shape,)
+        raise ValueError(msg)
+    if len(textures) == 0:
+        return tuple(np.empty(0) for _ in range(5))
+    mean, std, codes = rosetta(rosetta_version, SoilData.from_array(textures))
+    return mean[:, 0], mean[:, 1], 10**mean[:, 2], 10**mean[:, 3], 10**mean[:, 4]
+
 
 class SoilDataProvider(dict):
     """
@@ -36,42 +73,160 @@ class SoilDataProvider(dict):
         'DEFLIM' : -0.300
     }
 
-    def __init__(self, osgrid_code):
+    def __init__(self, osgrid_code, soil_parameters=None):
         dict.__init__(self)
         self.update(self._defaults)
+        if soil_parameters is None:
+            soil_parameters = self._parcel_parameters([osgrid_code])[0]
+        self.update(soil_parameters)
+
+    @classmethod
+    def from_codes(cls, osgrid_codes):
+        """
+        Build the soil data providers of many parcels (e.g. all the parcels of
+        a farm or region) at once: textures are looked up together where the
+        data source allows it (see '_load_soil_textures') and Rosetta is run
+        once for all of them. Returns a dictionary of providers keyed by OS
+        grid code.
+        """
+        osgrid_codes = list(dict.fromkeys(osgrid_codes))
+        parameters = cls._parcel_parameters(osgrid_codes)
+        return {code: cls(code, soil_parameters=params) for code, params in zip(osgrid_codes, parameters)}
+
+    @classmethod
+    def _load_soil_textures(cls, osgrid_codes):
+        """
+        Abstract method: return the sand, silt and clay (%) of many parcels, as
+        an array of shape (N, 3), in the order required by Rosetta. Subclasses
+        implement either this method or '_parcel_parameters' (e.g. when the
+        soil parameters are read as such, see SoilHydraulicsDataProvider).
+        """
+        msg = "%s does not implement _load_soil_textures" % cls.__name__
+        raise NotImplementedError(msg)
+
+    @classmethod
+    def _cell_keys(cls, osgrid_codes):
+        """
+        Keys of the cells of the data source of many parcels (see
+        cropyields.soil_cache), or None where the cell cannot be found
+        without looking up the soil data.
+        """
+        return [None] * len(osgrid_codes)
+
+    @classmethod
+    def _parcel_parameters(cls, osgrid_codes):
+        """
+        Soil parameters of many parcels, taken from the soil parameter cache by
+        cell or by texture where possible. Only the textures of the parcels whose
+        cell is not cached are looked up, and Rosetta only runs on the textures
+        that are not cached either.
+        """
+        osgrid_codes = list(osgrid_codes)
+        cells = cls._cell_keys(osgrid_codes)
+        parameters = [None if cell is None else soil_parameter_cache.get(("cell",) + cell) for cell in cells]
+        todo = [k for k, params in enumerate(parameters) if params is None]
+        if todo:
+            textures = cls._load_soil_textures([osgrid_codes[k] for k in todo])
+            for k, params in zip(todo, cls.hydraulic_parameters(textures)):
+                parameters[k] = params
+                if cells[k] is not None:
+                    soil_parameter_cache.put(("cell",) + cells[k], params)
+        return cls._with_location(osgrid_codes, parameters)
+
+    @classmethod
+    def soil_parameters(cls, osgrid_codes, textures):
+        """
+        Return the soil parameters (SOLNAM, SMTAB, SMW, SMFCF, SM0, CONTAB, K0 and
+        location) of many parcels from their soil textures (see 'hydraulic_parameters').
+
+        :param osgrid_codes: list of N OS grid codes
+        :param textures: array of shape (N, 3) of sand, silt and clay (%)
+        """
+        osgrid_codes = list(osgrid_codes)
+        textures = np.asarray(textures, dtype=float).reshape(len(osgrid_codes), -1)
+        return cls._with_location(osgrid_codes, cls.hydraulic_parameters(textures))
+
+    @staticmethod
+    def _with_location(osgrid_codes, parameters):
+        """Add the OS grid code and location of each parcel to its soil parameters"""
+        x, y = zip(*[osgrid2lonlat(code) for code in osgrid_codes]) if osgrid_codes else ((), ())
+        lons, lats = Transformer.from_crs(27700, 4326, always_xy=True).transform(np.array(x, dtype=float),
+                                                                               np.array(y, dtype=float))
+        # tables are copied, as cached parameters are shared between parcels
+        return [{"osgrid_code": code, "lon": float(lon), "lat": float(lat),
+                 **params, "SMTAB": list(params["SMTAB"]), "CONTAB": list(params["CONTAB"])}
+                for code, lon, lat, params in zip(osgrid_codes, lons, lats, parameters)]
+
+    @classmethod
+    def hydraulic_parameters(cls, textures):
+        """
+        Return the soil parameters (SOLNAM, SMTAB, SMW, SMFCF, SM0, CONTAB, K0) of
+        many soil textures. Parameters are taken from the soil parameter cache
+        where possible; Rosetta is run once for all the other textures (see
+        rosetta_parameters) and their parameters are cached.
+
+        :param textures: array of shape (N, 3) of sand, silt and clay (%)
+        """
+        textures = np.asarray(textures, dtype=float)
+        if textures.ndim != 2:
+            textures = textures.reshape(-1, 3)
+        keys = [("texture",) + tuple(float(v) for v in texture) for texture in textures]
+        parameters = [soil_parameter_cache.get(key) for key in keys]
+        # first parcel of each texture that is not cached
+        first = {}
+        for k, key in enumerate(keys):
+            if parameters[k] is None:
+                first.setdefault(key, k)
+        todo = list(first.values())
+        if not todo:
+            return parameters
 
-    def _return_soildata(self, osgrid_code, soil_texture_list):
-        lon, lat = osgrid2lonlat(osgrid_code, EPSG=4326)
-        rosettasoil = SoilData.from_array([soil_texture_list])
-        mean, std, codes = rosetta(3,rosettasoil) #int=rosetta version
-        theta_r, theta_s, alpha, npar, K0 = mean[0][0], mean[0][1], 10**mean[0][2], 10**mean[0][3], 10**mean[0][4]
+        arrays = cls.hydraulic_arrays(textures[todo])
+        computed = {}
+        for i, k in enumerate(todo):
+            computed[keys[k]] = {
+                "SOLNAM": arrays["SOLNAM"][i],
+                "SMTAB": arrays["SMTAB"][i].tolist(),
+                "SMW": float(arrays["SMW"][i]),
+                "SMFCF": float(arrays["SMFCF"][i]),
+                "SM0": float(arrays["SM0"][i]),
+                "CONTAB": arrays["CONTAB"][i].tolist(),
+                "K0": float(arrays["K0"][i])
+            }
+            # textures with no data are not cached
+            if np.isfinite(textures[k]).all():
+                soil_parameter_cache.put(keys[k], computed[keys[k]])
+        for k, params in enumerate(parameters):
+            if params is None:
+                parameters[k] = computed[keys[k]]
+        return parameters
+
+    @classmethod
+    def hydraulic_arrays(cls, textures):
+        """
+        Compute the soil parameters of many soil textures at once, running
+        Rosetta once for all of them (see rosetta_parameters). Returns a
+        dictionary with the list of texture classes (SOLNAM), the arrays of
+        length N of SMW, SMFCF, SM0 and K0 and the arrays of shape (N, 2*n_psi)
+        of the SMTAB and CONTAB tables.
+
+        :param textures: array of shape (N, 3) of sand, silt and clay (%)
+        """
+        textures = np.asarray(textures, dtype=float)
         psi = [x for x in np.arange(0, 6.1, 0.1).tolist()]
         psi = [-1] + psi# saturation
-        wr = [water_retention(x, theta_r, theta_s, alpha, npar) for x in psi]
-        wc = [water_conductivity(x, theta_r, theta_s, alpha, npar, K0) for x in psi]
-        SMTAB = [x for pair in zip(psi, wr) for x in pair]
         # Permanent wilting point conventianally at 1500 kPa, fc between 10-30kPa
-        wp_idx = psi.index(nearest(self._WILTING_POTENTIAL, psi))
-        fc_idx = psi.index(nearest(self._FIELD_CAPACITY, psi))
-        SMW = wr[wp_idx]
-        SMFCF = wr[fc_idx]
-        SM0 = wr[0]
-        CONTAB = [x for pair in zip(psi, wc) for x in pair]
-        # Provide soil texture given percentage of sand and clay
-        SOLNAM = getTexture(soil_texture_list[0], soil_texture_list[2], classification='INTERNATIONAL')
+        wp_idx = psi.index(nearest(cls._WILTING_POTENTIAL, psi))
+        fc_idx = psi.index(nearest(cls._FIELD_CAPACITY, psi))
 
-        return {
-            "osgrid_code": osgrid_code,
-            "lon": lon,
-            "lat": lat,
-            "SOLNAM": SOLNAM,
-            "SMTAB": SMTAB,
-            "SMW": SMW,
-            "SMFCF": SMFCF,
-            "SM0": SM0,
-            "CONTAB": CONTAB,
-            "K0": K0
-        }
+        # retention and conductivity curves of all the textures at once
+        theta_r, theta_s, alpha, npar, K0 = rosetta_parameters(textures)
+        wr, SMTAB, CONTAB = hydraulic_tables(psi, theta_r, theta_s, alpha, npar, K0)
+
+        # Provide soil texture given percentage of sand and clay
+        SOLNAM = [getTexture(texture[0], texture[2], classification='INTERNATIONAL') for texture in textures]
+        return {"SOLNAM": SOLNAM, "SMTAB": SMTAB, "SMW": wr[:, wp_idx], "SMFCF": wr[:, fc_idx],
+                "SM0": wr[:, 0], "CONTAB": CONTAB, "K0": K0}
 
     def __str__(self):
         msg = "============================================\n"
@@ -90,6 +245,112 @@ class SoilDataProvider(dict):
         return msg
 
 
+class SoilGridsRaster:
+    """
+    Soil texture grids (sand, silt, clay) of the SoilGrids netCDF file, as
+    written by 'bulk_SoilGrids_downloader.py' (4000x6400 cells in EPSG 4326).
+
+    The grids are extracted from the netCDF file the first time they are used
+    and written next to it as a '.npy' file of shape (3, ny, nx), with a '.json'
+    header holding the cell coordinates, the identity of the netCDF file and
+    the name of the '.npy' file (see 'write_header_and_data').
+    The '.npy' file is then memory-mapped, hence opening the raster is instant
+    and lookups only read the pages of the requested cells. The files are
+    rebuilt whenever the netCDF file changes.
+
+    :param soil_fname: name of the SoilGrids netCDF file
+    :param variables: soil variables to extract, in this order
+    """
+
+    def __init__(self, soil_fname, variables=("sand", "silt", "clay")):
+        self.soil_fname = soil_fname
+        self.variables = list(variables)
+        base = os.path.splitext(soil_fname)[0] + "_" + "_".join(self.variables)
+        self.header_fname = base + ".json"
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _build(self, source):
+        """Extract the grids from the netCDF file. Returns a tuple (header, data)"""
+        with xr.open_dataset(self.soil_fname) as ds:
+            x, y = ds["x"].to_numpy(), ds["y"].to_numpy()
+            # first band of each variable, as in the original point lookups
+            grids = [ds[var].transpose(..., "y", "x").to_numpy().reshape(-1, len(y), len(x))[0]
+                     for var in self.variables]
+        header = {"format_version": RASTER_FORMAT_VERSION, "source": source, "variables": self.variables,
+                  "x": x.tolist(), "y": y.tolist()}
+        return header, np.stack(grids)
+
+    def _open(self):
+        """Memory-map the raster, building its files first if needed. If the files
+        cannot be written, the grids extracted from the netCDF file are kept in memory.
+        """
+        source = source_identity(self.soil_fname)
+        try:
+            with open(self.header_fname, "r") as fp:
+                header = json.load(fp)
+            valid = (header.get("format_version") == RASTER_FORMAT_VERSION and header.get("source") == source and
+                     header.get("variables") == self.variables)
+            data = np.load(data_file(self.header_fname, header), mmap_mode="r") if valid else None
+        except (IOError, ValueError, KeyError):
+            valid = False
+        if not valid:
+            header, data = self._build(source)
+            try:
+                data = np.load(write_header_and_data(self.header_fname, header, data), mmap_mode="r")
+            except OSError as e:
+                warnings.warn("Cannot write the soil texture raster to %s: %s" % (self.header_fname, e))
+        self.source = source
+        self.x, self.y = pd.Index(header["x"]), pd.Index(header["y"])
+        self._data = data
+
+    @property
+    def data(self):
+        """Memory-mapped array of shape (n_variables, ny, nx)"""
+        with self._lock:
+            if self._data is None:
+                self._open()
+            return self._data
+
+    def cells_at(self, lon, lat):
+        """
+        Return the (row, column) indices of the cells nearest to arrays of
+        longitudes and latitudes (EPSG 4326), selected as by xarray's
+        '.sel(method="nearest")'.
+        """
+        self.data  # opens the raster and its coordinates
+        ix = self.x.get_indexer(np.atleast_1d(lon), method="nearest")
+        iy = self.y.get_indexer(np.atleast_1d(lat), method="nearest")
+        return iy, ix
+
+    def values_at(self, lon, lat):
+        """
+        Return an array of shape (n_points, n_variables) with the values of the
+        cells nearest to arrays of longitudes and latitudes (EPSG 4326), with a
+        single indexed read.
+        """
+        iy, ix = self.cells_at(lon, lat)
+        return self.data[:, iy, ix].T
+
+    def cells(self, osgrid_codes):
+        """Return the (row, column) indices of the cells of many parcels"""
+        osgrid_codes = list(osgrid_codes)
+        x, y = zip(*[osgrid2lonlat(code) for code in osgrid_codes]) if osgrid_codes else ((), ())
+        lon, lat = Transformer.from_crs(27700, 4326, always_xy=True).transform(np.array(x, dtype=float),
+                                                                             np.array(y, dtype=float))
+        return self.cells_at(lon, lat)
+
+    def texture(self, osgrid_codes):
+        """
+        Return a dataframe indexed by OS grid code with the values of the soil
+        variables (e.g. sand, silt and clay) of many parcels at once.
+        """
+        osgrid_codes = list(osgrid_codes)
+        iy, ix = self.cells(osgrid_codes)
+        values = self.data[:, iy, ix].T.reshape(len(osgrid_codes), len(self.variables))
+        return pd.DataFrame(values, index=pd.Index(osgrid_codes, name="osgrid_code"), columns=self.variables)
+
+
 class SoilGridsDataProvider(SoilDataProvider):
     """
     Read soil data from netcdf file. This data provider is set to
@@ -99,44 +360,215 @@ class SoilGridsDataProvider(SoilDataProvider):
     INPUT DATA     
     :param osgrid_code: the OS Grid Code of the parcel for which soil
            soil data is required.
+    :param soil_parameters: optional soil parameters of the parcel, already
+           computed for many parcels at once (see 'from_codes')
     """
 
     # class attributes
     _SOIL_PATH   = data_dirs["soils_dir"] + "GB_soil_data.nc"
     _DATA_SOURCE = "SoilGrids\nhttps://www.isric.org/explore/soilgrids"
 
-    def __init__(self, osgrid_code):
-        super().__init__(osgrid_code)
-        soil_texture_list = self._load_soil_data(osgrid_code)
-        self.update(self._return_soildata(osgrid_code, soil_texture_list))
+    _raster = None
+    _raster_lock = threading.Lock()
+
+    @classmethod
+    def raster(cls):
+        """Return the SoilGridsRaster shared by all the providers, opening it on first use"""
+        with SoilGridsDataProvider._raster_lock:
+            if SoilGridsDataProvider._raster is None:
+                SoilGridsDataProvider._raster = SoilGridsRaster(cls._SOIL_PATH, cls._DEFAULT_SOILVARS)
+            return SoilGridsDataProvider._raster
 
-    def _load_soil_data(self, osgrid_code):
-        lon, lat = osgrid2lonlat(osgrid_code, EPSG=4326)
-        soil_array = xr.open_dataset(SoilGridsDataProvider._SOIL_PATH)
-        soil_df = soil_array.sel(x=lon, y=lat, method="nearest").to_dataframe().reset_index()[self._DEFAULT_SOILVARS]
+    @classmethod
+    def soil_texture(cls, osgrid_codes):
+        """
+        Return a dataframe indexed by OS grid code with the sand, silt and clay
+        content (%) of many parcels, looked up in one vectorized read.
+        """
+        return cls.raster().texture(osgrid_codes)
+
+    @classmethod
+    def _load_soil_textures(cls, osgrid_codes):
         # rosetta requires [%sand, %silt, %clay, bulk density, th33, th1500] in this order. Last 3 optional
-        soil_df = soil_df.iloc[0].tolist()
-        return soil_df
+        return cls.soil_texture(osgrid_codes).to_numpy(dtype=float)
+
+    @classmethod
+    def _cell_keys(cls, osgrid_codes):
+        # raster cell of each parcel, tied to the version of the SoilGrids file
+        raster = cls.raster()
+        iy, ix = raster.cells(osgrid_codes)
+        source = (raster.source["size"], raster.source["mtime_ns"])
+        return [("SoilGrids",) + source + (int(j), int(i)) for j, i in zip(iy, ix)]
+
 
 class WHSDDataProvider(SoilDataProvider):
     """
     Read soil data from the WHSD. This data is currently stored after
     processing in a postgreSQL database at a 2km spatial resolution 
-    (NEV SEER grid.)
+    (NEV SEER grid.) The data of all the cells is read once and kept in
+    memory (see cropyields.seer), hence parcels need no database query.
     
     INPUT DATA     
     :param osgrid_code: the OS Grid Code of the parcel for which soil
            soil data is required.
+    :param soil_parameters: optional soil parameters of the parcel, already
+           computed for many parcels at once (see 'from_codes')
     """
 
     # class attributes
     _DATA_SOURCE = "WHSD: https://tinyurl.com/y3b83h53"
 
-    def __init__(self, osgrid_code):
-        super().__init__(osgrid_code)
-        soil_texture_list = self._load_soil_data(osgrid_code)
-        self.update(self._return_soildata(osgrid_code, soil_texture_list))
+    @classmethod
+    def _load_soil_textures(cls, osgrid_codes):
+        return seer_soil_table().texture(osgrid_codes)
+
+    @classmethod
+    def _cell_keys(cls, osgrid_codes):
+        return [("WHSD", int(new2kid)) for new2kid in seer_soil_table().cells(osgrid_codes)]
+
+
+class SoilHydraulicRaster:
+    """
+    Soil parameters of every cell of a regular British National Grid raster,
+    precomputed from the SoilGrids file by 'build_soil_hydraulics.py' (see
+    cropyields.soil_hydraulics). The raster is stored as three files:
+        - '<base>_index.<id>.npy': int32 grid of shape (ny, nx), row 0 to the
+          south, with the row of the parameter table of each cell (0 where
+          there is no soil data);
+        - '<base>_table.<id>.npz': table of the soil parameters (SOLNAM, SMW,
+          SMFCF, SM0, K0, SMTAB, CONTAB) of the distinct soil textures, whose
+          row 0 holds no data;
+        - '<base>.json': header with the grid geometry, the identity of the
+          SoilGrids file and the names of the index and table files, which
+          have a unique id (see 'write_header_and_files').
+    The index grid is memory-mapped, hence the parameters of a parcel are read
+    from its coordinates with index arithmetic and two array lookups.
+
+    :param base_fname: name of the raster files, without suffix
+    :param soil_fname: optional name of the SoilGrids file the raster is built
+           from. If the file exists and differs from the one recorded in the
+           header (see source_identity), the raster is out of date
+    """
+
+    def __init__(self, base_fname, soil_fname=None):
+        self.soil_fname = soil_fname
+        self.header_fname = base_fname + ".json"
+        self.index_fname = base_fname + "_index.npy"
+        self.table_fname = base_fname + "_table.npz"
+        self._index = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def save(cls, base_fname, index, table, grid, source, texture_resolution):
+        """
+        Write the raster files.
+
+        :param base_fname: name of the raster files, without suffix
+        :param index: int32 array of shape (ny, nx) of rows of the table
+        :param table: dictionary of the arrays of the parameter table (see
+               SoilDataProvider.hydraulic_arrays), with no data in row 0
+        :param grid: dictionary with the south-west corner ('x0', 'y0'), the
+               'resolution' (m) and the size ('nx', 'ny') of the grid
+        :param source: identity of the SoilGrids file (see source_identity)
+        :param texture_resolution: resolution (%) of the textures of the table
+        """
+        raster = cls(base_fname)
+        header = {"format_version": HYDRAULIC_FORMAT_VERSION, "source": source, "grid": grid,
+                  "texture_resolution": texture_resolution, "n_soils": len(table["K0"]) - 1}
+        index = np.asarray(index, dtype=np.int32)
+        table = {key: np.asarray(value) for key, value in table.items()}
+        files = {"index_file": (raster.index_fname, lambda fp: np.save(fp, index)),
+                 "table_file": (raster.table_fname, lambda fp: np.savez(fp, **table))}
+        write_header_and_files(raster.header_fname, header, files)
+        return raster
+
+    def _open(self):
+        """Memory-map the index grid and load the parameter table"""
+        try:
+            with open(self.header_fname, "r") as fp:
+                header = json.load(fp)
+        except (IOError, ValueError):
+            msg = "No soil hydraulic raster at %s, run build_soil_hydraulics.py" % self.header_fname
+            raise IOError(msg)
+        if (header.get("format_version") != HYDRAULIC_FORMAT_VERSION or
+                self.soil_fname is not None and os.path.exists(self.soil_fname) and
+                header.get("source") != source_identity(self.soil_fname)):
+            msg = "Soil hydraulic raster %s is out of date, run build_soil_hydraulics.py" % self.header_fname
+            raise IOError(msg)
+        self.header = header
+        self.grid = header["grid"]
+        with np.load(data_file(self.header_fname, header, "table_file")) as f:
+            self.table = {key: f[key] for key in f.files}
+        self.table["SOLNAM"] = [name or None for name in self.table["SOLNAM"].tolist()]
+        self._index = np.load(data_file(self.header_fname, header, "index_file"), mmap_mode="r")
+
+    @property
+    def index(self):
+        """Memory-mapped index grid of shape (ny, nx)"""
+        with self._lock:
+            if self._index is None:
+                self._open()
+            return self._index
+
+    def rows(self, osgrid_codes):
+        """Return the rows of the parameter table of many parcels (0 where there is no soil data)"""
+        index = self.index
+        osgrid_codes = list(osgrid_codes)
+        x, y = zip(*[osgrid2lonlat(code) for code in osgrid_codes]) if osgrid_codes else ((), ())
+        ix = np.floor((np.array(x, dtype=float) - self.grid["x0"]) / self.grid["resolution"]).astype(int)
+        iy = np.floor((np.array(y, dtype=float) - self.grid["y0"]) / self.grid["resolution"]).astype(int)
+        inside = (ix >= 0) & (ix < self.grid["nx"]) & (iy >= 0) & (iy < self.grid["ny"])
+        rows = np.zeros(len(osgrid_codes), dtype=np.int32)
+        rows[inside] = index[iy[inside], ix[inside]]
+        return rows
+
+    def parameters(self, row):
+        """Return the soil parameters of a row of the parameter table"""
+        return {
+            "SOLNAM": self.table["SOLNAM"][row],
+            "SMTAB": self.table["SMTAB"][row].tolist(),
+            "SMW": float(self.table["SMW"][row]),
+            "SMFCF": float(self.table["SMFCF"][row]),
+            "SM0": float(self.table["SM0"][row]),
+            "CONTAB": self.table["CONTAB"][row].tolist(),
+            "K0": float(self.table["K0"][row])
+        }
+
+
+class SoilHydraulicsDataProvider(SoilDataProvider):
+    """
+    Read the soil parameters from the soil hydraulic raster precomputed from
+    the SoilGrids data by 'build_soil_hydraulics.py', with no Rosetta run at
+    simulation time. Parameters are those of the 250m BNG cell of the parcel
+    (the SoilGridsDataProvider uses the SoilGrids cell nearest to the parcel
+    instead), with the soil textures rounded to the resolution of the raster.
+
+    INPUT DATA
+    :param osgrid_code: the OS Grid Code of the parcel for which soil
+           soil data is required.
+    :param soil_parameters: optional soil parameters of the parcel, already
+           read for many parcels at once (see 'from_codes')
+    """
+
+    # class attributes
+    _RASTER_PATH = data_dirs["soils_dir"] + "GB_soil_hydraulics"
+    _DATA_SOURCE = "SoilGrids (precomputed)\nhttps://www.isric.org/explore/soilgrids"
+
+    _raster = None
+    _raster_lock = threading.Lock()
+
+    @classmethod
+    def raster(cls):
+        """Return the SoilHydraulicRaster shared by all the providers, opening it on first use"""
+        with SoilHydraulicsDataProvider._raster_lock:
+            if SoilHydraulicsDataProvider._raster is None:
+                SoilHydraulicsDataProvider._raster = SoilHydraulicRaster(cls._RASTER_PATH,
+                                                                         SoilGridsDataProvider._SOIL_PATH)
+            return SoilHydraulicsDataProvider._raster
 
-    def _load_soil_data(self, osgrid_code):
-        soil_dict = get_whsd_data(osgrid_code, self._DEFAULT_SOILVARS)
-        return [soil_dict[x] for x in soil_dict.keys()]
+    @classmethod
+    def _parcel_parameters(cls, osgrid_codes):
+        raster = cls.raster()
+        osgrid_codes = list(osgrid_codes)
+        parameters = [raster.parameters(row) for row in raster.rows(osgrid_codes)]
+        return cls._with_location(osgrid_codes, parameters)
@@ -7,18 +7,29 @@ A weather data provider reading its data from netCDF files.
 Code based on the 'excelweatherdataprovider contained in the
 fileinput of the PCSE module
 """
+import mmap
 import os
+import pickle
+import sys
+import numpy as np
 import xarray as xr
 import pandas as pd
 import datetime as dt
 from pcse.base import WeatherDataContainer, WeatherDataProvider
-from pcse.util import reference_ET, check_angstromAB
-from pcse.exceptions import PCSEError
+from pcse.util import check_angstromAB
+from pcse.exceptions import PCSEError, WeatherDataProviderError
 from pcse.db import NASAPowerWeatherDataProvider
 from pcse.settings import settings
-from cropyields import data_dirs
-from cropyields.utils import osgrid2lonlat, rh_to_vpress, sun, calc_doy, nearest, find_closest_point
+from cropyields.utils import osgrid2lonlat, rh_to_vpress_array, daylength
 from cropyields.db_manager import get_parcel_data
+from cropyields.evapotranspiration import reference_ET
+from cropyields.weather_cache import (CACHE_COLUMNS, CACHE_DTYPE, source_identity, is_cache_valid,
+                                      read_cache_header, write_pickle_cache, read_pickle_cache,
+                                      write_columnar_cache, read_columnar_cache)
+from cropyields.chess_scape import (osgrid_to_1km, osgrid_to_10km, tile_filename, read_cell,
+                                    calendar_mapping, TileBatch, CHESS_SCAPE_VARIABLES, WEATHER_VARIABLES)
+from cropyields.chess_scape_store import STORE_COLUMNS, open_store
+from cropyields.angstrom import angstrom_coefficients
 import logging
 
 # Conversion functions
@@ -29,6 +40,19 @@ W_to_J = lambda x: x*86400.
 kPa_to_hPa = lambda x: x*10.
 mm_to_cm = lambda x: x/10.
 
+# Reference ET columns, computed by the providers with the site parameters of
+# the parcel, and all the columns of the weather series of a provider
+ET_COLUMNS = ["E0", "ES0", "ET0"]
+SERIES_COLUMNS = CACHE_COLUMNS + ET_COLUMNS
+
+def _is_memory_mapped(array):
+    """Whether a NumPy array is (a view of) a memory-mapped file"""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
 # Declare NetCDFWeatherDataProvider class
 class NetCDFWeatherDataProvider(WeatherDataProvider):
     """Reading weather data from a NetCDF file (.nc).
@@ -40,6 +64,36 @@ class NetCDFWeatherDataProvider(WeatherDataProvider):
            the default value is `None`.
     :param force_update: bypass the cache file, reload data from the netcdf files and
            write a new cache file. Cache files are written under `$HOME/.pcse/meteo_cache`
+    :param tile_batch: optional TileBatch including this parcel, from which the Chess-Scape
+           data is taken instead of reading the tile for this parcel alone (see 'from_tile')
+    :param cache_format: format of the cache files, either 'pickle' (default, the PCSE
+           format) or 'columnar' (see cropyields.weather_cache). With the columnar format
+           the series is kept as memory-mapped float32 columns and WeatherDataContainers
+           are only built for the days that are requested.
+    :param backend: source of the Chess-Scape data, either 'netcdf' (default, the 10km
+           OSGB tiles, with a cache file per 1km cell) or 'store' (the national store of
+           the rcp and ensemble, see cropyields.chess_scape_store). The store is already
+           laid out for point reads, hence no cache file is written with this backend.
+    :param start_date: optional first day of the simulation window, e.g. from
+           SingleRotationAgroManager.campaign_window. Only the days between start_date and
+           end_date are kept in memory, while cache files still hold the whole series.
+    :param end_date: optional last day of the simulation window. With the columnar cache
+           format (or the store backend) the rest of the series is never read, hence
+           short runs load a small fraction of the data.
+    :param daylength_radiation: if True, the daily radiation is the Chess-Scape shortwave
+           flux over the hours of daylight (from a cached day length table, see
+           cropyields.utils.daylength) rather than over 24 hours (default False). Cache
+           files record the choice and are rebuilt when it changes.
+    :param site: optional (elevation, angstA, angstB) of the parcel (see 'site_parameters'),
+           used instead of looking them up again, e.g. by the providers of a ScenarioWeatherCube
+    :param observations: optional columns of the whole series of the cell, already converted
+           (see ScenarioWeatherCube), which are kept and written to the cache file instead of
+           reading the Chess-Scape data.
+
+    Cache files are shared by all the parcels of a 1km cell, hence they only hold the
+    weather variables of the cell. The reference ET (E0, ES0, ET0) depends on the elevation
+    and the Angstrom coefficients of the parcel and is computed by each provider, on the
+    days of the simulation window only.
 
     The NetCDFWeatherDataProvider takes care of the adjustment of solar radiation to the 
     length of the day (AAA: need to verify that the solar radiation data passed to
@@ -56,36 +110,61 @@ class NetCDFWeatherDataProvider(WeatherDataProvider):
         "RAIN": mm_to_cm,
         "SNOWDEPTH": NoConversion
     }
+    cache_format = "pickle"
+    backend = "netcdf"
+    daylength_radiation = False
 
-    def __init__(self, osgrid_code, rcp, ensemble, missing_snow_depth=None, nodata_value = -999, force_update=False):
+    # Series of the columnar cache, from which WeatherDataContainers are built on request
+    _days = None
+    _columns = None
+
+    def __init__(self, osgrid_code, rcp, ensemble, missing_snow_depth=None, nodata_value = -999, force_update=False,
+                 tile_batch=None, cache_format=None, backend=None, start_date=None, end_date=None,
+                 daylength_radiation=None, site=None, observations=None):
         WeatherDataProvider.__init__(self)
 
-        os_digits = [int(s) for s in osgrid_code if s.isdigit()]
-        os_digits_1k = os_digits[0:2] + os_digits[int(len(os_digits)/2):int(len(os_digits)/2+2)]
-        os_digits_10k = os_digits[0:1] + os_digits[int(len(os_digits)/2):int(len(os_digits)/2+1)]
-        os_digits_1k = ''.join(str(s) for s in os_digits_1k)
-        os_digits_10k = ''.join(str(s) for s in os_digits_10k)
-        self.osgrid_1km = osgrid_code[0:2].upper() + os_digits_1k
-        self.osgrid_10km = osgrid_code[0:2].upper() + os_digits_10k
-        self.nc_fname = os.path.abspath(data_dirs['OSGB_dir']+f'{self.osgrid_10km.upper()}_{rcp}_{ensemble:02d}.nc')
+        self.cache_format = cache_format or self.cache_format
+        if self.cache_format not in ("pickle", "columnar"):
+            msg = "Unknown cache format '%s', use 'pickle' or 'columnar'" % self.cache_format
+            raise PCSEError(msg)
+        self.backend = backend or self.backend
+        if self.backend not in ("netcdf", "store"):
+            msg = "Unknown backend '%s', use 'netcdf' or 'store'" % self.backend
+            raise PCSEError(msg)
+        if daylength_radiation is not None:
+            self.daylength_radiation = daylength_radiation
+
+        self.start_date = None if start_date is None else self.check_keydate(start_date)
+        self.end_date = None if end_date is None else self.check_keydate(end_date)
+
+        self.osgrid_code = osgrid_code
+        self.tile_batch = tile_batch
+        self.osgrid_1km = osgrid_to_1km(osgrid_code)
+        self.osgrid_10km = osgrid_to_10km(osgrid_code)
+        self.nc_fname = tile_filename(self.osgrid_10km, rcp, ensemble)
         self.rcp, self.ensemble = rcp, ensemble
         self.missing_snow_depth = missing_snow_depth
         self.nodata_value = nodata_value
-        self.cache_fname = f'{self.osgrid_1km}_{self.rcp}_{self.ensemble:02d}'
-        if not os.path.exists(self.nc_fname):
+        self.cache_fname = self._cell_cache_fname(self.osgrid_1km, rcp, ensemble)
+        if self.backend == "netcdf" and not os.path.exists(self.nc_fname):
             msg = "Cannot find weather file at: %s" % self.nc_fname
             raise PCSEError(msg)
 
         self.longitude, self.latitude = osgrid2lonlat(self.osgrid_1km, EPSG=4326)
 
-        # Retrieve altitude
-        self.elevation = get_parcel_data(osgrid_code, ['elevation'])['elevation']
-
-        # Retrieve Angstrom coefficients A and B
-        w = pd.read_csv(data_dirs['utils_dir'] + 'angst_coefficients.csv').set_index('parcel')
-        self.angstA, self.angstB = w.loc[osgrid_code]['angstA'], w.loc[osgrid_code]['angstB']
+        # Retrieve altitude and Angstrom coefficients A and B
+        self.elevation, self.angstA, self.angstB = site or self.site_parameters(osgrid_code)
         self.has_sunshine = False # data has radiation values, not sunshine hours
 
+        if observations is not None:
+            self._keep_observations(observations)
+            self._write_cache(observations)
+            return
+
+        if self.backend == "store":
+            self._read_from_store()
+            return
+
         # Check for existence of a cache file
         cache_file = self._find_cache_file(self.cache_fname)
         if cache_file is None or force_update is True:
@@ -95,12 +174,10 @@ class NetCDFWeatherDataProvider(WeatherDataProvider):
             self._get_and_process_ChessScape()
             return
 
-        # get age of cache file, if age < 90 days then try to load it. If loading fails retrieve data
-        # from the Chess-Scape nc files.
-        r = os.stat(cache_file)
-        cache_file_date = dt.date.fromtimestamp(r.st_mtime)
-        age = (dt.date.today() - cache_file_date).days
-        if age < 90:
+        # The cache file is valid if it was written with the current cache format from the
+        # same Chess-Scape file (same name, size and modification time), whatever its age.
+        # If loading fails retrieve data from the Chess-Scape nc files.
+        if self._is_cache_file_valid(cache_file):
             msg = "Start loading weather data from cache file: %s" % cache_file
             self.logger.debug(msg)
 
@@ -111,9 +188,9 @@ class NetCDFWeatherDataProvider(WeatherDataProvider):
                 # Loading cache file failed!
                 self._get_and_process_ChessScape()
         else:
-            # Cache file is too old. Try loading new data from ChessScape
+            # Chess-Scape file or cache format changed. Try loading new data from ChessScape
             try:
-                msg = "Cache file older then 90 days, reloading from Chess-Scape nc files."
+                msg = "Cache file built from a different Chess-Scape file or cache format, reloading."
                 self.logger.debug(msg)
                 self._get_and_process_ChessScape()
             except Exception as e:
@@ -138,113 +215,377 @@ class NetCDFWeatherDataProvider(WeatherDataProvider):
                             u"Source: %s" % src,
                             u"Contact: %s" % contact]
     
+    @staticmethod
+    def site_parameters(osgrid_code):
+        """Return the (elevation, angstA, angstB) of a parcel, from the database
+        and the Angstrom coefficients table.
+        """
+        elevation = get_parcel_data(osgrid_code, ['elevation'])['elevation']
+        try:
+            angstA, angstB = angstrom_coefficients(osgrid_code)
+        except KeyError as e:
+            raise PCSEError(e.args[0])
+        return elevation, angstA, angstB
+
+    @classmethod
+    def from_tile(cls, osgrid_codes, rcp, ensemble, **kwargs):
+        """Build the weather providers of many parcels in the same 10km tile.
+
+        The Chess-Scape data of all the parcels that are not loaded from a cache
+        file is extracted with a single read of the tile (see TileBatch).
+        Returns a dictionary of providers keyed by OS grid code. Additional
+        keyword arguments are passed to each provider.
+        """
+        tile_batch = TileBatch(osgrid_codes, rcp, ensemble)
+        return {code: cls(code, rcp, ensemble, tile_batch=tile_batch, **kwargs)
+                for code in osgrid_codes}
+
     def _get_and_process_ChessScape(self):
 
-        # Initial preparation of weather data
-        x, y = osgrid2lonlat(self.osgrid_1km)
-        os_array = xr.open_dataset(self.nc_fname)
-
-        os_dataframe = os_array.sel(x=x, y=y, method="nearest").to_dataframe().reset_index()
-        # There is  a posibility that the assignment of weather data to parcels  near the coastline 
-        # could result in empty data (nan). This is because the .sel("closest") method in xarray is 
-        # based on the x-y coordinates, regardless of whether the arrays at those coordinates are 
-        # empty or not. Deal with this selecting the closest non-null cell. (Euclidean distance)
-        if os_dataframe.isnull().any().any():
-            os_array.sel(x=x, y=y, method="nearest").to_dataframe().reset_index()
-            os_dataframe = os_array.where((os_array.x >= x-10000) & 
-                                          (os_array.x < x+10000) &
-                                          (os_array.y >= y-10000) &
-                                          (os_array.y < y+10000), drop=True).to_dataframe().reset_index()
-            os_dataframe = os_dataframe.dropna()
-            unique_combinations = os_dataframe[['y', 'x']].drop_duplicates().to_dict(orient='records') 
-            closest = find_closest_point(unique_combinations, x, y)
-            os_dataframe = os_dataframe[(os_dataframe['x'] == closest['x']) & (os_dataframe['y'] == closest['y'])]
-        # rh to vapour pressure in hPa
-        vap = [rh_to_vpress(x, y) for x, y in zip(os_dataframe['hurs'], os_dataframe['tas'] - 273.15)]
-        # remove unnecesary columns and rename the remaining ones
-        os_dataframe = os_dataframe[os_dataframe.columns.drop(['lat', 'lon', 'x', 'y', 'tas', 'rds', 'rlds', 'hurs'])]
-        # os_dataframe = os_dataframe[os_dataframe.columns.drop(['lat', 'lon', 'x', 'y', 'tas', 'rlds', 'rsds', 'hurs'])]
-        os_dataframe.columns = ['DAY', 'TMAX', 'TMIN', 'RAIN', 'IRRAD', 'WIND']
-        # os_dataframe.columns = ['DAY', 'TMAX', 'TMIN', 'RAIN', 'WIND', 'IRRAD']
-        os_dataframe['SNOWDEPTH'] = -999
-        os_dataframe['VAP'] = vap
+        # Initial preparation of weather data (see chess_scape.read_cell for the cells
+        # with no data near the coastline)
+        os_dataframe = read_cell(self.osgrid_code, self.rcp, self.ensemble, self.tile_batch)
 
         # chess-scape data is based on 360 day years, which breaks Wofost. 
-        # Convert to datetime and interpolate missing data
-        os_dataframe['DAY'] = [calc_doy(x) for x in os_dataframe['DAY']]
-        os_dataframe.set_index(['DAY'], inplace=True)   
-        date_rng = pd.date_range(os_dataframe.index[0], os_dataframe.index[-1], freq='D')
-        date_rng = [x.date() for x in date_rng]
-        missing_days = list(set(date_rng).difference(os_dataframe.index))
-        for day in missing_days:
-            nearest_day = nearest(day, os_dataframe.index)
-            nearest_vals = os_dataframe.loc[nearest_day,:].to_frame().transpose().reset_index()
-            nearest_vals['index'] = day
-            nearest_vals.set_index('index', inplace=True)
-            nearest_vals.index.rename('DAY', inplace=True)
-            os_dataframe = pd.concat([os_dataframe, nearest_vals])
-        
-        os_dataframe.sort_index(ascending=True, inplace=True)
+        # Convert to datetime and fill the missing days with the nearest available day
+        first_day, take = calendar_mapping(os_dataframe['time'].to_numpy())
+        days = first_day + np.arange(len(take))
+        values = {var: os_dataframe[var].to_numpy(dtype=float)[take] for var in WEATHER_VARIABLES}
+        raw = self._chess_scape_columns(values, days, self.latitude, self.daylength_radiation)
+        obs = self._read_observations(days, raw)
+        self._write_cache(obs)
+
+    @classmethod
+    def _chess_scape_columns(cls, values, days, latitude, daylength_radiation):
+        """Return the columns of the WOFOST weather variables, before the unit
+        conversions, from the Chess-Scape variables of a cell. Arrays have one
+        row per day and, optionally, further dimensions (e.g. one column per
+        scenario, see ScenarioWeatherCube).
+
+        :param values: dictionary of arrays of the Chess-Scape WEATHER_VARIABLES,
+               already mapped to the Gregorian 'days' (see calendar_mapping)
+        :param days: datetime64[D] array of the days
+        :param latitude: latitude of the cell, for the day length
+        :param daylength_radiation: adjust the radiation to the day length
+        """
+        # keep and rename the columns needed by WOFOST
+        raw = {label: values[var] for var, label in CHESS_SCAPE_VARIABLES.items()}
+        raw["SNOWDEPTH"] = np.full(np.shape(raw["TMAX"]), -999.)
+        # rh to vapour pressure in hPa
+        raw["VAP"] = rh_to_vpress_array(values['hurs'], values['tas'] - 273.15)
 
         # adjust irradiation for lenght of the day
-        daylength = sun(lat=self.latitude, long=self.longitude)
-        # os_dataframe['IRRAD'] = os_dataframe['IRRAD'] * [daylength.daylength(day)*3600 for day in os_dataframe.index]
-        os_dataframe['IRRAD'] = os_dataframe['IRRAD'] * 3600*24
-        self._read_observations(os_dataframe)
+        if daylength_radiation:
+            hours = daylength(days, latitude)
+            raw["IRRAD"] = raw["IRRAD"] * hours.reshape(hours.shape + (1,)*(raw["IRRAD"].ndim - 1))*3600
+        else:
+            raw["IRRAD"] = raw["IRRAD"] * 3600*24
+        return raw
 
-        # dump contents to a cache file
+    def _write_cache(self, obs):
+        """Dump the columns of the whole series, except the reference ET, to the cache file"""
         cache_filename = self._get_cache_filename(self.cache_fname)
-        self._dump(cache_filename)
+        if self.cache_format == "columnar":
+            header = {"source": source_identity(self.nc_fname), "longitude": self.longitude,
+                      "latitude": self.latitude, "description": self.description,
+                      "daylength_radiation": self.daylength_radiation}
+            write_columnar_cache(cache_filename, obs, header)
+        else:
+            self._dump(cache_filename, obs)
 
 
-    def _read_observations(self, os_dataframe):
-        df = os_dataframe.reset_index()
+    def _read_from_store(self):
+        """Read the series of the 1km cell from the national Chess-Scape store,
+        and compute the reference ET of the parcel on the simulation window.
+        """
+        try:
+            store = open_store(self.rcp, self.ensemble)
+            columns = store.read_cell(*osgrid2lonlat(self.osgrid_1km))
+        except (IOError, ValueError, KeyError) as e:
+            msg = "Cannot read the national Chess-Scape store of %s, ensemble %s: %s" % (self.rcp, self.ensemble, e)
+            raise PCSEError(msg)
 
-        # First get the column labels
-        labels = list(df.columns)
+        # the reference ET is only computed on the simulation window
+        rows = self._window_slice(columns["DAY"])
+        obs = {label: columns[label][rows] for label in STORE_COLUMNS}
+        obs["DAY"] = columns["DAY"][rows]
+        # days with missing values are NaN in the store and are skipped, as
+        # by '_observations_to_arrays'
+        valid = np.all([np.isfinite(obs[label]) for label in STORE_COLUMNS], axis=0)
+        if not valid.all():
+            obs = {label: values[valid] for label, values in obs.items()}
+        fill = np.nan if self.missing_snow_depth is None else self.missing_snow_depth
+        obs["SNOWDEPTH"] = np.full(len(obs["DAY"]), fill)
+        if self.daylength_radiation:
+            # the store holds the radiation over 24 hours
+            obs["IRRAD"] = obs["IRRAD"] * daylength(obs["DAY"], self.latitude)/24.
+        self._add_reference_ET(obs)
+
+        if self.cache_format == "columnar":
+            self._set_columns(obs)
+        else:
+            obs["DAY"] = obs["DAY"].astype(dt.date).tolist()
+            self._store_observations(obs)
+
+    def _read_observations(self, days, raw):
+        obs = self._observations_to_arrays(days, raw)
+        self._keep_observations(obs)
+        return obs
+
+    def _keep_observations(self, obs):
+        """Keep the columns of the simulation window of the whole series 'obs' (as
+        written to the cache files), with the reference ET of the parcel, either as
+        containers or, with the columnar cache format, as columns.
+        """
+        days = np.asarray(obs["DAY"], dtype="datetime64[D]")
+        rows = self._window_slice(days)
+        if self.cache_format == "columnar":
+            # same float32 values as those that are read back from the cache; memory-mapped
+            # columns are sliced, not loaded
+            window = {label: np.asarray(obs[label], dtype=CACHE_DTYPE)[rows] for label in CACHE_COLUMNS}
+        else:
+            window = {label: np.asarray(obs[label])[rows] for label in CACHE_COLUMNS}
+        window["DAY"] = days[rows]
+        self._add_reference_ET(window)
+        if self.cache_format == "columnar":
+            self._set_columns(window)
+        else:
+            self._store_observations(window)
 
-        # Start reading all rows with data
-        # rownums = list(range(sheet.nrows))
-        for row in range(len(df)):
-            try:
-                d = {}
-                for label in labels:
-                    if label == "DAY":
-                        if df.iloc[row,:][label] is None:
-                            raise ValueError
-                        else:
-                            doy = df.iloc[row,:][label]
-                            d[label] = doy
-                            continue
-
-                    # explicitly convert to float. If this fails a ValueError will be thrown
-                    value = df.iloc[row,:][label]
-
-                    # Check for observations marked as missing. Currently only missing
-                    # data is allowed for SNOWDEPTH. Otherwise raise an error
-                    if self._is_missing_value(value):
-                        if label == "SNOWDEPTH":
-                            value = self.missing_snow_depth
-                        else:
-                            raise ValueError()
-
-                    func = self.obs_conversions[label]
-                    d[label] = func(value)
-
-                # Reference ET in mm/day
-                e0, es0, et0 = reference_ET(LAT=self.latitude, ELEV=self.elevation, ANGSTA=self.angstA,
-                                            ANGSTB=self.angstB, **d)
-                # convert to cm/day
-                d["E0"] = e0/10.; d["ES0"] = es0/10.; d["ET0"] = et0/10.
-
-                wdc = WeatherDataContainer(LAT=self.latitude, LON=self.longitude, ELEV=self.elevation, **d)
-                self._store_WeatherDataContainer(wdc, d["DAY"])
-
-            except ValueError as e:  # strange value in cell
-                msg = "Failed reading row: %i. Skipping..." % (row)
-                self.logger.warn(msg)
-                print(msg)
+    def _observations_to_arrays(self, days, raw):
+        """Convert the columns returned by '_chess_scape_columns' into a dictionary
+        of columns (one NumPy array per weather variable, plus 'DAY').
+
+        Unit conversion, the check for missing values and the substitution of
+        missing SNOWDEPTH values are carried out on whole columns (see
+        '_convert_columns'). Rows with missing values in any variable other
+        than SNOWDEPTH are dropped.
+        """
+        obs, valid = self._convert_columns(raw, self.nodata_value, self.missing_snow_depth)
+        days = np.asarray(days, dtype="datetime64[D]")
+        if not valid.all():
+            skipped = days[~valid]
+            msg = "Skipping %i days with missing values between %s and %s in %s" % (
+                len(skipped), skipped[0], skipped[-1], self.nc_fname)
+            self.logger.warning(msg)
 
+        obs = {label: values[valid] for label, values in obs.items()}
+        obs["DAY"] = days[valid].astype(dt.date).tolist()
+        return obs
+
+    @classmethod
+    def _convert_columns(cls, raw, nodata_value, missing_snow_depth):
+        """Convert the columns returned by '_chess_scape_columns' to the WOFOST
+        units (see 'obs_conversions'). Returns the converted columns and a
+        boolean array, of the shape of the columns, of the values with no
+        missing variable other than SNOWDEPTH.
+        """
+        valid = np.ones(np.shape(raw["TMAX"]), dtype=bool)
+        obs = {}
+        for label, func in cls.obs_conversions.items():
+            values = np.asarray(raw[label], dtype=float)
+            missing = cls._is_nodata(values, nodata_value)
+            if label == "SNOWDEPTH":
+                # Missing SNOWDEPTH is replaced by 'missing_snow_depth'. NaN stands
+                # for None, in which case SNOWDEPTH is not set on the container
+                fill = np.nan if missing_snow_depth is None else missing_snow_depth
+                values = np.where(missing, fill, values)
+            else:
+                valid &= ~missing
+            obs[label] = func(values)
+        return obs, valid
+
+    def _add_reference_ET(self, obs):
+        """Add E0, ES0 and ET0 (cm/day), with the site parameters of the parcel,
+        to columns of weather variables in WOFOST units.
+        """
+        self._reference_ET_columns(obs, self.latitude, (self.elevation, self.angstA, self.angstB))
+
+    @classmethod
+    def _reference_ET_columns(cls, obs, latitude, site):
+        """Add E0, ES0 and ET0 (cm/day) to columns of weather variables in WOFOST
+        units, with 'DAY' broadcastable to the other columns.
+
+        :param obs: dictionary of the columns
+        :param latitude: latitude of the cell
+        :param site: (elevation, angstA, angstB) of the parcel
+        """
+        elevation, angstA, angstB = site
+        inputs = {label: np.asarray(obs[label], dtype=float) for label in ("TMAX", "TMIN", "IRRAD", "VAP", "WIND")}
+        # Reference ET in mm/day
+        e0, es0, et0 = reference_ET(DAY=obs["DAY"], LAT=latitude, ELEV=elevation, ANGSTA=angstA, ANGSTB=angstB,
+                                    ETMODEL=cls.ETmodel, **inputs)
+        # convert to cm/day
+        obs["E0"] = e0/10.; obs["ES0"] = es0/10.; obs["ET0"] = et0/10.
+
+    def _has_window(self):
+        return self.start_date is not None or self.end_date is not None
+
+    def _window_slice(self, days):
+        """Slice of the sorted datetime64[D] array 'days' within the
+        simulation window (all the days if there is no window).
+        """
+        lo, hi = 0, len(days)
+        if self.start_date is not None:
+            lo = np.searchsorted(days, np.datetime64(self.start_date, "D"), side="left")
+        if self.end_date is not None:
+            hi = np.searchsorted(days, np.datetime64(self.end_date, "D"), side="right")
+        return slice(lo, hi)
+
+    def _containers(self, obs, rows=slice(None)):
+        """Yield (day, WeatherDataContainer) for the 'rows' of the columns
+        returned by '_observations_to_arrays' and '_add_reference_ET'.
+        """
+        labels = [label for label in obs if label != "DAY"]
+        columns = [np.asarray(obs[label])[rows].tolist() for label in labels]
+        days = np.asarray(obs["DAY"], dtype="datetime64[D]")[rows].astype(dt.date).tolist()
+        for i, day in enumerate(days):
+            d = {label: column[i] for label, column in zip(labels, columns)}
+            yield day, self._make_container(day, d)
+
+    def _store_observations(self, obs):
+        """Store one WeatherDataContainer per day of the simulation window
+        from the columns returned by '_observations_to_arrays' and '_add_reference_ET'.
+        """
+        rows = self._window_slice(np.asarray(obs["DAY"], dtype="datetime64[D]"))
+        for day, wdc in self._containers(obs, rows):
+            self._store_WeatherDataContainer(wdc, day)
+
+    def _make_container(self, day, d):
+        """Build the WeatherDataContainer of a single day from a dictionary
+        of weather variables.
+        """
+        if d["SNOWDEPTH"] != d["SNOWDEPTH"]: # NaN, no value for missing snow depth
+            d["SNOWDEPTH"] = None
+        return WeatherDataContainer(LAT=self.latitude, LON=self.longitude, ELEV=self.elevation,
+                                    DAY=day, **d)
+
+    def _store_day(self, day, d):
+        """Build and store the WeatherDataContainer of a single day from
+        a dictionary of weather variables.
+        """
+        wdc = self._make_container(day, d)
+        self._store_WeatherDataContainer(wdc, day)
+        return wdc
+
+    def _set_columns(self, columns):
+        """Keep the weather series of the simulation window as columns (e.g.
+        memory-mapped from a columnar cache file); containers are built by
+        '__call__' on request.
+        """
+        days = np.asarray(columns["DAY"], dtype="datetime64[D]")
+        rows = self._window_slice(days)
+        self._days = days[rows]
+        self._columns = {label: np.asarray(columns[label], dtype=CACHE_DTYPE)[rows] for label in SERIES_COLUMNS}
+
+    def _store_column_day(self, keydate):
+        """Build the WeatherDataContainer of 'keydate' from the columns.
+        Returns None if there is no data for that day.
+        """
+        day = np.datetime64(keydate, "D")
+        i = np.searchsorted(self._days, day)
+        if i == len(self._days) or self._days[i] != day:
+            return None
+        d = {label: float(self._columns[label][i]) for label in SERIES_COLUMNS}
+        return self._store_day(keydate, d)
+
+    def __call__(self, day, member_id=0):
+        if self._days is not None:
+            keydate = self.check_keydate(day)
+            if (keydate, member_id) not in self.store:
+                self._store_column_day(keydate)
+        return WeatherDataProvider.__call__(self, day, member_id)
+
+    def _materialise(self):
+        """Build the containers of all the days held in columns"""
+        if self._days is not None:
+            for day in self._days.astype(dt.date):
+                if (day, 0) not in self.store:
+                    self._store_column_day(day)
+
+    def _is_empty(self):
+        """True if there is no weather data in the simulation window"""
+        return len(self.store) == 0 if self._days is None else len(self._days) == 0
+
+    def _check_not_empty(self):
+        """Raise WeatherDataProviderError if there is no weather data in the simulation window"""
+        if self._is_empty():
+            msg = "No weather data for OS tile '%s', %s and ensemble %s in the simulation window." % (
+                self.osgrid_1km, self.rcp, self.ensemble)
+            raise WeatherDataProviderError(msg)
+
+    @property
+    def first_date(self):
+        self._check_not_empty()
+        if self._days is None:
+            return WeatherDataProvider.first_date.fget(self)
+        return self._days[0].astype(dt.date)
+
+    @property
+    def last_date(self):
+        self._check_not_empty()
+        if self._days is None:
+            return WeatherDataProvider.last_date.fget(self)
+        return self._days[-1].astype(dt.date)
+
+    @property
+    def missing(self):
+        if self._is_empty():
+            return 0
+        if self._days is None:
+            return WeatherDataProvider.missing.fget(self)
+        return (self.last_date - self.first_date).days - len(self._days) + 1
+
+    @property
+    def missing_days(self):
+        if self._is_empty():
+            return []
+        self._materialise()
+        return WeatherDataProvider.missing_days.fget(self)
+
+    def export(self):
+        self._materialise()
+        return WeatherDataProvider.export(self)
+
+    def columns(self):
+        """Return the series of the simulation window as a dictionary with the
+        'DAY' datetime64[D] array and one float32 array per weather variable (see
+        SERIES_COLUMNS), taken from the columns or, if the series is held as
+        WeatherDataContainers, built from them. Missing SNOWDEPTH values are NaN.
+        """
+        if self._days is not None:
+            return dict(self._columns, DAY=self._days)
+        days = sorted(day for day, member_id in self.store if member_id == 0)
+        containers = [self.store[(day, 0)] for day in days]
+        columns = {}
+        for label in SERIES_COLUMNS:
+            values = [getattr(wdc, label, None) for wdc in containers]
+            columns[label] = np.array([np.nan if v is None else v for v in values], dtype=CACHE_DTYPE)
+        columns["DAY"] = np.array(days, dtype="datetime64[D]")
+        return columns
+
+    def memory_usage(self):
+        """Report the memory (bytes) held by the weather series of the provider:
+        the WeatherDataContainers in the store (objects, attribute dictionaries,
+        values and keys) and the columns, if any. Memory-mapped columns are
+        reported as 'mapped', as they only take memory when read.
+        """
+        containers = 0
+        for key, wdc in self.store.items():
+            containers += sys.getsizeof(key) + sys.getsizeof(wdc)
+            values = [getattr(wdc, slot) for slot in wdc.__slots__ if hasattr(wdc, slot)]
+            if hasattr(wdc, "__dict__"):
+                containers += sys.getsizeof(wdc.__dict__)
+                values += list(wdc.__dict__.values())
+            containers += sum(sys.getsizeof(value) for value in values)
+        columns = mapped = 0
+        if self._days is not None:
+            arrays = [self._days] + list(self._columns.values())
+            mapped = sum(a.nbytes for a in arrays if _is_memory_mapped(a))
+            columns = sum(a.nbytes for a in arrays) - mapped
+        return {"n_days": len(self.store) if self._days is None else len(self._days),
+                "containers": containers, "columns": columns, "mapped": mapped,
+                "total": containers + columns}
 
     def _find_cache_file(self, cache_fname):
         """Try to find a cache file for given latitude/longitude.
@@ -263,33 +604,390 @@ class NetCDFWeatherDataProvider(WeatherDataProvider):
 
         The file name is constructed combining the class name, the OS 1km tile
         code, the rcp code and the ensemble 
-        (i.e.: NetCDFWeatherDataProvider_SX7347_rcp26_01.cache)
+        (i.e.: NetCDFWeatherDataProvider_SX7347_rcp26_01.cache). With the columnar
+        cache format this is the name of the '.json' header file.
         """
-        fname = "%s_%s.cache" % (self.__class__.__name__, cache_fname)
+        return self._cache_filename(cache_fname, self.cache_format)
+
+    @classmethod
+    def _cache_filename(cls, cache_fname, cache_format):
+        extension = "json" if cache_format == "columnar" else "cache"
+        # subclasses share the cache files of NetCDFWeatherDataProvider
+        fname = "%s_%s.%s" % (NetCDFWeatherDataProvider.__name__, cache_fname, extension)
         cache_filename = os.path.join(settings.METEO_CACHE_DIR, fname)
         return cache_filename
 
+    @staticmethod
+    def _cell_cache_fname(osgrid_1km, rcp, ensemble):
+        return f'{osgrid_1km}_{rcp}_{ensemble:02d}'
+
+    @classmethod
+    def has_valid_cache(cls, osgrid_code, rcp, ensemble, cache_format=None, daylength_radiation=None):
+        """Check, without building the provider, whether the 1km cell of 'osgrid_code'
+        has a valid cache file for the given rcp and ensemble.
+        """
+        cache_format = cache_format or cls.cache_format
+        if daylength_radiation is None:
+            daylength_radiation = cls.daylength_radiation
+        cache_fname = cls._cell_cache_fname(osgrid_to_1km(osgrid_code), rcp, ensemble)
+        cache_file = cls._cache_filename(cache_fname, cache_format)
+        try:
+            header = read_cache_header(cache_file, cache_format)
+        except (IOError, EnvironmentError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+        return (is_cache_valid(header, tile_filename(osgrid_to_10km(osgrid_code), rcp, ensemble)) and
+                header.get("daylength_radiation", False) == daylength_radiation)
+
+    def _dump(self, cache_fname, obs):
+        """Dumps the whole weather series into cache_fname using pickle, preceded
+        by a header with the identity of the Chess-Scape file (see
+        cropyields.weather_cache). The series is stored as the columns returned by
+        '_observations_to_arrays' (CACHE_COLUMNS) rather than as WeatherDataContainers,
+        which are only built on loading for the days of the simulation window.
+        """
+        header = {"source": source_identity(self.nc_fname), "daylength_radiation": self.daylength_radiation}
+        columns = {label: np.asarray(obs[label]) for label in CACHE_COLUMNS}
+        columns["DAY"] = np.asarray(obs["DAY"], dtype="datetime64[D]")
+        payload = (columns, self.longitude, self.latitude, self.description)
+        write_pickle_cache(cache_fname, header, payload)
+
+    def _load(self, cache_fname):
+        """Loads the contents of a pickle cache file written by '_dump'
+        """
+        header, payload = read_pickle_cache(cache_fname)
+        (columns, self.longitude, self.latitude, self.description) = payload
+        self._keep_observations(columns)
+
+    def _is_cache_file_valid(self, cache_file):
+        """Check the header of the cache file against the current Chess-Scape file,
+        cache format version and radiation adjustment. Returns True|False
+        """
+        try:
+            header = read_cache_header(cache_file, self.cache_format)
+        except (IOError, EnvironmentError, EOFError, ValueError, pickle.UnpicklingError) as e:
+            msg = "Failed to read the header of cache file '%s' due to: %s" % (cache_file, e)
+            self.logger.debug(msg)
+            return False
+        return (is_cache_valid(header, self.nc_fname) and
+                header.get("daylength_radiation", False) == self.daylength_radiation)
+
     def _load_cache_file(self, cache_fname):
         """Loads the data from the cache file. Return True if successful.
         """
         cache_filename = self._get_cache_filename(cache_fname)
         try:
-            self._load(cache_filename)
+            if self.cache_format == "columnar":
+                self._load_columnar(cache_filename)
+            else:
+                self._load(cache_filename)
             msg = "Cache file successfully loaded."
             self.logger.debug(msg)
             return True
-        except (IOError, EnvironmentError, EOFError) as e:
+        except (IOError, EnvironmentError, EOFError, ValueError, KeyError, pickle.UnpicklingError) as e:
             msg = "Failed to load cache from file '%s' due to: %s" % (cache_filename, e)
             self.logger.warning(msg)
             return False
 
+    def _load_columnar(self, cache_filename):
+        """Loads the contents of a columnar cache file, memory-mapping the columns.
+        """
+        header, columns = read_columnar_cache(cache_filename)
+        self.longitude, self.latitude = header["longitude"], header["latitude"]
+        self.description = header["description"]
+        self._keep_observations(columns)
+
     def _is_missing_value(self, value):
         """Checks if value is equal to the value specified for missing date
         :return: True|False
+        Works on single values as well as on whole NumPy arrays, in which
+        case a boolean array is returned.
         """
+        return self._is_nodata(value, self.nodata_value)
+
+    @staticmethod
+    def _is_nodata(value, nodata_value):
+        """Checks if value is equal to 'nodata_value' (see '_is_missing_value')"""
         eps = 0.0001
-        if abs(value - self.nodata_value) < eps:
-            return True
-        else:
-            return False
+        return np.abs(value - nodata_value) < eps
+
+
+
+class DailyWeather:
+    """Weather of a single day, as returned by ArrayWeatherDataProvider.
+
+    A lightweight replacement of the PCSE WeatherDataContainer with the same
+    attributes, held in __slots__ only (no attribute dictionary) and with no
+    range checks, as these are carried out once on the whole series. It also
+    has slots for the variables added by the PCSE engine (e.g. DTEMP).
+    """
+    sitevar = WeatherDataContainer.sitevar
+    required = WeatherDataContainer.required
+    optional = WeatherDataContainer.optional
+    units = WeatherDataContainer.units
+    __slots__ = sitevar + required + optional + ["DAY", "DTEMP"]
+
+    def __init__(self, DAY, **kwargs):
+        self.DAY = DAY
+        for varname, value in kwargs.items():
+            setattr(self, varname, value)
+
+    def add_variable(self, varname, value, unit):
+        """Adds an attribute <varname> with <value> (see WeatherDataContainer)"""
+        setattr(self, varname, value)
+
+    def __str__(self):
+        return WeatherDataContainer.__str__(self)
+
+
+class ArrayWeatherDataProvider(NetCDFWeatherDataProvider):
+    """NetCDFWeatherDataProvider keeping the weather series in contiguous
+    float32 arrays (one per weather variable, indexed by the offset of the day
+    from the first day of the series) rather than one WeatherDataContainer per
+    day. A DailyWeather is built each time WOFOST asks for a day and is not
+    kept, hence memory use does not grow during a simulation.
+
+    It takes the same parameters as NetCDFWeatherDataProvider, and works with
+    all cache formats and backends; the columnar cache format avoids loading
+    the series in memory altogether. See 'memory_usage' to size worker pools.
+    """
+
+    def _store_observations(self, obs):
+        self._set_columns(obs)
+
+    def _set_columns(self, columns):
+        NetCDFWeatherDataProvider._set_columns(self, columns)
+        self._check_ranges()
 
+    def _check_ranges(self):
+        """Range checks of the PCSE WeatherDataContainer on the whole series"""
+        if not settings.METEO_RANGE_CHECKS:
+            return
+        for label, values in self._columns.items():
+            if label not in WeatherDataContainer.ranges:
+                continue
+            vmin, vmax = WeatherDataContainer.ranges[label]
+            outside = ~((values >= vmin) & (values <= vmax))
+            if label == "SNOWDEPTH":
+                outside &= ~np.isnan(values)
+            if outside.any():
+                i = np.flatnonzero(outside)[0]
+                msg = "Value (%s) for meteo variable '%s' outside allowed range (%s, %s) on %s." % (
+                    values[i], label, vmin, vmax, self._days[i])
+                raise PCSEError(msg)
+
+    def _day_index(self, keydate):
+        """Position of 'keydate' in the series, or None if there is no data"""
+        day = np.datetime64(keydate, "D")
+        if len(self._days) == 0:
+            return None
+        i = int((day - self._days[0]).astype(int))
+        if not (0 <= i < len(self._days) and self._days[i] == day):
+            # days missing from the series
+            i = int(np.searchsorted(self._days, day))
+            if i == len(self._days) or self._days[i] != day:
+                return None
+        return i
+
+    def __call__(self, day, member_id=0):
+        if member_id != 0:
+            msg = "Retrieving ensemble weather is not supported by %s" % self.__class__.__name__
+            raise WeatherDataProviderError(msg)
+        keydate = self.check_keydate(day)
+        i = self._day_index(keydate)
+        if i is None:
+            msg = "No weather data for %s." % keydate
+            raise WeatherDataProviderError(msg)
+        d = {label: float(self._columns[label][i]) for label in SERIES_COLUMNS}
+        if d["SNOWDEPTH"] != d["SNOWDEPTH"]: # NaN, no value for missing snow depth
+            del d["SNOWDEPTH"]
+        return DailyWeather(DAY=keydate, LAT=self.latitude, LON=self.longitude, ELEV=self.elevation, **d)
+
+    @property
+    def missing_days(self):
+        if self._is_empty():
+            return []
+        all_days = np.arange(self._days[0], self._days[-1] + 1)
+        return sorted(np.setdiff1d(all_days, self._days).astype(dt.date).tolist())
+
+    def export(self):
+        weather_data = []
+        for day in self._days.astype(dt.date):
+            wdc = self(day)
+            weather_data.append({key: getattr(wdc, key) for key in WeatherDataContainer.__slots__ if hasattr(wdc, key)})
+        return weather_data
+
+
+class ScenarioWeatherCube:
+    """Weather of one parcel for many (rcp, ensemble) scenarios.
+
+    Everything that does not depend on the scenario is done once for all the
+    scenarios: the lookup of the elevation and of the Angstrom coefficients of
+    the parcel and, for the scenarios with no valid cache file, the calendar
+    and unit conversions, which are computed on arrays of shape
+    (n_days, n_scenarios). Each scenario is then handed out as a weather
+    provider (a view) that can be passed to PCSE and that writes the usual
+    cache file of its rcp and ensemble.
+
+    :param osgrid_code: code of the OS tile for which weather projections are required
+    :param scenarios: list of (rcp, ensemble) pairs
+    :param provider_class: class of the providers of the scenarios, by default
+           NetCDFWeatherDataProvider (e.g. ArrayWeatherDataProvider)
+    :param force_update: bypass the cache files, reload data from the netcdf files and
+           write new cache files
+    Additional keyword arguments (e.g. cache_format, start_date, end_date) are passed
+    to the provider of each scenario.
+
+    Typical use:
+        cube = ScenarioWeatherCube(osgrid_code, [('rcp26', 1), ('rcp85', 1)])
+        for (rcp, ensemble), wdp in cube.items():
+            wofsim = Wofost71_WLP_FD(parameters, wdp, agromanagement)
+    """
+
+    def __init__(self, osgrid_code, scenarios, provider_class=None, force_update=False, **kwargs):
+        self.osgrid_code = osgrid_code
+        self.scenarios = list(dict.fromkeys((rcp, ensemble) for rcp, ensemble in scenarios))
+        self.provider_class = provider_class or NetCDFWeatherDataProvider
+        self.site = self.provider_class.site_parameters(osgrid_code)
+        self._providers = {}
+
+        pending = []
+        backend = kwargs.get("backend") or self.provider_class.backend
+        for rcp, ensemble in self.scenarios:
+            if (backend == "store" or not force_update and
+                    self.provider_class.has_valid_cache(osgrid_code, rcp, ensemble, kwargs.get("cache_format"),
+                                                        kwargs.get("daylength_radiation"))):
+                self._providers[(rcp, ensemble)] = self.provider_class(osgrid_code, rcp, ensemble,
+                                                                       site=self.site, **kwargs)
+            else:
+                pending.append((rcp, ensemble))
+        if pending:
+            self._read_scenarios(pending, kwargs)
+
+    def _read_scenarios(self, scenarios, kwargs):
+        """Read the cell for all the 'scenarios' and convert them together. Scenarios
+        whose tiles have a different time axis than the first one are read by their
+        own provider.
+        """
+        for rcp, ensemble in scenarios:
+            nc_fname = tile_filename(osgrid_to_10km(self.osgrid_code), rcp, ensemble)
+            if not os.path.exists(nc_fname):
+                msg = "Cannot find weather file at: %s" % nc_fname
+                raise PCSEError(msg)
+        frames = [read_cell(self.osgrid_code, rcp, ensemble) for rcp, ensemble in scenarios]
+        time = frames[0]['time'].to_numpy()
+        same_axis = [np.array_equal(frame['time'].to_numpy(), time) for frame in frames]
+        for scenario, same in zip(scenarios, same_axis):
+            if not same:
+                self._providers[scenario] = self.provider_class(self.osgrid_code, *scenario, site=self.site,
+                                                                force_update=True, **kwargs)
+        scenarios = [scenario for scenario, same in zip(scenarios, same_axis) if same]
+        frames = [frame for frame, same in zip(frames, same_axis) if same]
+
+        # calendar conversion, shared by all the scenarios
+        first_day, take = calendar_mapping(time)
+        days = first_day + np.arange(len(take))
+        values = {var: np.column_stack([frame[var].to_numpy(dtype=float) for frame in frames])[take]
+                  for var in WEATHER_VARIABLES}
+
+        # same processing as the providers, on arrays of shape (n_days, n_scenarios)
+        latitude = osgrid2lonlat(osgrid_to_1km(self.osgrid_code), EPSG=4326)[1]
+        daylength_radiation = kwargs.get("daylength_radiation")
+        if daylength_radiation is None:
+            daylength_radiation = self.provider_class.daylength_radiation
+        raw = self.provider_class._chess_scape_columns(values, days, latitude, daylength_radiation)
+        columns, valid = self.provider_class._convert_columns(raw, kwargs.get("nodata_value", -999),
+                                                              kwargs.get("missing_snow_depth"))
+
+        # each provider adds the reference ET of its simulation window
+        for k, (rcp, ensemble) in enumerate(scenarios):
+            rows = valid[:, k]
+            obs = {label: column[rows, k] for label, column in columns.items()}
+            obs["DAY"] = days[rows]
+            self._providers[(rcp, ensemble)] = self.provider_class(self.osgrid_code, rcp, ensemble, site=self.site,
+                                                                   observations=obs, **kwargs)
+
+    def __getitem__(self, scenario):
+        """Return the weather provider of an (rcp, ensemble) scenario"""
+        return self._providers[tuple(scenario)]
+
+    def __iter__(self):
+        return iter(self.scenarios)
+
+    def __len__(self):
+        return len(self.scenarios)
+
+    def items(self):
+        """Yield the ((rcp, ensemble), provider) pairs, in the order of the scenarios"""
+        for scenario in self.scenarios:
+            yield scenario, self._providers[scenario]
+
+
+class PerturbedWeatherDataProvider(ArrayWeatherDataProvider):
+    """Delta-change scenario of the weather of a loaded provider.
+
+    The series of the baseline provider is perturbed in memory, with no access
+    to the Chess-Scape files or to the cache files: temperature offsets and
+    scaling factors of rainfall, radiation and wind speed are applied to whole
+    columns, then only the quantities that depend on them are recomputed:
+    the vapour pressure (VAP, at constant relative humidity) and the reference
+    evapotranspiration (E0, ES0, ET0), with the site parameters of the baseline.
+    The perturbed series is kept as arrays, as in ArrayWeatherDataProvider.
+
+    Offsets and factors are either single values or sequences of 12 monthly
+    values (January first), as in the delta-change method.
+
+    :param baseline: loaded NetCDFWeatherDataProvider (or subclass). Baselines
+           holding their series as columns (ArrayWeatherDataProvider or the
+           columnar cache format) are perturbed without building any container.
+    :param delta_temp: offset (Celsius) added to TMIN and TMAX
+    :param rain_factor: factor applied to RAIN
+    :param irrad_factor: factor applied to IRRAD
+    :param wind_factor: factor applied to WIND
+    :param keep_relative_humidity: if True (default) VAP is rescaled to keep the
+           relative humidity of the baseline, otherwise it is not changed
+
+    Typical use:
+        baseline = ArrayWeatherDataProvider(osgrid_code, 'rcp26', 1)
+        for delta_temp in [0.5, 1., 1.5, 2.]:
+            wdp = PerturbedWeatherDataProvider(baseline, delta_temp=delta_temp, rain_factor=0.9)
+            wofsim = Wofost71_WLP_FD(parameters, wdp, agromanagement)
+    """
+
+    def __init__(self, baseline, delta_temp=0., rain_factor=1., irrad_factor=1., wind_factor=1.,
+                 keep_relative_humidity=True):
+        WeatherDataProvider.__init__(self)
+        for attr in ("osgrid_code", "osgrid_1km", "rcp", "ensemble", "latitude", "longitude", "elevation",
+                     "angstA", "angstB", "has_sunshine", "description", "ETmodel", "start_date", "end_date"):
+            setattr(self, attr, getattr(baseline, attr))
+        self.delta_temp, self.rain_factor = delta_temp, rain_factor
+        self.irrad_factor, self.wind_factor = irrad_factor, wind_factor
+
+        columns = baseline.columns()
+        months = columns["DAY"].astype("datetime64[M]").astype(int) % 12
+        obs = {label: np.asarray(columns[label], dtype=float) for label in CACHE_COLUMNS}
+        tmean = (obs["TMIN"] + obs["TMAX"])/2.
+        obs["TMIN"] = obs["TMIN"] + self._monthly(delta_temp, months)
+        obs["TMAX"] = obs["TMAX"] + self._monthly(delta_temp, months)
+        obs["RAIN"] = obs["RAIN"] * self._monthly(rain_factor, months)
+        obs["IRRAD"] = obs["IRRAD"] * self._monthly(irrad_factor, months)
+        obs["WIND"] = obs["WIND"] * self._monthly(wind_factor, months)
+        if keep_relative_humidity:
+            # saturated vapour pressure of the baseline and perturbed mean temperatures
+            svp = rh_to_vpress_array(100., tmean)
+            svp_new = rh_to_vpress_array(100., (obs["TMIN"] + obs["TMAX"])/2.)
+            obs["VAP"] = obs["VAP"] * svp_new/svp
+        obs["DAY"] = columns["DAY"]
+        self._add_reference_ET(obs)
+        self._set_columns(obs)
+
+    @staticmethod
+    def _monthly(value, months):
+        """Value of a single or monthly (12 values) perturbation for each day,
+        given the month (0-11) of each day."""
+        value = np.asarray(value, dtype=float)
+        if value.ndim == 0:
+            return value
+        if value.shape != (12,):
+            msg = "Perturbations must be single values or 12 monthly values, got shape %s" % (value.shape,)
+            raise PCSEError(msg)
+        return value[months]
@@ -17,10 +17,13 @@ db_parameters = {
 
 # other paths:
 #   - OSGB_dir:   where the rechunked Chess_Scape data is stored
+#   - store_dir:  where the national Chess_Scape stores are stored
+#                 (see cropyields.chess_scape_store)
 #   - soilds_dir: where the soil data is stored.
 data_dirs = {
     'ceda_dir':   'D:\\Documents\\Data\\PCSE-WOFOST\\ClimateData\\nc_files\\Raw\\',
     'OSGB_dir':   'D:\\Documents\\Data\\PCSE-WOFOST\\ClimateData\\nc_files\\OsGrid\\',
+    'store_dir':  'D:\\Documents\\Data\\PCSE-WOFOST\\ClimateData\\Store\\',
     'soils_dir':  'D:\\Documents\\Data\\PCSE-WOFOST\\SoilData\\nc_files\\',
     'utils_dir':  'D:\\Documents\\Data\\PCSE-WOFOST\\Utils\\',
     'wofost_dir': 'D:\\Documents\\Data\\PCSE-WOFOST\\'
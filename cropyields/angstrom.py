@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+ANGSTROM COEFFICIENTS
+=====================
+
+Process-wide lookup of the Angstrom A and B coefficients of the parcels.
+Coefficients come from two csv files in data_dirs['utils_dir']:
+    - 'angst_coefficients.csv': coefficients by parcel, from NASA POWER
+      (see angstrom_downloader.py);
+    - 'angst_coefficients_cells.csv': coefficients by 1km cell, estimated
+      from the Chess-Scape radiation (see 'estimate_angstrom_coefficients'
+      and angstrom_estimator.py).
+Parcels are looked up by OS grid code in the first table and, if they are
+not in it, by their 1km cell: in the second table or, if the cell is not in
+it either, as the average of the coefficients of the parcels in the cell.
+
+The csv files are parsed once and converted to a compact binary file
+('angst_coefficients.npz') holding the sorted parcel codes and 1km cell
+codes with their coefficients, which is loaded instead of the csv files as
+long as these do not change.
+
+The table is loaded on first use; call 'preload_angstrom_coefficients'
+before forking worker processes to share it with all of them.
+"""
+import glob
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import warnings
+import zipfile
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pyproj import Transformer
+from cropyields import data_dirs
+from cropyields.chess_scape import osgrid_to_1km
+from cropyields.evapotranspiration import astro
+from cropyields.utils import bng2osgrid, calc_doy_array
+from cropyields.weather_cache import source_identity
+
+# Default Angstrom coefficients, used where they cannot be estimated (as in
+# the PCSE NASAPowerWeatherDataProvider)
+DEFAULT_ANGSTA = 0.29
+DEFAULT_ANGSTB = 0.49
+
+# Valid ranges of the coefficients (see pcse.util.check_angstromAB)
+ANGSTA_RANGE = (0.1, 0.4)
+ANGSTB_RANGE = (0.3, 0.7)
+ANGSTAB_RANGE = (0.6, 0.9)
+
+
+def angstrom_filenames():
+    """Return the (parcel csv, cell csv, binary) file names of the Angstrom coefficients"""
+    return (data_dirs['utils_dir'] + 'angst_coefficients.csv',
+            data_dirs['utils_dir'] + 'angst_coefficients_cells.csv',
+            data_dirs['utils_dir'] + 'angst_coefficients.npz')
+
+
+class AngstromTable:
+    """
+    Angstrom coefficients indexed by parcel code and by 1km cell code.
+
+    :param parcels: sorted array of parcel OS grid codes
+    :param parcel_coefficients: (n_parcels, 2) array of Angstrom A and B
+    :param cells: sorted array of 1km cell codes
+    :param cell_coefficients: (n_cells, 2) array of Angstrom A and B
+    """
+
+    def __init__(self, parcels, parcel_coefficients, cells, cell_coefficients):
+        self.parcels, self.parcel_coefficients = parcels, parcel_coefficients
+        self.cells, self.cell_coefficients = cells, cell_coefficients
+
+    @classmethod
+    def from_csv(cls, csv_fname, cells_fname=None):
+        """
+        Build the table from the parcel csv file written by angstrom_downloader.py
+        and, optionally, the cell csv file written by estimate_angstrom_coefficients.
+        Either file can be None.
+        """
+        df = pd.DataFrame({'parcel': pd.Series(dtype=str), 'angstA': pd.Series(dtype=float),
+                           'angstB': pd.Series(dtype=float)})
+        if csv_fname is not None:
+            df = pd.read_csv(csv_fname, dtype={'parcel': str})
+        df = df.drop_duplicates('parcel', keep='last').sort_values('parcel')
+        df['cell'] = [osgrid_to_1km(code) for code in df['parcel']]
+        cells = df.groupby('cell')[['angstA', 'angstB']].mean()
+        if cells_fname is not None:
+            estimated = pd.read_csv(cells_fname, dtype={'cell': str}).set_index('cell')[['angstA', 'angstB']]
+            cells = pd.concat([cells[~cells.index.isin(estimated.index)], estimated]).sort_index()
+        return cls(df['parcel'].to_numpy(dtype=str), df[['angstA', 'angstB']].to_numpy(dtype=float),
+                   cells.index.to_numpy(dtype=str), cells.to_numpy(dtype=float))
+
+    @classmethod
+    def load(cls, csv_fname=None, cells_fname=None, binary_fname=None):
+        """
+        Load the table from the binary file if it was built from the current
+        csv files, otherwise parse the csv files and write the binary file.
+        Missing csv files are skipped, but at least one must exist.
+        """
+        default_csv, default_cells, default_binary = angstrom_filenames()
+        csv_fname = csv_fname or default_csv
+        cells_fname = cells_fname or default_cells
+        binary_fname = binary_fname or default_binary
+        csv_fname, cells_fname = [fname if os.path.exists(fname) else None for fname in (csv_fname, cells_fname)]
+        if csv_fname is None and cells_fname is None:
+            msg = "No Angstrom coefficient files in %s" % data_dirs['utils_dir']
+            raise IOError(msg)
+
+        source = [None if fname is None else source_identity(fname) for fname in (csv_fname, cells_fname)]
+        try:
+            with np.load(binary_fname) as f:
+                if json.loads(str(f['source'])) == source:
+                    return cls(f['parcels'], f['parcel_coefficients'], f['cells'], f['cell_coefficients'])
+        except (IOError, KeyError, ValueError, zipfile.BadZipFile):
+            pass
+
+        table = cls.from_csv(csv_fname, cells_fname)
+        try:
+            table.save(binary_fname, source)
+        except OSError as e:
+            # e.g. read-only utils directory: the table is only kept in memory
+            warnings.warn("Cannot write the Angstrom coefficients to %s: %s" % (binary_fname, e))
+        return table
+
+    def save(self, binary_fname, source):
+        """
+        Write the table to a binary file, with the identity of its csv source
+        files. The file is written to a temporary file of this process first,
+        so that processes writing the table at the same time do not clash.
+        """
+        fd, tmp_fname = tempfile.mkstemp(suffix='.tmp.npz', dir=os.path.dirname(os.path.abspath(binary_fname)))
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                np.savez(fp, source=json.dumps(source), parcels=self.parcels,
+                         parcel_coefficients=self.parcel_coefficients, cells=self.cells,
+                         cell_coefficients=self.cell_coefficients)
+            # temporary files are only readable by their owner
+            os.chmod(tmp_fname, 0o644)
+            os.replace(tmp_fname, binary_fname)
+        except BaseException:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            raise
+
+    @staticmethod
+    def _find(keys, key):
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return i
+        return None
+
+    def get(self, osgrid_code):
+        """
+        Return the Angstrom A and B coefficients of a parcel, or of its 1km cell
+        if the parcel is not in the table. Raises KeyError if neither is.
+        """
+        i = self._find(self.parcels, osgrid_code)
+        if i is not None:
+            return tuple(float(v) for v in self.parcel_coefficients[i])
+        i = self._find(self.cells, osgrid_to_1km(osgrid_code))
+        if i is not None:
+            return tuple(float(v) for v in self.cell_coefficients[i])
+        msg = "No Angstrom coefficients for parcel '%s' or its 1km cell" % osgrid_code
+        raise KeyError(msg)
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def angstrom_table():
+    """Return the process-wide AngstromTable, loading it on first use"""
+    global _table
+    with _table_lock:
+        if _table is None:
+            _table = AngstromTable.load()
+        return _table
+
+
+def preload_angstrom_coefficients():
+    """Load the process-wide AngstromTable, e.g. before forking worker processes"""
+    return angstrom_table()
+
+
+def angstrom_coefficients(osgrid_code):
+    """Return the Angstrom A and B coefficients of a parcel (see AngstromTable.get)"""
+    return angstrom_table().get(osgrid_code)
+
+
+def estimate_angstromAB(irrad, toa):
+    """
+    Estimate the Angstrom A and B coefficients of many cells at once from
+    their daily surface and top-of-atmosphere radiation, as done by the
+    PCSE NASAPowerWeatherDataProvider: A is the 5th percentile of the ratio
+    irrad/toa and A+B its 98th percentile. Cells with less than 200 days of
+    data or with coefficients outside the valid ranges get the default
+    coefficients.
+
+    :param irrad: (n_days, n_cells) array of surface radiation (J/m2/day)
+    :param toa: (n_days, n_cells) array of top-of-atmosphere radiation (J/m2/day)
+
+    Returns two arrays with the A and B coefficients of each cell.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(toa > 0., irrad/toa, np.nan)
+    n_days = np.sum(~np.isnan(ratio), axis=0)
+    angstA = np.full(ratio.shape[1], np.nan)
+    angstAB = np.full(ratio.shape[1], np.nan)
+    has_data = n_days > 0
+    angstA[has_data] = np.nanpercentile(ratio[:, has_data], 5, axis=0)
+    angstAB[has_data] = np.nanpercentile(ratio[:, has_data], 98, axis=0)
+    angstB = angstAB - angstA
+
+    valid = ((n_days >= 200) &
+             (angstA >= ANGSTA_RANGE[0]) & (angstA <= ANGSTA_RANGE[1]) &
+             (angstB >= ANGSTB_RANGE[0]) & (angstB <= ANGSTB_RANGE[1]) &
+             (angstAB >= ANGSTAB_RANGE[0]) & (angstAB <= ANGSTAB_RANGE[1]))
+    return np.where(valid, angstA, DEFAULT_ANGSTA), np.where(valid, angstB, DEFAULT_ANGSTB)
+
+
+def _estimate_tile(args):
+    """
+    Estimate the Angstrom coefficients of all the cells with data of one
+    Chess-Scape tile. Runs in a worker process.
+    """
+    fname, start_year, end_year = args
+    with xr.open_dataset(fname) as ds:
+        days = xr.CFTimeIndex(ds['time'].to_numpy())
+        keep = np.ones(len(days), dtype=bool)
+        if start_year is not None:
+            keep &= days.year >= start_year
+        if end_year is not None:
+            keep &= days.year <= end_year
+        rsds = ds['rsds'].transpose('time', 'y', 'x').to_numpy()[keep]
+        x, y = ds['x'].to_numpy(), ds['y'].to_numpy()
+    days = calc_doy_array(days.year[keep], days.dayofyear[keep])
+
+    j, i = np.nonzero(~np.isnan(rsds).all(axis=0))
+    if len(j) == 0:
+        return pd.DataFrame(columns=['cell', 'angstA', 'angstB'])
+    irrad = rsds[:, j, i] * 3600*24
+
+    # latitude of the south-west corner of the 1km cell, as in the weather provider
+    x0, y0 = np.floor(x[i]/1000.)*1000., np.floor(y[j]/1000.)*1000.
+    _, lat = Transformer.from_crs(27700, 4326, always_xy=True).transform(x0, y0)
+    toa = astro(days[:, None], lat[None, :], 0.)["ANGOT"]
+
+    angstA, angstB = estimate_angstromAB(irrad, toa)
+    return pd.DataFrame({'cell': [bng2osgrid(a, b, figs=4) for a, b in zip(x0, y0)],
+                         'angstA': angstA, 'angstB': angstB})
+
+
+def estimate_angstrom_coefficients(rcp='rcp26', ensemble=1, start_year=None, end_year=None,
+                                   processes=None, verbose=True):
+    """
+    Estimate the Angstrom coefficients of every land cell from the Chess-Scape
+    shortwave radiation (rsds) and the top-of-atmosphere radiation, processing
+    the 10km tiles in parallel, and write them to the cell csv file (see
+    angstrom_filenames), which is then used by the weather providers.
+
+    :param rcp: rcp of the Chess-Scape tiles to use
+    :param ensemble: ensemble of the Chess-Scape tiles to use
+    :param start_year: first year of the radiation series to use, all by default
+    :param end_year: last year of the radiation series to use, all by default
+    :param processes: number of worker processes, by default the number of CPUs
+    :param verbose: print progress
+
+    Returns a dataframe with the 'angstA' and 'angstB' coefficients indexed by cell.
+    """
+    tile_files = sorted(glob.glob(data_dirs['OSGB_dir'] + f'*_{rcp}_{ensemble:02d}.nc'))
+    if not tile_files:
+        msg = "No Chess-Scape tiles found for %s and ensemble %s in %s" % (rcp, ensemble, data_dirs['OSGB_dir'])
+        raise ValueError(msg)
+
+    results = []
+    jobs = [(fname, start_year, end_year) for fname in tile_files]
+    with multiprocessing.Pool(processes=processes) as pool:
+        for counter, df in enumerate(pool.imap_unordered(_estimate_tile, jobs), start=1):
+            results.append(df)
+            if verbose:
+                print(f'\rTile {counter} of {len(jobs)}', end='')
+    if verbose:
+        print()
+
+    df = pd.concat(results).drop_duplicates('cell').set_index('cell').sort_index()
+    cells_fname = angstrom_filenames()[1]
+    tmp_fname = cells_fname + '.tmp'
+    df.to_csv(tmp_fname)
+    os.replace(tmp_fname, cells_fname)
+    return df
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+CHESS-SCAPE TILES
+=================
+
+Helpers to locate and open the OSGB-rechunked Chess-Scape netCDF tiles
+stored in data_dirs['OSGB_dir'], one file per 10km OS grid tile, rcp
+and ensemble (e.g. 'SX54_rcp26_01.nc').
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.spatial import cKDTree
+from cropyields import data_dirs
+from cropyields.utils import osgrid2lonlat, calc_doy_array, nearest_index
+
+# Chess-Scape variables used by the weather providers and the WOFOST
+# variable they are mapped to. 'hurs' and 'tas' are only used to derive
+# the vapour pressure (VAP)
+CHESS_SCAPE_VARIABLES = {
+    'tasmax': 'TMAX',
+    'tasmin': 'TMIN',
+    'pr': 'RAIN',
+    'rsds': 'IRRAD',
+    'sfcWind': 'WIND'
+}
+WEATHER_VARIABLES = list(CHESS_SCAPE_VARIABLES) + ['hurs', 'tas']
+
+
+def osgrid_to_1km(osgrid_code):
+    """
+    Return the code of the 1km OS grid cell containing 'osgrid_code'
+    (e.g. 'SX5941249334' -> 'SX5949')
+    """
+    os_digits = [s for s in osgrid_code if s.isdigit()]
+    half = int(len(os_digits)/2)
+    return osgrid_code[0:2].upper() + ''.join(os_digits[0:2] + os_digits[half:half+2])
+
+
+def osgrid_to_10km(osgrid_code):
+    """
+    Return the code of the 10km OS grid tile containing 'osgrid_code'
+    (e.g. 'SX5941249334' -> 'SX54')
+    """
+    os_digits = [s for s in osgrid_code if s.isdigit()]
+    half = int(len(os_digits)/2)
+    return osgrid_code[0:2].upper() + ''.join(os_digits[0:1] + os_digits[half:half+1])
+
+
+def tile_filename(osgrid_10km, rcp, ensemble):
+    """Full path of the Chess-Scape netCDF file of a 10km tile"""
+    return os.path.abspath(data_dirs['OSGB_dir'] + f'{osgrid_10km.upper()}_{rcp}_{ensemble:02d}.nc')
+
+
+class ValidCells:
+    """
+    KD-tree of the cells of a tile with data, used to find the closest cell
+    with data to locations on cells with no data (e.g. near the coastline).
+    Cells with data are those with no missing WEATHER_VARIABLES on any day of
+    the series.
+
+    :param dataset: the open dataset of the tile
+    """
+
+    def __init__(self, dataset):
+        valid = np.ones((dataset.sizes['y'], dataset.sizes['x']), dtype=bool)
+        for var in WEATHER_VARIABLES:
+            valid &= np.isfinite(dataset[var].transpose('time', 'y', 'x').to_numpy()).all(axis=0)
+        # cells in the order of the tile (y first, then x)
+        j, i = np.nonzero(valid)
+        self.x = dataset['x'].to_numpy()[i]
+        self.y = dataset['y'].to_numpy()[j]
+        self.tree = cKDTree(np.column_stack([self.x, self.y])) if len(self.x) else None
+
+    def nearest(self, x, y):
+        """
+        Return the (x, y) coordinates of the cell with data closest to (x, y)
+        (Euclidean distance). Ties are resolved towards the first cell in the
+        order of the tile, as in utils.find_closest_point.
+        """
+        if self.tree is None:
+            msg = "No cell with Chess-Scape data in the tile of (%s, %s)" % (x, y)
+            raise ValueError(msg)
+        k = min(8, len(self.x))
+        distance, index = self.tree.query([x, y], k=k)
+        distance, index = np.atleast_1d(distance), np.atleast_1d(index)
+        closest = index[distance <= distance[0] + 1e-6].min()
+        return self.x[closest], self.y[closest]
+
+
+class TilePool:
+    """
+    Bounded pool of open Chess-Scape tile datasets, shared by all the weather
+    providers in a process. Datasets are keyed by (osgrid_10km, rcp, ensemble)
+    and the least recently used one is closed when more than 'maxsize' tiles
+    are open, which caps the number of file descriptors on long runs.
+
+    Datasets are checked out with 'tile' for the duration of a read, and an
+    evicted dataset is only closed once no thread is reading it any more, so
+    the pool can briefly hold more than 'maxsize' open files.
+
+    :param maxsize: maximum number of tiles kept open at the same time
+
+    Counters of the tiles opened, of the requests served by an already open
+    tile (hits) and of the tiles closed to make room (evictions) are returned
+    by 'stats'.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._datasets = OrderedDict()
+        self._valid_cells = {}
+        # number of readers of each checked-out dataset, keyed by id(dataset)
+        self._readers = {}
+        self._lock = threading.Lock()
+        self.opens = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @contextmanager
+    def tile(self, osgrid_10km, rcp, ensemble):
+        """
+        Check out the open dataset of a tile for the duration of a 'with'
+        block, opening it (and evicting the least recently used tile if the
+        pool is full) if needed. The dataset is not closed while checked out.
+
+        Typical use:
+            with tile_pool.tile('SX54', 'rcp26', 1) as dataset:
+                values = dataset['pr'].isel(x=0, y=0).to_numpy()
+        """
+        key = (osgrid_10km.upper(), rcp, ensemble)
+        dataset = self._checkout(key)
+        try:
+            yield dataset
+        finally:
+            self._release(key, dataset)
+
+    def _checkout(self, key):
+        with self._lock:
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+                self.hits += 1
+                dataset = self._datasets[key]
+            else:
+                dataset = xr.open_dataset(tile_filename(*key))
+                self.opens += 1
+                self._datasets[key] = dataset
+                while len(self._datasets) > self.maxsize:
+                    evicted_key, evicted = self._datasets.popitem(last=False)
+                    self._valid_cells.pop(evicted_key, None)
+                    self._close(evicted)
+                    self.evictions += 1
+            self._readers[id(dataset)] = self._readers.get(id(dataset), 0) + 1
+            return dataset
+
+    def _release(self, key, dataset):
+        with self._lock:
+            self._readers[id(dataset)] -= 1
+            if self._readers[id(dataset)] == 0:
+                del self._readers[id(dataset)]
+                # evicted (or cleared) while checked out
+                if self._datasets.get(key) is not dataset:
+                    dataset.close()
+
+    def _close(self, dataset):
+        """Close a dataset removed from the pool, unless it is checked out (see _release)"""
+        if id(dataset) not in self._readers:
+            dataset.close()
+
+    def valid_cells(self, osgrid_10km, rcp, ensemble):
+        """Return the ValidCells of a tile, built on first use and kept as
+        long as the tile is open."""
+        key = (osgrid_10km.upper(), rcp, ensemble)
+        with self.tile(osgrid_10km, rcp, ensemble) as dataset:
+            with self._lock:
+                cells = self._valid_cells.get(key)
+            if cells is None:
+                # built outside the lock, as it reads the whole tile
+                cells = ValidCells(dataset)
+                with self._lock:
+                    if self._datasets.get(key) is dataset:
+                        cells = self._valid_cells.setdefault(key, cells)
+            return cells
+
+    def stats(self):
+        """Return the pool counters, the number of tiles currently open and
+        the number of datasets checked out"""
+        with self._lock:
+            return {
+                "open": len(self._datasets),
+                "in_use": len(self._readers),
+                "opens": self.opens,
+                "hits": self.hits,
+                "evictions": self.evictions
+            }
+
+    def clear(self):
+        """Close all the open tiles (those checked out once released)"""
+        with self._lock:
+            self._valid_cells = {}
+            while self._datasets:
+                _, dataset = self._datasets.popitem()
+                self._close(dataset)
+
+    def _forget(self):
+        """Drop the handles inherited from a parent process without closing
+        them, as the underlying files are shared with the parent."""
+        self._datasets = OrderedDict()
+        self._valid_cells = {}
+        self._readers = {}
+        self._lock = threading.Lock()
+
+
+def read_tile_cells(osgrid_codes, rcp, ensemble):
+    """
+    Read the daily series of many 1km cells of the same 10km tile with a
+    single indexed read of the tile, projecting only WEATHER_VARIABLES.
+
+    :param osgrid_codes: list of OS grid codes, all within the same 10km tile
+    :param rcp: the rcp scenario
+    :param ensemble: the ensemble of the rcp
+
+    Returns a dictionary mapping each 1km cell code (see osgrid_to_1km) to a
+    dataframe with a 'time' column and one column per weather variable, as
+    obtained by selecting the nearest cell with '.sel(method="nearest")'.
+    """
+    cells = list(dict.fromkeys(osgrid_to_1km(code) for code in osgrid_codes))
+    tiles = {osgrid_to_10km(code) for code in cells}
+    if len(tiles) != 1:
+        msg = "All OS grid codes must be in the same 10km tile, found tiles %s" % sorted(tiles)
+        raise ValueError(msg)
+
+    x, y = zip(*[osgrid2lonlat(cell) for cell in cells])
+    with tile_pool.tile(tiles.pop(), rcp, ensemble) as dataset:
+        os_array = dataset[WEATHER_VARIABLES]
+        ix = os_array.indexes['x'].get_indexer(list(x), method='nearest')
+        iy = os_array.indexes['y'].get_indexer(list(y), method='nearest')
+        values = os_array.isel(x=xr.DataArray(ix, dims='cell'),
+                               y=xr.DataArray(iy, dims='cell')).transpose('time', 'cell').load()
+
+    time = values['time'].to_numpy()
+    columns = {var: values[var].to_numpy() for var in WEATHER_VARIABLES}
+    return {
+        cell: pd.DataFrame({'time': time, **{var: columns[var][:, k] for var in WEATHER_VARIABLES}})
+        for k, cell in enumerate(cells)
+    }
+
+
+def read_cell(osgrid_code, rcp, ensemble, tile_batch=None):
+    """
+    Read the daily series of the 1km cell of 'osgrid_code' from its tile or,
+    if given, from 'tile_batch' (see TileBatch).
+
+    :param osgrid_code: OS grid code of the parcel
+    :param rcp: the rcp scenario
+    :param ensemble: the ensemble of the rcp
+    :param tile_batch: optional TileBatch including the parcel
+
+    Returns a dataframe with a 'time' column and one column per weather variable.
+    """
+    osgrid_10km = osgrid_to_10km(osgrid_code)
+    x, y = osgrid2lonlat(osgrid_to_1km(osgrid_code))
+    if tile_batch is not None:
+        os_dataframe = tile_batch[osgrid_code]
+    else:
+        with tile_pool.tile(osgrid_10km, rcp, ensemble) as os_array:
+            os_dataframe = os_array[WEATHER_VARIABLES].sel(x=x, y=y, method="nearest").to_dataframe().reset_index()
+    # There is  a posibility that the assignment of weather data to parcels  near the coastline 
+    # could result in empty data (nan). This is because the .sel("closest") method in xarray is 
+    # based on the x-y coordinates, regardless of whether the arrays at those coordinates are 
+    # empty or not. Deal with this selecting the closest non-null cell (Euclidean distance)
+    # from the KD-tree of the cells of the tile with data.
+    if os_dataframe[WEATHER_VARIABLES].isnull().any().any():
+        closest_x, closest_y = tile_pool.valid_cells(osgrid_10km, rcp, ensemble).nearest(x, y)
+        with tile_pool.tile(osgrid_10km, rcp, ensemble) as os_array:
+            os_dataframe = os_array[WEATHER_VARIABLES].sel(x=closest_x, y=closest_y).to_dataframe().reset_index()
+    return os_dataframe
+
+
+def calendar_mapping(time):
+    """
+    Map the 360-day Chess-Scape time axis to a daily Gregorian series (see
+    NetCDFWeatherDataProvider). Returns the first day of the series and, for
+    each day of the series, the position of the Chess-Scape day used.
+    """
+    days = xr.CFTimeIndex(time)
+    dates = calc_doy_array(days.year, days.dayofyear)
+    order = np.argsort(dates, kind='stable')
+    date_rng = np.arange(dates[order[0]], dates[order[-1]] + 1)
+    return date_rng[0], order[nearest_index(dates[order], date_rng)]
+
+
+class TileBatch:
+    """
+    Lazily read batch of 1km cells of the same 10km tile. The tile is only
+    read, once and for all the cells (see read_tile_cells), the first time
+    the data of one of the cells is requested, so that a batch of weather
+    providers whose cache files are all valid never touches the netCDF file.
+
+    :param osgrid_codes: list of OS grid codes, all within the same 10km tile
+    :param rcp: the rcp scenario
+    :param ensemble: the ensemble of the rcp
+    """
+
+    def __init__(self, osgrid_codes, rcp, ensemble):
+        self.osgrid_codes = list(osgrid_codes)
+        self.rcp, self.ensemble = rcp, ensemble
+        self._cells = None
+        self._lock = threading.Lock()
+        self.nbytes = 0 # bytes of Chess-Scape data read for the batch
+
+    def __getitem__(self, osgrid_code):
+        with self._lock:
+            if self._cells is None:
+                self._cells = read_tile_cells(self.osgrid_codes, self.rcp, self.ensemble)
+                self.nbytes = sum(cell[WEATHER_VARIABLES].to_numpy().nbytes for cell in self._cells.values())
+        return self._cells[osgrid_to_1km(osgrid_code)].copy()
+
+
+# Process-wide pool used by the weather providers
+tile_pool = TilePool()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=tile_pool._forget)
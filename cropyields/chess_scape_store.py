@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+CHESS-SCAPE NATIONAL STORE
+==========================
+
+National store of the Chess-Scape projections of one rcp and ensemble,
+built from the 10km OSGB tiles in data_dirs['OSGB_dir'] and laid out for
+point time-series reads. The store is a directory in data_dirs['store_dir']
+(e.g. 'chess_scape_rcp26_01') holding:
+    - 'data.bin': the whole daily series of each land cell, already converted
+      to WOFOST units and to the Gregorian calendar, as one compressed chunk
+      per cell (see 'pack_cell'), so that the series of a cell is read with
+      one contiguous read;
+    - 'offsets.npy': int64 array of the n_cells + 1 byte offsets of the
+      chunks in 'data.bin';
+    - 'index.npy': int32 array of shape (ny, nx) mapping each 1km cell of
+      the national grid to its row in 'offsets.npy' (-1 for cells with no data);
+    - 'header.json': grid geometry, column names and packing, first day of
+      the series and the identity of the source tiles, which are checked
+      against the tiles when the store is opened (see 'is_store_valid'). It
+      is written last, so that a store is only considered complete when it
+      exists.
+
+Besides the Chess-Scape variables, the vapour pressure (VAP) is precomputed.
+Values are packed as int16 with the scale factors of STORE_SCALE_FACTORS, as
+in the CF conventions, and each chunk is compressed, so that the store takes
+less than half the size of the float32 series. The reference
+evapotranspiration depends on the elevation and the Angstrom coefficients of
+each parcel, hence it is not stored and is computed by the weather provider.
+"""
+import glob
+import json
+import multiprocessing
+import os
+import threading
+import zlib
+import numpy as np
+import xarray as xr
+from cropyields import data_dirs
+from cropyields.chess_scape import WEATHER_VARIABLES, calendar_mapping
+from cropyields.utils import rh_to_vpress_array
+from cropyields.weather_cache import source_identity
+
+# Version of the layout of the store. Bump it whenever the layout or the
+# content of the store changes.
+STORE_FORMAT_VERSION = 2
+
+# Columns of the store, in this order
+STORE_COLUMNS = ["TMAX", "TMIN", "IRRAD", "VAP", "WIND", "RAIN"]
+STORE_DTYPE = np.float32
+
+# Packing of the columns as int16 (value = packed value * scale factor + offset),
+# which sets the precision and the range of the store: 0.005 C (-163 to 163 C),
+# 1000 J/m2/day (0 to 65.5 MJ/m2/day), 0.002 hPa (0 to 131 hPa), 0.001 m/s
+# (0 to 65.5 m/s) and 0.001 cm/day (0 to 65.5 cm/day). Missing values are
+# packed as STORE_FILL_VALUE
+STORE_SCALE_FACTORS = {"TMAX": 0.005, "TMIN": 0.005, "IRRAD": 1000., "VAP": 0.002, "WIND": 0.001, "RAIN": 0.001}
+STORE_ADD_OFFSETS = {"TMAX": 0., "TMIN": 0., "IRRAD": 32767000., "VAP": 65.534, "WIND": 32.767, "RAIN": 32.767}
+STORE_FILL_VALUE = -32768
+
+# Search radius (m) for the closest cell with data, for locations on cells
+# with no data (e.g. near the coastline)
+SEARCH_RADIUS = 10000
+
+
+def store_dirname(rcp, ensemble):
+    """Full path of the directory of the national store of an rcp and ensemble"""
+    return os.path.abspath(data_dirs['store_dir'] + f'chess_scape_{rcp}_{ensemble:02d}')
+
+
+def store_files(store_dir):
+    """Return the (header, index, offsets, data) file names of a store"""
+    return tuple(os.path.join(store_dir, fname) for fname in ('header.json', 'index.npy', 'offsets.npy', 'data.bin'))
+
+
+def store_tile_files(rcp, ensemble):
+    """Return the sorted file names of the 10km tiles of an rcp and ensemble"""
+    return sorted(glob.glob(data_dirs['OSGB_dir'] + f'*_{rcp}_{ensemble:02d}.nc'))
+
+
+def is_store_valid(header, rcp, ensemble):
+    """
+    A store is valid if it was written with the current store format version
+    from the tiles that are now in data_dirs['OSGB_dir'], all of them identical
+    (see weather_cache.source_identity) to those it was built from.
+    """
+    try:
+        return (header.get("format_version") == STORE_FORMAT_VERSION and
+                header.get("sources") == [source_identity(fname) for fname in store_tile_files(rcp, ensemble)])
+    except (OSError, AttributeError):
+        return False
+
+
+def pack_cell(columns):
+    """
+    Pack the series of a cell into a compressed chunk of the store: the columns
+    are packed as int16 (see STORE_SCALE_FACTORS), their bytes are shuffled
+    (all the low bytes, then all the high bytes) and compressed with zlib.
+
+    :param columns: array of shape (n_columns, n_days) of the STORE_COLUMNS,
+           with NaN for missing values
+    """
+    columns = np.asarray(columns, dtype=float)
+    scale = np.array([STORE_SCALE_FACTORS[label] for label in STORE_COLUMNS])[:, None]
+    offset = np.array([STORE_ADD_OFFSETS[label] for label in STORE_COLUMNS])[:, None]
+    missing = np.isnan(columns)
+    packed = np.round((np.where(missing, offset, columns) - offset)/scale)
+    if (np.abs(packed) > 32767).any():
+        k = np.nonzero((np.abs(packed) > 32767).any(axis=1))[0][0]
+        msg = "Values of %s outside the range of the store" % STORE_COLUMNS[k]
+        raise ValueError(msg)
+    packed = np.ascontiguousarray(np.where(missing, STORE_FILL_VALUE, packed), dtype='<i2')
+    return zlib.compress(packed.ravel().view(np.uint8).reshape(-1, 2).T.tobytes())
+
+
+def unpack_cell(chunk, n_days):
+    """Return the array of shape (n_columns, n_days) of a chunk written by 'pack_cell'"""
+    shuffled = np.frombuffer(zlib.decompress(chunk), dtype=np.uint8)
+    packed = shuffled.reshape(2, -1).T.copy().view('<i2').reshape(len(STORE_COLUMNS), n_days)
+    scale = np.array([STORE_SCALE_FACTORS[label] for label in STORE_COLUMNS])[:, None]
+    offset = np.array([STORE_ADD_OFFSETS[label] for label in STORE_COLUMNS])[:, None]
+    columns = (packed * scale + offset).astype(STORE_DTYPE)
+    columns[packed == STORE_FILL_VALUE] = np.nan
+    return columns
+
+
+def _scan_tiles(tile_files):
+    """
+    Read the coordinates, the cells with data and the time axis of all the
+    tiles. Returns the grid geometry, the list of tiles with the local (y, x)
+    positions and the national (iy, ix) positions of their cells with data,
+    and the time axis of the first tile.
+    """
+    tiles = []
+    for fname in tile_files:
+        with xr.open_dataset(fname) as ds:
+            x, y = ds['x'].to_numpy(), ds['y'].to_numpy()
+            valid = np.ones((len(y), len(x)), dtype=bool)
+            for var in WEATHER_VARIABLES:
+                valid &= ds[var].isel(time=0).transpose('y', 'x').notnull().to_numpy()
+            if not tiles:
+                time = ds['time'].to_numpy()
+            elif not np.array_equal(ds['time'].to_numpy(), time):
+                msg = "Tile '%s' has a different time axis than '%s'" % (fname, tiles[0][0])
+                raise ValueError(msg)
+            tiles.append((fname, x, y, valid))
+
+    resolution = float(np.diff(tiles[0][1][:2])[0])
+    xmin = min(t[1].min() for t in tiles) - resolution/2
+    ymin = min(t[2].min() for t in tiles) - resolution/2
+    xmax = max(t[1].max() for t in tiles) + resolution/2
+    ymax = max(t[2].max() for t in tiles) + resolution/2
+    grid = {
+        "xmin": float(xmin), "ymin": float(ymin), "resolution": resolution,
+        "nx": int(round((xmax - xmin)/resolution)), "ny": int(round((ymax - ymin)/resolution))
+    }
+
+    cells = []
+    for fname, x, y, valid in tiles:
+        j, i = np.nonzero(valid)
+        ix = np.floor((x[i] - xmin)/resolution).astype(int)
+        iy = np.floor((y[j] - ymin)/resolution).astype(int)
+        cells.append((fname, j, i, iy, ix))
+    return grid, cells, time
+
+
+def _pack_tile(args):
+    """
+    Convert the cells with data of one tile and return their compressed
+    chunks (see pack_cell). Runs in a worker process.
+    """
+    fname, j, i, take, nodata_value = args
+    with xr.open_dataset(fname) as ds:
+        values = {var: ds[var].transpose('time', 'y', 'x').to_numpy()[:, j, i][take]
+                  for var in WEATHER_VARIABLES}
+
+    columns = {
+        "TMAX": values['tasmax'] - 273.15,
+        "TMIN": values['tasmin'] - 273.15,
+        "IRRAD": values['rsds'] * 3600*24,
+        "VAP": rh_to_vpress_array(values['hurs'], values['tas'] - 273.15),
+        "WIND": values['sfcWind'],
+        "RAIN": values['pr'] / 10.
+    }
+    out = np.stack([columns[label].T for label in STORE_COLUMNS], axis=1)
+
+    # days with missing values, found as by the weather provider before the unit
+    # conversions, are stored as missing and skipped by the provider
+    raw = [values['tasmax'], values['tasmin'], columns["IRRAD"], columns["VAP"], values['sfcWind'], values['pr']]
+    missing = np.any([np.abs(column - nodata_value) < 0.0001 for column in raw], axis=0)
+    out.transpose(0, 2, 1)[missing.T] = np.nan
+    return [pack_cell(cell) for cell in out]
+
+
+def build_chess_scape_store(rcp, ensemble, nodata_value=-999, processes=None, verbose=True):
+    """
+    Build the national store of an rcp and ensemble from all its 10km tiles.
+
+    :param rcp: the rcp scenario
+    :param ensemble: the ensemble of the rcp
+    :param nodata_value: value of the missing data in the tiles, as in the weather provider
+    :param processes: number of worker processes, by default the number of CPUs
+    :param verbose: print progress
+
+    Returns the directory of the store.
+    """
+    tile_files = store_tile_files(rcp, ensemble)
+    if not tile_files:
+        msg = "No Chess-Scape tiles found for %s and ensemble %s in %s" % (rcp, ensemble, data_dirs['OSGB_dir'])
+        raise ValueError(msg)
+
+    grid, cells, time = _scan_tiles(tile_files)
+    first_day, take = calendar_mapping(time)
+
+    store_dir = store_dirname(rcp, ensemble)
+    os.makedirs(store_dir, exist_ok=True)
+    header_fname, index_fname, offsets_fname, data_fname = store_files(store_dir)
+    if os.path.exists(header_fname):
+        os.remove(header_fname)
+
+    # assign the rows tile by tile, so that the cells of a tile are contiguous
+    index = np.full((grid["ny"], grid["nx"]), -1, dtype=np.int32)
+    jobs, n_cells = [], 0
+    for fname, j, i, iy, ix in cells:
+        if len(j) == 0:
+            # tile with no land cells
+            continue
+        index[iy, ix] = np.arange(n_cells, n_cells + len(j))
+        n_cells += len(j)
+        jobs.append((fname, j, i, take, nodata_value))
+    np.save(index_fname, index)
+
+    # chunks are appended in the order of the rows
+    offsets = [0]
+    with open(data_fname, 'wb') as fp, multiprocessing.Pool(processes=processes) as pool:
+        for counter, chunks in enumerate(pool.imap(_pack_tile, jobs), start=1):
+            for chunk in chunks:
+                fp.write(chunk)
+                offsets.append(offsets[-1] + len(chunk))
+            if verbose:
+                print(f'\rTile {counter} of {len(jobs)}, {offsets[-1]/1e9:.2f} GB', end='')
+    if verbose:
+        print()
+    np.save(offsets_fname, np.array(offsets, dtype=np.int64))
+
+    header = dict(grid)
+    header.update({
+        "format_version": STORE_FORMAT_VERSION,
+        "rcp": rcp,
+        "ensemble": ensemble,
+        "columns": STORE_COLUMNS,
+        "scale_factors": [STORE_SCALE_FACTORS[label] for label in STORE_COLUMNS],
+        "add_offsets": [STORE_ADD_OFFSETS[label] for label in STORE_COLUMNS],
+        "fill_value": STORE_FILL_VALUE,
+        "compression": "zlib",
+        "first_day": str(first_day),
+        "n_days": len(take),
+        "n_cells": n_cells,
+        "sources": [source_identity(fname) for fname in tile_files]
+    })
+    tmp_header = header_fname + ".tmp"
+    with open(tmp_header, "w") as fp:
+        json.dump(header, fp)
+    os.replace(tmp_header, header_fname)
+    return store_dir
+
+
+class ChessScapeStore:
+    """
+    Reader of the national store of an rcp and ensemble. Only the chunks of
+    the cells that are read are loaded from the data file. Raises ValueError
+    if the store is out of date (see 'is_store_valid').
+
+    :param rcp: the rcp scenario
+    :param ensemble: the ensemble of the rcp
+    """
+
+    def __init__(self, rcp, ensemble):
+        self.store_dir = store_dirname(rcp, ensemble)
+        header_fname, index_fname, offsets_fname, self.data_fname = store_files(self.store_dir)
+        with open(header_fname, "r") as fp:
+            self.header = json.load(fp)
+        if self.header.get("format_version") != STORE_FORMAT_VERSION:
+            msg = "Store format version %s, expected %s" % (self.header.get("format_version"), STORE_FORMAT_VERSION)
+            raise ValueError(msg)
+        if not is_store_valid(self.header, rcp, ensemble):
+            msg = ("The national store %s was built from other Chess-Scape tiles, rebuild it with "
+                   "build_chess_scape_store.py" % self.store_dir)
+            raise ValueError(msg)
+        self.index = np.load(index_fname)
+        self.offsets = np.load(offsets_fname)
+        self.days = np.datetime64(self.header["first_day"], "D") + np.arange(self.header["n_days"])
+
+    def cell_row(self, x, y):
+        """
+        Row of the store holding the cell that contains the point (x, y), in
+        OSGB36 coordinates. If that cell has no data, the closest cell with
+        data within SEARCH_RADIUS is used. Raises KeyError if there is none.
+        """
+        res = self.header["resolution"]
+        ix = int(np.floor((x - self.header["xmin"])/res))
+        iy = int(np.floor((y - self.header["ymin"])/res))
+        if 0 <= iy < self.index.shape[0] and 0 <= ix < self.index.shape[1] and self.index[iy, ix] >= 0:
+            return int(self.index[iy, ix])
+
+        # closest cell with data (Euclidean distance between cell centres)
+        r = int(SEARCH_RADIUS // res)
+        y0, x0 = max(iy - r, 0), max(ix - r, 0)
+        window = self.index[y0:iy + r + 1, x0:ix + r + 1]
+        wy, wx = np.nonzero(window >= 0)
+        if len(wy) == 0:
+            msg = "No Chess-Scape data within %s m of (%s, %s)" % (SEARCH_RADIUS, x, y)
+            raise KeyError(msg)
+        closest = np.argmin((wy + y0 - iy)**2 + (wx + x0 - ix)**2)
+        return int(window[wy[closest], wx[closest]])
+
+    def read_cell(self, x, y):
+        """
+        Return the series of the cell containing (x, y) as a dictionary with
+        the 'DAY' datetime64[D] array and one float32 array per column, with
+        NaN for missing values.
+        """
+        row = self.cell_row(x, y)
+        start, stop = int(self.offsets[row]), int(self.offsets[row + 1])
+        with open(self.data_fname, "rb") as fp:
+            fp.seek(start)
+            chunk = fp.read(stop - start)
+        block = unpack_cell(chunk, len(self.days))
+        columns = {label: block[k] for k, label in enumerate(self.header["columns"])}
+        columns["DAY"] = self.days
+        return columns
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(rcp, ensemble):
+    """Return the process-wide ChessScapeStore of an rcp and ensemble"""
+    with _stores_lock:
+        if (rcp, ensemble) not in _stores:
+            _stores[(rcp, ensemble)] = ChessScapeStore(rcp, ensemble)
+        return _stores[(rcp, ensemble)]
@@ -53,6 +53,41 @@ class SingleRotationAgroManager(YAMLAgroManagementReader):
         variety_names = [item for item in variety_names if item is not None]
         return variety_names[0]
 
+    @property
+    def campaign_window(self):
+        """
+        Retrieve the first and last simulation dates of the agromanagement, i.e.
+        the weather needed to run it (see NetCDFWeatherDataProvider start_date and
+        end_date). As in the PCSE AgroManager, the last date is the start date of a
+        trailing empty campaign if there is one, otherwise the latest end date of
+        the crop calendars (harvest date or crop start date plus max_duration) and
+        of the timed events. If there is none, the last date is None, i.e. the
+        whole weather series from the first date is used.
+        """
+        campaign_dates = [date_key for item in self for date_key in item]
+        campaigns = [item[date_key] for item in self for date_key in item]
+        if not campaign_dates:
+            raise ValueError("The agromanagement has no campaigns, hence no simulation dates.")
+        start_date = campaign_dates[0]
+        if len(campaigns) > 1 and not campaigns[-1]:
+            return start_date, campaign_dates[-1]
+
+        end_dates = []
+        for campaign in campaigns:
+            if not campaign:
+                continue
+            crop_calendar = campaign.get("CropCalendar")
+            if crop_calendar:
+                if crop_calendar["crop_end_type"] in ["harvest", "earliest"]:
+                    end_dates.append(crop_calendar["crop_end_date"])
+                else:
+                    end_dates.append(crop_calendar["crop_start_date"] +
+                                     dt.timedelta(days=crop_calendar["max_duration"]))
+            for timed_events in campaign.get("TimedEvents") or []:
+                for event in timed_events["events_table"]:
+                    end_dates.extend(event.keys())
+        return start_date, max(end_dates) if end_dates else None
+
     def change_year(self, new_year):
         """
         Change calendar year of single rotation crop.
@@ -357,15 +357,28 @@ def get_whsd_data(parcel_OS_code, vars):
         seer_soilvars = ['adj' + x for x in vars]
         to_get = str(seer_soilvars).replace('[\'', '').replace('\']', '')
         x, y = osgrid2lonlat(parcel_OS_code)
+        # The closest 2km cell is searched first among the cells with centre
+        # within 2km of the parcel, which holds the cell containing it, and
+        # only on the whole grid if there is none (e.g. near the coastline)
         sql = '''
             SELECT {to_get}
             FROM {db_schema}.seer_soil
             JOIN {db_schema}.seer_regions ON seer_soil.new2kid = seer_regions.new2kid
-            ORDER BY SQRT(POWER(seer_regions.xmn + 1000 - {x}, 2) + POWER(seer_regions.ymn + 1000 - {y}, 2))
+            {window}
+            ORDER BY POWER(seer_regions.xmn + 1000 - {x}, 2) + POWER(seer_regions.ymn + 1000 - {y}, 2)
             LIMIT 1;
-            '''.format(to_get=to_get.replace("'", ""), db_schema=db_schema, x=x, y=y)
-        cur.execute(sql)
-        t = cur.fetchall()[0]
+            '''
+        window = '''
+            WHERE seer_regions.xmn BETWEEN {x} - 3000 AND {x} + 1000
+              AND seer_regions.ymn BETWEEN {y} - 3000 AND {y} + 1000
+              AND POWER(seer_regions.xmn + 1000 - {x}, 2) + POWER(seer_regions.ymn + 1000 - {y}, 2) <= 4000000
+            '''.format(x=x, y=y)
+        for where in [window, '']:
+            cur.execute(sql.format(to_get=to_get.replace("'", ""), db_schema=db_schema, x=x, y=y, window=where))
+            t = cur.fetchall()
+            if t:
+                break
+        t = t[0]
         t = [int(x) for x in t]
         parcel_dict = {key:val for (key, val) in zip(vars, t)}
         return parcel_dict
@@ -376,6 +389,50 @@ def get_whsd_data(parcel_OS_code, vars):
             conn.close()
 
 
+# Get WHSD data from database for all the SEER cells
+def get_seer_soil_table(vars):
+    '''
+    Retrieve from the SEER NEV database the soil data of all the cells of
+    the 2km SEER grid, from the World Harmonized Soil Database, with one
+    query (see cropyields.seer).
+
+    INPUT ARGUMENTS
+    :param vars: list of variables to query (i.e., the data needed)
+           Default variables required are % Sand, % silt and % clay
+
+    Returns a dataframe with the 'new2kid', 'xmn' and 'ymn' (south-west
+    corner) of each cell and the variables, ordered by new2kid.
+    '''
+    db_name = whsd_parameters['db_name']
+    db_user = whsd_parameters['db_user']
+    db_password = whsd_parameters['db_password']
+    db_schema = whsd_parameters['schema']
+    conn = None
+    try:
+        conn = psycopg2.connect(user=db_user,
+                                password=db_password,
+                                database=db_name,
+                                host='127.0.0.1',
+                                port= '5432')
+        conn.autocommit = True
+        cur = conn.cursor()
+        seer_soilvars = ['seer_soil.adj' + x for x in vars]
+        sql = '''
+            SELECT seer_regions.new2kid, seer_regions.xmn, seer_regions.ymn, {to_get}
+            FROM {db_schema}.seer_soil
+            JOIN {db_schema}.seer_regions ON seer_soil.new2kid = seer_regions.new2kid
+            ORDER BY seer_regions.new2kid;
+            '''.format(to_get=', '.join(seer_soilvars), db_schema=db_schema)
+        cur.execute(sql)
+        t = cur.fetchall()
+        return pd.DataFrame(t, columns=['new2kid', 'xmn', 'ymn'] + list(vars))
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
 def find_farm(OSGrid_code):
     """
     Find farm managing the parcel at 'OSGrid code' location
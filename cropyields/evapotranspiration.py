@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+REFERENCE EVAPOTRANSPIRATION
+============================
+
+Array versions of the reference evapotranspiration routines in 'pcse.util'
+(astro, penman, penman_monteith and reference_ET). They compute E0, ES0 and
+ET0 for a whole time series in one call instead of one day at a time and
+return the same values as the scalar PCSE implementation.
+
+Site variables (LAT, ELEV, ANGSTA, ANGSTB) can be scalars or arrays, while
+the weather variables (TMIN, TMAX, IRRAD, VAP, WIND) are arrays of equal
+length, one value per day.
+"""
+import numpy as np
+
+# Constants of the modified Penman model
+_PENMAN_PSYCON = 0.67     # psychrometric instrument constant (mbar/Celsius)
+_REFCFW = 0.05            # albedo for a water surface
+_REFCFS = 0.15            # albedo for a soil surface
+_REFCFC = 0.25            # albedo for a canopy
+_LHVAP = 2.45E6           # latent heat of evaporation of water (J/kg=J/mm)
+_STBC = 5.670373E-8 * 24*60*60  # Stefan Boltzmann constant (J/m2/d/K4)
+
+# Constants of the FAO Penman-Monteith model
+_PM_PSYCON = 0.665        # psychrometric instrument constant (kPa/Celsius)
+_PM_REFCFC = 0.23         # albedo of the reference crop canopy
+_PM_CRES = 70.            # surface resistance of the reference canopy (s/m)
+_PM_STBC = 4.903E-3       # Stefan Boltzmann constant (J/m2/d/K4)
+
+
+def day_of_year(days):
+    """
+    Day of the year (Jan 1st = 1) for an array of dates. 'days' can be
+    a sequence of datetime.date objects, a NumPy datetime64 array or an
+    array of integer days of the year, which is returned unchanged.
+    """
+    days = np.asarray(days)
+    if np.issubdtype(days.dtype, np.integer):
+        return days
+    days = days.astype("datetime64[D]")
+    return (days - days.astype("datetime64[Y]")).astype(int) + 1
+
+
+def astro(DAY, LAT, AVRAD):
+    """
+    Array version of the ASTRO routine in 'pcse.util'. Returns a dictionary
+    with the astronomic daylength (DAYL), the seasonal offset (SINLD) and
+    amplitude (COSLD) of the sine of solar height, the daily atmospheric
+    transmission (ATMTR) and the Angot radiation at the top of the
+    atmosphere (ANGOT, J m-2 d-1). Only the quantities needed by the
+    reference evapotranspiration models are computed.
+
+    :param DAY: dates (or days of the year) of the radiation values
+    :param LAT: latitude of the location in decimal degrees
+    :param AVRAD: daily global incoming radiation (J/m2/day)
+    """
+    LAT = np.asarray(LAT, dtype=float)
+    if np.any(np.abs(LAT) > 90.):
+        msg = "Latitude not between -90 and 90"
+        raise RuntimeError(msg)
+    IDAY = day_of_year(DAY).astype(float)
+    AVRAD = np.asarray(AVRAD, dtype=float)
+    RAD = np.radians(1.)
+
+    # Declination and solar constant for this day
+    DEC = -np.arcsin(np.sin(23.45*RAD)*np.cos(2.*np.pi*(IDAY+10.)/365.))
+    SC = 1370.*(1.+0.033*np.cos(2.*np.pi*IDAY/365.))
+
+    # daylength from intermediate variables SINLD, COSLD and AOB. AOB is
+    # clipped to [-1, 1], where the daylength reaches 0 or 24 hours
+    SINLD = np.sin(RAD*LAT)*np.sin(DEC)
+    COSLD = np.cos(RAD*LAT)*np.cos(DEC)
+    AOB = np.clip(SINLD/COSLD, -1., 1.)
+    DAYL = 12.0*(1.+2.*np.arcsin(AOB)/np.pi)
+    DSINB = 3600.*(DAYL*SINLD+24.*COSLD*np.sqrt(1.-AOB**2)/np.pi)
+
+    # extraterrestrial radiation and atmospheric transmission
+    ANGOT = SC*DSINB
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ATMTR = np.where(DAYL > 0., AVRAD/ANGOT, 0.)
+
+    return {"DAYL": DAYL, "SINLD": SINLD, "COSLD": COSLD, "ATMTR": ATMTR, "ANGOT": ANGOT}
+
+
+def penman(DAY, LAT, ELEV, TMIN, TMAX, AVRAD, VAP, WIND2, ANGSTA, ANGSTB):
+    """
+    Array version of 'pcse.util.penman'. Calculates the potential
+    evapo(transpi)ration rates from a free water surface (E0), a bare soil
+    surface (ES0) and a crop canopy (ET0) in mm/d following Penman (1948).
+
+    Temperatures in Celsius, AVRAD in J m-2 d-1, VAP in hPa and WIND2
+    (windspeed at 2 meter) in m/s. Returns a tuple of arrays (E0, ES0, ET0).
+    """
+    TMIN, TMAX = np.asarray(TMIN, dtype=float), np.asarray(TMAX, dtype=float)
+    AVRAD, WIND2 = np.asarray(AVRAD, dtype=float), np.asarray(WIND2, dtype=float)
+
+    # mean daily temperature and temperature difference (Celsius)
+    # coefficient Bu in wind function, dependent on temperature difference
+    TMPA = (TMIN+TMAX)/2.
+    TDIF = TMAX - TMIN
+    BU = 0.54 + 0.35 * np.clip((TDIF-12.)/4., 0., 1.)
+
+    # barometric pressure (mbar) and psychrometric constant (mbar/Celsius)
+    PBAR = 1013.*np.exp(-0.034*np.asarray(ELEV, dtype=float)/(TMPA+273.))
+    GAMMA = _PENMAN_PSYCON*PBAR/1013.
+
+    # saturated vapour pressure according to equation of Goudriaan (1977),
+    # its derivative with respect to temperature; measured vapour pressure
+    # not to exceed saturated vapour pressure
+    SVAP = 6.10588 * np.exp(17.32491*TMPA/(TMPA+238.102))
+    DELTA = 238.102*17.32491*SVAP/(TMPA+238.102)**2
+    VAP = np.minimum(np.asarray(VAP, dtype=float), SVAP)
+
+    # n/N (RELSSD) from the Angstrom formula: RI=RA(A+B.n/N)
+    r = astro(DAY, LAT, AVRAD)
+    RELSSD = np.clip((r["ATMTR"]-np.abs(ANGSTA))/np.abs(ANGSTB), 0., 1.)
+
+    # net outgoing long-wave radiation (J/m2/d) acc. to Brunt (1932)
+    RB = _STBC*(TMPA+273.)**4*(0.56-0.079*np.sqrt(VAP))*(0.1+0.9*RELSSD)
+
+    # net absorbed radiation, expressed in mm/d
+    RNW = (AVRAD*(1.-_REFCFW)-RB)/_LHVAP
+    RNS = (AVRAD*(1.-_REFCFS)-RB)/_LHVAP
+    RNC = (AVRAD*(1.-_REFCFC)-RB)/_LHVAP
+
+    # evaporative demand of the atmosphere (mm/d)
+    EA = 0.26 * np.maximum(0., (SVAP-VAP)) * (0.5+BU*WIND2)
+    EAC = 0.26 * np.maximum(0., (SVAP-VAP)) * (1.0+BU*WIND2)
+
+    # Penman formula (1948), reference evaporation >= 0.
+    E0 = np.maximum(0., (DELTA*RNW+GAMMA*EA)/(DELTA+GAMMA))
+    ES0 = np.maximum(0., (DELTA*RNS+GAMMA*EA)/(DELTA+GAMMA))
+    ET0 = np.maximum(0., (DELTA*RNC+GAMMA*EAC)/(DELTA+GAMMA))
+
+    return E0, ES0, ET0
+
+
+def penman_monteith(DAY, LAT, ELEV, TMIN, TMAX, AVRAD, VAP, WIND2):
+    """
+    Array version of 'pcse.util.penman_monteith'. Calculates the reference
+    ET0 (mm/d) of a reference crop canopy following FAO paper 56.
+
+    Temperatures in Celsius, AVRAD in J m-2 d-1, VAP in hPa and WIND2
+    (windspeed at 2 meter) in m/s.
+    """
+    TMIN, TMAX = np.asarray(TMIN, dtype=float), np.asarray(TMAX, dtype=float)
+    AVRAD, WIND2 = np.asarray(AVRAD, dtype=float), np.asarray(WIND2, dtype=float)
+    ELEV = np.asarray(ELEV, dtype=float)
+
+    # mean daily temperature (Celsius), vapour pressure to kPa
+    TMPA = (TMIN+TMAX)/2.
+    VAP = np.asarray(VAP, dtype=float)/10.
+
+    # atmospheric pressure at standard temperature of 293K (kPa)
+    # and psychrometric constant (kPa/Celsius)
+    T = 293.0
+    PATM = 101.3 * np.power((T - (0.0065*ELEV))/T, 5.26)
+    GAMMA = _PM_PSYCON * PATM * 1.0E-3
+
+    # slope of the SVAP-temperature curve (kPa/Celsius)
+    SVAP_TMPA = _sat_vapour_pressure(TMPA)
+    DELTA = (4098. * SVAP_TMPA)/np.power((TMPA + 237.3), 2)
+
+    # daily average saturated vapour pressure [kPa] from min/max temperature;
+    # measured vapour pressure not to exceed saturated vapour pressure
+    SVAP = (_sat_vapour_pressure(TMAX) + _sat_vapour_pressure(TMIN)) / 2.
+    VAP = np.minimum(VAP, SVAP)
+
+    # preliminary net outgoing long-wave radiation (J/m2/d)
+    STB_TMAX = _PM_STBC * np.power(TMAX + 273.16, 4)
+    STB_TMIN = _PM_STBC * np.power(TMIN + 273.16, 4)
+    RNL_TMP = ((STB_TMAX + STB_TMIN) / 2.) * (0.34 - 0.14 * np.sqrt(VAP))
+
+    # clear sky radiation [J/m2/DAY] from Angot TOA radiation
+    r = astro(DAY, LAT, AVRAD)
+    CSKYRAD = (0.75 + (2e-05 * ELEV)) * r["ANGOT"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # final net outgoing longwave radiation [J/m2/day] and radiative
+        # evaporation equivalent for the reference surface [mm/DAY]
+        RNL = RNL_TMP * (1.35 * (AVRAD/CSKYRAD) - 0.35)
+        RN = ((1-_PM_REFCFC) * AVRAD - RNL)/_LHVAP
+
+        # aerodynamic evaporation equivalent [mm/day] and modified
+        # psychometric constant (gamma*)[kPa/C]
+        EA = ((900./(TMPA + 273)) * WIND2 * (SVAP - VAP))
+        MGAMMA = GAMMA * (1. + (_PM_CRES/208.*WIND2))
+
+        # soil heat flux is set to zero
+        ET0 = (DELTA * RN)/(DELTA + MGAMMA) + (GAMMA * EA)/(DELTA + MGAMMA)
+
+    return np.where(CSKYRAD > 0, np.maximum(0., ET0), 0.)
+
+
+def reference_ET(DAY, LAT, ELEV, TMIN, TMAX, IRRAD, VAP, WIND,
+                 ANGSTA, ANGSTB, ETMODEL="PM", **kwargs):
+    """
+    Array version of 'pcse.util.reference_ET'. Calculates the reference
+    evapotranspiration values E0, ES0 and ET0 (mm/d) for whole time series.
+
+    E0 and ES0 are computed with the modified Penman approach, ET0 with
+    either the Penman-Monteith (ETMODEL='PM', default) or the modified
+    Penman (ETMODEL='P') approach. Extra keyword arguments (e.g. RAIN) are
+    ignored, so that a dictionary of weather columns can be passed directly.
+
+    :param DAY: sequence of dates (datetime.date or datetime64)
+    :param LAT: latitude of the site (degrees)
+    :param ELEV: elevation above sea level (m)
+    :param TMIN: array of minimum temperatures (C)
+    :param TMAX: array of maximum temperatures (C)
+    :param IRRAD: array of daily shortwave radiation (J m-2 d-1)
+    :param VAP: array of 24-hour average vapour pressure (hPa)
+    :param WIND: array of 24-hour average windspeed at 2 meter (m/s)
+    :param ANGSTA: empirical constant A in the Angstrom formula
+    :param ANGSTB: empirical constant B in the Angstrom formula
+
+    Returns a tuple of arrays (E0, ES0, ET0)
+    """
+    if ETMODEL not in ["PM", "P"]:
+        msg = "Variable ETMODEL can have values 'PM'|'P' only."
+        raise RuntimeError(msg)
+
+    E0, ES0, ET0 = penman(DAY, LAT, ELEV, TMIN, TMAX, IRRAD, VAP, WIND, ANGSTA, ANGSTB)
+    if ETMODEL == "PM":
+        ET0 = penman_monteith(DAY, LAT, ELEV, TMIN, TMAX, IRRAD, VAP, WIND)
+
+    return E0, ES0, ET0
+
+
+def _sat_vapour_pressure(temp):
+    """Saturated vapour pressure (kPa) at temperature 'temp' (Celsius)"""
+    return 0.6108 * np.exp((17.27 * temp) / (237.3 + temp))
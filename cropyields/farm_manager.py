@@ -81,12 +81,18 @@ class Farm:
             result_dict[parcel_id] = {"geometry": geometry, "area": area, "crop": {}}
 
         farmed_parcels = kwargs.keys()
+        # soil data of all the farmed parcels, with a single Rosetta run
+        if soilsource == "SoilGrids":
+            soil_providers = SoilGridsDataProvider.from_codes(
+                [parcel_id for parcel_id in self.parcel_ids if parcel_id in farmed_parcels]
+            )
+        else:
+            soil_providers = WHSDDataProvider.from_codes(
+                [parcel_id for parcel_id in self.parcel_ids if parcel_id in farmed_parcels]
+            )
         for parcel_id in self.parcel_ids:
             if parcel_id in farmed_parcels:
-                if soilsource == "SoilGrids":
-                    soildata = SoilGridsDataProvider(parcel_id)
-                else:
-                    soildata = WHSDDataProvider(parcel_id)
+                soildata = soil_providers[parcel_id]
                 try:
                     wdp = NetCDFWeatherDataProvider(
                         parcel_id, rcp, ensemble, force_update=False
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+PREFETCH
+========
+
+Background construction of the inputs of a bulk simulation loop (e.g. the
+soil and weather providers of the next parcels) while the current item is
+simulated, so that netCDF and database I/O overlaps with WOFOST.
+
+Items are built by a bounded pool of threads and handed out in their
+original order. At most 'depth' items are built ahead of the one being
+simulated: when the loop falls behind, the pool waits for it rather than
+filling memory with providers (backpressure).
+"""
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch(items, build, depth=4, workers=2):
+    """
+    Yield (item, result, error) for each element of 'items', in order, where
+    'result' is build(item), run in a background thread, and 'error' is the
+    exception raised by build, if any (in which case 'result' is None).
+
+    :param items: iterable of the items to build, e.g. parcel OS grid codes
+    :param build: function building the inputs of an item
+    :param depth: maximum number of items built ahead of the one being
+           consumed (queue depth)
+    :param workers: number of threads building items
+
+    Typical use:
+        for parcel, result, error in prefetch(parcels, build_providers, depth=8):
+            if error is not None:
+                # log or record the failed parcel
+                continue
+            soildata, wdp = result
+            ...
+    """
+    if depth < 1 or workers < 1:
+        msg = "Prefetch depth and workers must be at least 1, got %s and %s" % (depth, workers)
+        raise ValueError(msg)
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = deque((item, executor.submit(build, item)) for item in itertools.islice(items, depth))
+        while pending:
+            item, future = pending.popleft()
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, e
+            # keep the queue full while the item is consumed
+            for item_ahead in itertools.islice(items, 1):
+                pending.append((item_ahead, executor.submit(build, item_ahead)))
+            yield item, result, error
+    finally:
+        # items built ahead of a loop that stopped early are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
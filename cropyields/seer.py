@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+SEER SOIL TABLE
+===============
+
+In-memory table of the WHSD soil data (sand, silt and clay) of all the cells
+of the 2km SEER grid, so that the WHSDDataProvider needs no database query
+per parcel.
+
+The table is read from the SEER NEV database with a single query (see
+db_manager.get_seer_soil_table) and saved to 'seer_soil.npz' in
+data_dirs['utils_dir'], from which it is loaded afterwards (if the file
+cannot be written, the table is only kept in memory). The file is
+not updated when the database changes: call 'preload_seer_soil_table' with
+refresh=True (or delete the file) to read the database again.
+
+Parcels are assigned the cell whose centre is closest to them, as by
+db_manager.get_whsd_data. The cells form a regular 2km grid, hence the cell
+containing a parcel is found with index arithmetic on its BNG coordinates;
+a KD-tree of the cell centres is used for the parcels outside any cell
+(e.g. near the coastline), or for all of them if the cells are not aligned
+to a regular grid.
+
+The table is loaded on first use; call 'preload_seer_soil_table' before
+forking worker processes to share it with all of them.
+"""
+import json
+import threading
+import warnings
+import zipfile
+import numpy as np
+from scipy.spatial import cKDTree
+from cropyields import data_dirs
+from cropyields.utils import osgrid2lonlat
+from cropyields.weather_cache import write_atomic
+
+# Size (m) of the cells of the SEER grid
+SEER_CELL_SIZE = 2000.
+
+# Soil variables of the table, as in the soil data providers
+SEER_SOIL_VARIABLES = ["sand", "silt", "clay"]
+
+
+def seer_filename():
+    """Return the name of the binary file of the SEER soil table"""
+    return data_dirs['utils_dir'] + 'seer_soil.npz'
+
+
+class SeerSoilTable:
+    """
+    Soil data of the cells of the SEER grid, with a regular grid index and a
+    KD-tree of the cell centres.
+
+    :param new2kid: array of the ids of the cells
+    :param xmn: array of the x coordinates (BNG) of the south-west corners of the cells
+    :param ymn: array of the y coordinates (BNG) of the south-west corners of the cells
+    :param textures: array of shape (n_cells, n_variables) of the soil data of the cells
+    :param variables: names of the soil variables
+    """
+
+    def __init__(self, new2kid, xmn, ymn, textures, variables=SEER_SOIL_VARIABLES):
+        self.new2kid = np.asarray(new2kid, dtype=np.int64)
+        self.xmn, self.ymn = np.asarray(xmn, dtype=float), np.asarray(ymn, dtype=float)
+        self.textures = np.asarray(textures, dtype=float).reshape(len(self.new2kid), -1)
+        self.variables = list(variables)
+        if len(self.new2kid) == 0:
+            msg = "The SEER soil table has no cells"
+            raise ValueError(msg)
+        centres = np.column_stack([self.xmn, self.ymn]) + SEER_CELL_SIZE/2.
+        self.tree = cKDTree(centres)
+
+        # index of the regular grid, with the row of the table of each cell (-1 where there is none)
+        self.x0, self.y0 = self.xmn.min(), self.ymn.min()
+        ix, iy = (self.xmn - self.x0)/SEER_CELL_SIZE, (self.ymn - self.y0)/SEER_CELL_SIZE
+        self.grid = None
+        if np.array_equal(ix, np.round(ix)) and np.array_equal(iy, np.round(iy)):
+            ix, iy = ix.astype(int), iy.astype(int)
+            self.grid = np.full((iy.max() + 1, ix.max() + 1), -1, dtype=np.int32)
+            self.grid[iy, ix] = np.arange(len(self.new2kid))
+
+    @classmethod
+    def from_db(cls, variables=SEER_SOIL_VARIABLES):
+        """Read the table from the SEER NEV database, with one query"""
+        # the database is only needed when the table is not loaded from its file
+        from cropyields.db_manager import get_seer_soil_table
+        df = get_seer_soil_table(variables)
+        if df is None:
+            msg = "Could not read the SEER soil data from the database"
+            raise IOError(msg)
+        # WHSD values are truncated to integers, as by get_whsd_data
+        textures = np.trunc(df[variables].to_numpy(dtype=float))
+        return cls(df['new2kid'], df['xmn'], df['ymn'], textures, variables)
+
+    @classmethod
+    def load(cls, fname=None, variables=SEER_SOIL_VARIABLES, refresh=False):
+        """
+        Load the table from the binary file, or read it from the database and
+        write the binary file if this does not exist, holds other variables
+        or 'refresh' is True.
+        """
+        fname = fname or seer_filename()
+        if not refresh:
+            try:
+                with np.load(fname) as f:
+                    if json.loads(str(f['variables'])) == list(variables):
+                        return cls(f['new2kid'], f['xmn'], f['ymn'], f['textures'], variables)
+            except (IOError, KeyError, ValueError, zipfile.BadZipFile):
+                pass
+
+        table = cls.from_db(variables)
+        try:
+            table.save(fname)
+        except OSError as e:
+            # e.g. read-only utils directory: the table is only kept in memory
+            warnings.warn("Cannot write the SEER soil table to %s: %s" % (fname, e))
+        return table
+
+    def save(self, fname):
+        """
+        Write the table to a binary file, through a temporary file of this
+        process (see write_atomic)
+        """
+        write_atomic(fname, lambda fp: np.savez(fp, variables=json.dumps(self.variables), new2kid=self.new2kid,
+                                                xmn=self.xmn, ymn=self.ymn, textures=self.textures),
+                     suffix='.tmp.npz')
+
+    def rows(self, x, y):
+        """
+        Return the rows of the table of the cells whose centre is closest to
+        arrays of BNG coordinates.
+        """
+        x, y = np.atleast_1d(np.asarray(x, dtype=float)), np.atleast_1d(np.asarray(y, dtype=float))
+        rows = np.full(len(x), -1, dtype=np.int64)
+        if self.grid is not None:
+            ix = np.floor((x - self.x0)/SEER_CELL_SIZE).astype(int)
+            iy = np.floor((y - self.y0)/SEER_CELL_SIZE).astype(int)
+            inside = (ix >= 0) & (ix < self.grid.shape[1]) & (iy >= 0) & (iy < self.grid.shape[0])
+            rows[inside] = self.grid[iy[inside], ix[inside]]
+        outside = rows < 0
+        if outside.any():
+            _, rows[outside] = self.tree.query(np.column_stack([x[outside], y[outside]]))
+        return rows
+
+    def _parcel_rows(self, osgrid_codes):
+        osgrid_codes = list(osgrid_codes)
+        x, y = zip(*[osgrid2lonlat(code) for code in osgrid_codes]) if osgrid_codes else ((), ())
+        return self.rows(x, y)
+
+    def cells(self, osgrid_codes):
+        """Return the new2kid of the SEER cells of many parcels"""
+        return self.new2kid[self._parcel_rows(osgrid_codes)]
+
+    def texture(self, osgrid_codes):
+        """Return an array of shape (N, n_variables) with the soil data of many parcels"""
+        return self.textures[self._parcel_rows(osgrid_codes)]
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def seer_soil_table():
+    """Return the process-wide SeerSoilTable, loading it on first use"""
+    global _table
+    with _table_lock:
+        if _table is None:
+            _table = SeerSoilTable.load()
+        return _table
+
+
+def preload_seer_soil_table(refresh=False):
+    """
+    Load the process-wide SeerSoilTable, e.g. before forking worker processes.
+    With refresh=True the table is read from the database again.
+    """
+    global _table
+    with _table_lock:
+        if _table is None or refresh:
+            _table = SeerSoilTable.load(refresh=refresh)
+        return _table
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+SOIL PARAMETER CACHE
+====================
+
+Cache of the finished soil parameters (SOLNAM, SMTAB, SMW, SMFCF, SM0,
+CONTAB, K0) of the soil data providers, so that parcels sharing the same soil
+cell or the same soil texture do not repeat the soil lookup, the Rosetta run
+and the construction of the tables. Entries are keyed by tuples whose first
+item is the kind of key:
+    - ('cell', source, ...): the cell of a soil data source, e.g. the raster
+      cell of the SoilGrids file;
+    - ('texture', sand, silt, clay): the soil texture.
+
+The in-process cache is bounded and drops the least recently used entries.
+An optional on-disk cache (a SQLite file, see 'use_disk') keeps the entries
+across runs and processes. Hits and misses are counted by kind of key (see
+'stats').
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from cropyields import data_dirs
+
+
+class SoilParameterCache:
+    """
+    Bounded in-process cache of soil parameter dictionaries, with an optional
+    on-disk layer.
+
+    :param maxsize: maximum number of entries kept in memory
+    :param disk_fname: optional name of the SQLite file of the on-disk cache
+    """
+
+    def __init__(self, maxsize=100000, disk_fname=None):
+        self.maxsize = maxsize
+        self.disk_fname = disk_fname
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn, self._pid = None, None
+        self._counts = {}
+
+    def use_disk(self, disk_fname=None):
+        """Enable the on-disk cache, by default 'soil_parameters.sqlite' in data_dirs['soils_dir']"""
+        with self._lock:
+            self.disk_fname = disk_fname or data_dirs['soils_dir'] + 'soil_parameters.sqlite'
+            self._conn, self._pid = None, None
+
+    def _connection(self):
+        # one connection per process, as SQLite connections cannot be shared after a fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.disk_fname, timeout=60, check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS soil_parameters (key TEXT PRIMARY KEY, value TEXT)')
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _disk_key(key):
+        return json.dumps([k.item() if hasattr(k, 'item') else k for k in key])
+
+    def _count(self, key, outcome):
+        counts = self._counts.setdefault(key[0], {"hits": 0, "disk_hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def get(self, key):
+        """Return the soil parameters of 'key', or None if they are not cached"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count(key, "hits")
+                return self._entries[key]
+            if self.disk_fname is not None:
+                row = self._connection().execute('SELECT value FROM soil_parameters WHERE key = ?',
+                                                 (self._disk_key(key),)).fetchone()
+                if row is not None:
+                    self._count(key, "disk_hits")
+                    parameters = json.loads(row[0])
+                    self._remember(key, parameters)
+                    return parameters
+            self._count(key, "misses")
+            return None
+
+    def put(self, key, parameters):
+        """Cache the soil parameters of 'key'"""
+        with self._lock:
+            self._remember(key, parameters)
+            if self.disk_fname is not None:
+                conn = self._connection()
+                conn.execute('INSERT OR REPLACE INTO soil_parameters (key, value) VALUES (?, ?)',
+                             (self._disk_key(key), json.dumps(parameters)))
+                conn.commit()
+
+    def _remember(self, key, parameters):
+        self._entries[key] = parameters
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Return the number of entries in memory and, by kind of key ('cell',
+        'texture'), the counts of hits in memory, hits on disk and misses.
+        """
+        with self._lock:
+            return {"size": len(self._entries), **{kind: dict(c) for kind, c in self._counts.items()}}
+
+    def clear(self):
+        """Drop the in-memory entries and reset the counts (the on-disk cache is kept)"""
+        with self._lock:
+            self._entries = OrderedDict()
+            self._counts = {}
+
+
+# Process-wide cache used by the soil data providers
+soil_parameter_cache = SoilParameterCache()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+SOIL HYDRAULIC RASTER
+=====================
+
+One-off computation of the soil parameters (SOLNAM, SMW, SMFCF, SM0, K0,
+SMTAB and CONTAB) of every cell of a regular British National Grid raster
+covering GB, from the SoilGrids file 'GB_soil_data.nc' (see
+'build_soil_hydraulic_raster' and build_soil_hydraulics.py). The raster is
+read by the SoilHydraulicsDataProvider, which then needs no Rosetta run at
+simulation time.
+
+The raster is built in two passes, both run over a pool of worker processes:
+    - the soil texture of each BNG cell is read from the SoilGrids cell nearest
+      to its centre, in windows of rows of the grid. Textures are rounded to
+      'texture_resolution' (%), so that the cells share a small number of
+      distinct textures;
+    - the soil parameters of the distinct textures are computed in chunks, with
+      one Rosetta run per chunk.
+The raster stores the row of the table of distinct textures of each cell, and
+the table itself (see SoilHydraulicRaster).
+"""
+import multiprocessing
+import numpy as np
+from pyproj import Transformer
+from cropyields import data_dirs
+from cropyields.SoilManager import SoilDataProvider, SoilGridsDataProvider, SoilGridsRaster, SoilHydraulicRaster
+from cropyields.weather_cache import source_identity
+
+# Default grid: 250m cells (as SoilGrids) over the BNG extent of GB
+HYDRAULIC_GRID = {"x0": 0., "y0": 0., "resolution": 250., "nx": 2800, "ny": 5200}
+
+
+def _window_textures(args):
+    """
+    Read the rounded soil textures of the cells of a window of rows of the
+    grid, as an array of shape (n_rows, nx, 3), with NaN where there is no
+    soil data. Runs in a worker process.
+    """
+    soil_fname, grid, row0, row1, texture_resolution = args
+    raster = SoilGridsRaster(soil_fname, SoilDataProvider._DEFAULT_SOILVARS)
+    x = grid["x0"] + (np.arange(grid["nx"]) + 0.5) * grid["resolution"]
+    y = grid["y0"] + (np.arange(row0, row1) + 0.5) * grid["resolution"]
+    xx, yy = np.meshgrid(x, y)
+    lon, lat = Transformer.from_crs(27700, 4326, always_xy=True).transform(xx.ravel(), yy.ravel())
+    textures = np.array(raster.values_at(lon, lat), dtype=float)
+
+    # cells outside the SoilGrids file would get the values of its edges
+    half_x = abs(raster.x[1] - raster.x[0]) / 2.
+    half_y = abs(raster.y[1] - raster.y[0]) / 2.
+    outside = ((lon < raster.x.min() - half_x) | (lon > raster.x.max() + half_x) |
+               (lat < raster.y.min() - half_y) | (lat > raster.y.max() + half_y))
+    textures[outside] = np.nan
+    textures = np.round(textures / texture_resolution) * texture_resolution
+    return row0, textures.reshape(row1 - row0, grid["nx"], -1)
+
+
+def _texture_parameters(textures):
+    """Soil parameters of a chunk of distinct textures (see hydraulic_arrays). Runs in a worker process."""
+    return SoilDataProvider.hydraulic_arrays(textures)
+
+
+def build_soil_hydraulic_raster(soil_fname=None, base_fname=None, grid=None, texture_resolution=1.,
+                                window_rows=100, chunk_size=5000, processes=None, verbose=True):
+    """
+    Compute the soil parameters of every cell of a BNG grid from the SoilGrids
+    file and write them as a SoilHydraulicRaster.
+
+    :param soil_fname: name of the SoilGrids netCDF file, by default the one of
+           the SoilGridsDataProvider
+    :param base_fname: name of the raster files, without suffix, by default the
+           one read by the SoilHydraulicsDataProvider
+    :param grid: dictionary with the south-west corner ('x0', 'y0'), the
+           'resolution' (m) and the size ('nx', 'ny') of the grid, by default
+           HYDRAULIC_GRID
+    :param texture_resolution: resolution (%) to which the soil textures are
+           rounded
+    :param window_rows: number of rows of the grid read by each task
+    :param chunk_size: number of distinct textures passed to Rosetta by each task
+    :param processes: number of worker processes, by default the number of CPUs
+    :param verbose: print progress
+
+    Returns the SoilHydraulicRaster.
+    """
+    soil_fname = soil_fname or SoilGridsDataProvider._SOIL_PATH
+    base_fname = base_fname or data_dirs["soils_dir"] + "GB_soil_hydraulics"
+    grid = dict(grid or HYDRAULIC_GRID)
+    if texture_resolution <= 0:
+        msg = "The texture resolution must be positive, got %s" % texture_resolution
+        raise ValueError(msg)
+
+    # extract the SoilGrids texture grids once, before the workers memory-map them
+    SoilGridsRaster(soil_fname, SoilDataProvider._DEFAULT_SOILVARS).data
+
+    # row 0 of the parameter table holds no data
+    index = np.zeros((grid["ny"], grid["nx"]), dtype=np.int32)
+    soils = {}
+    jobs = [(soil_fname, grid, row0, min(row0 + window_rows, grid["ny"]), texture_resolution)
+            for row0 in range(0, grid["ny"], window_rows)]
+    with multiprocessing.Pool(processes=processes) as pool:
+        for counter, (row0, textures) in enumerate(pool.imap_unordered(_window_textures, jobs), start=1):
+            valid = np.isfinite(textures).all(axis=-1)
+            if valid.any():
+                distinct, inverse = np.unique(textures[valid], axis=0, return_inverse=True)
+                rows = np.array([soils.setdefault(tuple(texture), len(soils) + 1) for texture in distinct.tolist()],
+                                dtype=np.int32)
+                window = index[row0:row0 + len(textures)]
+                window[valid] = rows[inverse.ravel()]
+            if verbose:
+                print(f'\rWindow {counter} of {len(jobs)}', end='')
+        if verbose:
+            print(f'\n{len(soils)} distinct soil textures')
+
+        textures = np.array(list(soils.keys()), dtype=float).reshape(-1, 3)
+        chunks = [textures[k:k + chunk_size] for k in range(0, len(textures), chunk_size)]
+        results = []
+        for counter, arrays in enumerate(pool.imap(_texture_parameters, chunks), start=1):
+            results.append(arrays)
+            if verbose:
+                print(f'\rTextures {min(counter*chunk_size, len(textures))} of {len(textures)}', end='')
+        if verbose:
+            print()
+
+    # parameter table, with a row of no data first
+    nodata = SoilDataProvider.hydraulic_arrays(np.full((1, 3), np.nan))
+    table = {}
+    for key in nodata:
+        if key == "SOLNAM":
+            # invalid textures have no texture class (None), stored as ''
+            table[key] = np.array([name or "" for arrays in [nodata] + results for name in arrays[key]], dtype=str)
+        else:
+            table[key] = np.concatenate([arrays[key] for arrays in [nodata] + results])
+    return SoilHydraulicRaster.save(base_fname, index, table, grid, source_identity(soil_fname),
+                                    texture_resolution)
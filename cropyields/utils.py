@@ -1,7 +1,9 @@
 from math import exp, log, cos, sin, acos, asin, tan, floor 
 from math import degrees as deg, radians as rad  
 from datetime import date, datetime, time
+from functools import lru_cache
 from pyproj import Transformer
+import numpy as np
 import re
 import math
 
@@ -106,6 +108,35 @@ def lonlat2osgrid(coords, figs=4):
 
     return coords
 
+def bng2osgrid(x, y, figs=4):
+    """
+    Convert OSGB36 (EPSG:27700) numeric coordinates to British National Grid
+    references, without reprojecting (see lonlat2osgrid for WGS84 input).
+
+    :param x: easting
+    :param y: northing
+    :param figs: int - number of figures to output (4, 6, 8 or 10)
+    :return gridref: str - BNG grid reference
+
+    >>> bng2osgrid(259412, 49334, figs=4)
+    'SX5949'
+    """
+    templates = {4: '{}{:02}{:02}', 6: '{}{:03}{:03}',
+                 8: '{}{:04}{:04}', 10: '{}{:05}{:05}'}
+    factors = {4: 1000.0, 6: 100.0, 8: 10.0, 10: 1.0}
+    if figs not in templates:
+        raise BNGError('Valid inputs for figs are 4, 6, 8 or 10')
+    if (x < 0) or (y < 0):
+        raise BNGError('Coordinate location outside UK region: {}'.format((x, y)))
+    try:
+        region = _regions[int(floor(x / 100000.0))][int(floor(y / 100000.0))]
+    except IndexError:
+        raise BNGError('Coordinate location outside UK region: {}'.format((x, y)))
+    x_offset, y_offset = _offset_map[region]
+    return templates[figs].format(region,
+                                  int(floor((x - x_offset) / factors[figs])),
+                                  int(floor((y - y_offset) / factors[figs])))
+
 def osgrid2bbox(gridref, OS_cellsize):
     """
     Convert British National Grid references to OSGB36 numeric coordinates.
@@ -371,6 +402,91 @@ class sun:
         self.sunset_t     = (self.solarnoon_t*1440+HA_srise*4)/1440
         self.daylength_t  = self.sunset_t - self.sunrise_t
 
+# Array version of the NOAA calculations of the sun class
+def sun_array(days, lat, long=0.):
+    """
+    Array version of the sun class: compute the solar noon, sunrise, sunset
+    and day length for arrays of dates and latitudes at once, with the same
+    NOAA calculations (UTC, at noon of each day). Dates and coordinates are
+    broadcast against each other, e.g. days of shape (n_days, 1) and lat of
+    shape (n_cells,) give arrays of shape (n_days, n_cells). Where the sun
+    does not rise or set the day length is 0 or 24 hours.
+    :param days: dates, as datetime64 values or datetime.date objects
+    :param lat: latitude in decimal degrees, north is positive
+    :param long: longitude in decimal degrees, east is positive
+    Returns a dictionary with the 'noon', 'sunrise' and 'sunset' times as
+    decimal fractions of the day and the 'daylength' in hours.
+    """
+    days = np.asarray(days, dtype='datetime64[D]')
+    latitude = np.asarray(lat, dtype=float)
+    longitude = np.asarray(long, dtype=float)
+
+    # days numbered from 1/1/1900, as in sun.__preptime
+    day = (days - np.datetime64('1970-01-01', 'D')).astype(float) + (date(1970, 1, 1).toordinal()-(734123-40529))
+    Jday      = day+2415018.5+0.5
+    Jcent     = (Jday-2451545)/36525
+    GMLS      = (280.46646+Jcent*(36000.76983 + Jcent*0.0003032)) % 360
+    GMAS      = 357.52911+Jcent*(35999.05029 - 0.0001537*Jcent)
+    EEO       = 0.016708634-Jcent*(0.000042037+0.0000001267*Jcent)
+    Seqcent   = (np.sin(np.radians(GMAS))*(1.914602-Jcent*(0.004817+0.000014*Jcent)) +
+                 np.sin(np.radians(2*GMAS))*(0.019993-0.000101*Jcent)+np.sin(np.radians(3*GMAS))*0.000289)
+    Struelong = GMLS + Seqcent
+    Sapplong  = Struelong-0.00569-0.00478*np.sin(np.radians(125.04-1934.136*Jcent))
+    Mobec     = 23+(26+((21.448-Jcent*(46.815+Jcent*(0.00059-Jcent*0.001813))))/60)/60
+    Obcorr    = Mobec+0.00256*np.cos(np.radians(125.04-1934.136*Jcent))
+    Sdec      = np.degrees(np.arcsin(np.sin(np.radians(Obcorr))*np.sin(np.radians(Sapplong))))
+    var_y     = np.tan(np.radians(Obcorr/2))*np.tan(np.radians(Obcorr/2))
+    T_eq      = 4*np.degrees(var_y*np.sin(2*np.radians(GMLS))-2*EEO*np.sin(np.radians(GMAS)) +
+                             4*EEO*var_y*np.sin(np.radians(GMAS))*np.cos(2*np.radians(GMLS)) -
+                             0.5*var_y*var_y*np.sin(4*np.radians(GMLS))-1.25*EEO*EEO*np.sin(2*np.radians(GMAS)))
+    # clipped where the sun does not rise or does not set
+    cos_HA    = (np.cos(np.radians(90.833))/(np.cos(np.radians(latitude))*np.cos(np.radians(Sdec))) -
+                 np.tan(np.radians(latitude))*np.tan(np.radians(Sdec)))
+    HA_srise  = np.degrees(np.arccos(np.clip(cos_HA, -1., 1.)))
+    solarnoon = (720-4*longitude-T_eq)/1440
+    solarnoon, HA_srise = np.broadcast_arrays(solarnoon, HA_srise)
+    return {'noon': solarnoon,
+            'sunrise': (solarnoon*1440-HA_srise*4)/1440,
+            'sunset': (solarnoon*1440+HA_srise*4)/1440,
+            'daylength': HA_srise*8/60}
+
+# Resolution (decimal degrees) of the latitude bands of the day length table
+DAYLENGTH_LAT_BAND = 0.01
+# Days of a leap year, on which the day length table is computed
+_DAYLENGTH_TABLE_DAYS = np.arange('2000-01-01', '2001-01-01', dtype='datetime64[D]')
+
+@lru_cache(maxsize=None)
+def _daylength_band(band):
+    """Day length (hours) by day of a leap year at the centre of a latitude band"""
+    return sun_array(_DAYLENGTH_TABLE_DAYS, band*DAYLENGTH_LAT_BAND)['daylength']
+
+# Day length of many days from a cached (latitude band x day of the year) table
+def daylength(days, lat):
+    """
+    Return the day length (hours) of an array of dates at a latitude,
+    looked up by calendar day in a table of the latitude band (see
+    DAYLENGTH_LAT_BAND), which is computed once with sun_array and
+    cached for all the later lookups. The table ignores the shift of the
+    solar position between calendar years (mostly within the leap year
+    cycle), which changes the day length by a few minutes at most.
+    :param days: dates, as datetime64 values or datetime.date objects
+    :param lat: latitude in decimal degrees, north is positive
+    """
+    days = np.asarray(days, dtype='datetime64[D]')
+    years = days.astype('datetime64[Y]')
+    dayofyr = (days - years.astype('datetime64[D]')).astype(int)
+    # same calendar day in the leap year of the table
+    years = years.astype(int) + 1970
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    dayofyr = dayofyr + (~leap & (dayofyr >= 59))
+    return _daylength_band(int(round(lat/DAYLENGTH_LAT_BAND)))[dayofyr]
+
+# Latent heat of vaporization (kJ/kg) by temperature (Celsius) from
+# Osborne et al. (1930, 1937), obtained from https://bit.ly/2LXYLAO
+_HVAP_T = (0.01, 2, 4, 10, 14, 18, 20, 25, 30, 34, 40, 44, 50)
+_HVAP = (2500.9, 2496.2, 2491.4, 2477.2, 2467.7, 2458.3, 
+    2453.5, 2441.7, 2429.8, 2420.3, 2406.0, 2396.4, 2381.9)
+
 # Convert relative humidity to vapour pressure
 def rh_to_vpress(rh, temp):
     '''
@@ -381,14 +497,27 @@ def rh_to_vpress(rh, temp):
     curve from Osborne et al. (1930, 1937), obtained from
     https://bit.ly/2LXYLAO
     '''
-    t = (0.01, 2, 4, 10, 14, 18, 20, 25, 30, 34, 40, 44, 50)
-    hvap = (2500.9, 2496.2, 2491.4, 2477.2, 2467.7, 2458.3, 
-        2453.5, 2441.7, 2429.8, 2420.3, 2406.0, 2396.4, 2381.9)
+    t, hvap = _HVAP_T, _HVAP
     nearest_t_idx = min(range(len(t)), key=lambda i: abs(t[i]-(temp)))
     vps = 6.11 * exp(((hvap[nearest_t_idx]*1E3)/461)*(1/273.15 - 1/(temp+273.15)))
     vp = vps * (rh/100)
     return vp
 
+# Convert whole arrays of relative humidity to vapour pressure
+def rh_to_vpress_array(rh, temp):
+    '''
+    Array version of rh_to_vpress. Takes NumPy arrays or xarray
+    DataArrays of relative humidity (%) and temperature (Celsius)
+    of the same shape (e.g. a multi-decade series or a whole
+    Chess-Scape tile) and returns vapour pressure in hPa. The
+    latent heat of vaporization is looked up in the Osborne et al.
+    table with a single searchsorted call.
+    '''
+    hvap = np.asarray(_HVAP)[nearest_index(_HVAP_T, temp)]
+    vps = 6.11 * np.exp(((hvap*1E3)/461)*(1/273.15 - 1/(temp+273.15)))
+    vp = vps * (rh/100)
+    return vp
+
 # rescale windspeed based on measured height to a height of 2m
 def rescale_windspeed(windspeed, measured_height):
     '''
@@ -463,6 +592,31 @@ def calc_doy(cftime_day):
     doy = doy.replace(year=cftime_day.year)
     return doy
 
+# Mapping from the day of a 360 day year to the day offset from the 1st of
+# January in a 365 day (row 0) and in a 366 day (row 1) year, consistent with
+# calc_doy: the 29th of February and the last 5 days of December are missing.
+_CALENDAR_360_TABLE = np.array([
+    np.arange(360),
+    np.arange(360) + (np.arange(1, 361) >= 60)
+])
+
+# Converts arrays of 360 day based dates to standard dates
+def calc_doy_array(years, dayofyr):
+    """
+    Array version of calc_doy. Converts 360-day based dates, given
+    as arrays of years and days of the year (1-360), to a NumPy
+    datetime64[D] array through the precomputed 360 to 365/366
+    day mapping table.
+    :param years: array of calendar years
+    :param dayofyr: array of days of the 360 day year
+    """
+    years = np.asarray(years, dtype=int)
+    dayofyr = np.asarray(dayofyr, dtype=int)
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    offset = _CALENDAR_360_TABLE[leap.astype(int), dayofyr - 1]
+    jan_first = (years - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+    return jan_first + offset
+
 # find nearest value within a list to a given value
 def nearest(item, valuelist):
     """
@@ -470,6 +624,22 @@ def nearest(item, valuelist):
     """
     return min(valuelist, key=lambda x: abs(x - item))
 
+# find, for many values at once, the position of the nearest value in a sorted array
+def nearest_index(sorted_values, items):
+    """
+    Array version of nearest: return, for each element in items, the
+    position of the nearest value in sorted_values (sorted in ascending
+    order). Ties are resolved towards the smaller value.
+    """
+    sorted_values = np.asarray(sorted_values)
+    items = np.asarray(items)
+    if len(sorted_values) == 1:
+        return np.zeros(items.shape, dtype=int)
+    right = np.clip(np.searchsorted(sorted_values, items), 1, len(sorted_values) - 1)
+    left = right - 1
+    use_left = (items - sorted_values[left]) <= (sorted_values[right] - items)
+    return np.where(use_left, left, right)
+
 # Given a list of points defined by x and y coordinates, find 
 # the closest one to a user defined point (this works for EPSG 27700 only)
 def find_closest_point(points, x, y):
@@ -529,6 +699,56 @@ def water_conductivity(x, theta_r, theta_s, alpha, npar, Ksat):
     k_psi = Ksat * Krel
     return k_psi
 
+# Array versions of water_retention and water_conductivity
+def water_retention_array(x, theta_r, theta_s, alpha, npar):
+    """
+    Array version of water_retention. 'x' (log10 of the suction, e.g. a pF
+    grid) and the van Genuchten parameters are broadcast against each other,
+    e.g. x of shape (n_psi,) and parameters of shape (N, 1) give the retention
+    curves of N soils, of shape (N, n_psi). Output in cm3/cm3
+    """
+    psi = 10.**np.asarray(x, dtype=float)
+    m = 1-1/npar
+    num = theta_s - theta_r
+    denom = (1 + np.abs(alpha*psi)**npar)**m
+    return theta_r + num / denom
+
+def water_conductivity_array(x, theta_r, theta_s, alpha, npar, Ksat, theta=None):
+    """
+    Array version of water_conductivity, broadcasting as water_retention_array.
+    The retention curve 'theta' is computed if not given, hence it is not
+    computed twice when both curves are needed. Output in cm/d
+    """
+    if theta is None:
+        theta = water_retention_array(x, theta_r, theta_s, alpha, npar)
+    m = 1-1/npar
+    se = (theta - theta_r)/(theta_s - theta_r)
+    se_l = se**0.5 # parameter describing the pore structure of the material usually set to 0.5
+    se_m = se**(1/m)
+    se_fact = (1-se_m)**m
+    Krel = se_l * (1-se_fact)*(1-se_fact)
+    return Ksat * Krel
+
+def hydraulic_tables(x, theta_r, theta_s, alpha, npar, Ksat):
+    """
+    Build the PCSE SMTAB and CONTAB tables of many soils at once.
+    :param x: grid of log10 suctions (pF), of length n_psi
+    :param theta_r, theta_s, alpha, npar, Ksat: arrays of length N of the
+           van Genuchten parameters and saturated conductivity of the soils
+    Returns the retention curves, of shape (N, n_psi), and the SMTAB and CONTAB
+    tables, of shape (N, 2*n_psi), with x interleaved with the values of the
+    curves ([x0, y0, x1, y1, ...]).
+    """
+    x = np.asarray(x, dtype=float)
+    params = [np.asarray(p, dtype=float).reshape(-1, 1) for p in (theta_r, theta_s, alpha, npar, Ksat)]
+    theta_r, theta_s, alpha, npar, Ksat = params
+    wr = water_retention_array(x, theta_r, theta_s, alpha, npar)
+    wc = water_conductivity_array(x, theta_r, theta_s, alpha, npar, Ksat, theta=wr)
+    grid = np.broadcast_to(x, wr.shape)
+    SMTAB = np.stack([grid, wr], axis=-1).reshape(len(wr), -1)
+    CONTAB = np.stack([grid, wc], axis=-1).reshape(len(wc), -1)
+    return wr, SMTAB, CONTAB
+
 
 def stefan_boltzman(tmin, tmax):
     """
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+WEATHER CACHE
+=============
+
+Cache files of the weather providers. Every cache entry carries a header
+with the cache format version and the identity (name, size and modification
+time) of the Chess-Scape file it was built from; an entry is valid as long
+as both match, regardless of its age (see 'is_cache_valid').
+
+Entries are shared by all the parcels of a 1km cell, hence they only hold the
+weather variables of the cell (CACHE_COLUMNS). The reference ET, which also
+depends on the elevation and the Angstrom coefficients of each parcel, is
+computed by the providers when an entry is loaded.
+
+Two formats are available. The pickle format stores the header followed by
+the pickled weather series, as one array per weather variable. The columnar format stores
+each 1km cell as two files in the meteo cache directory:
+    - a '.npy' file holding a float32 array of shape (n_columns, n_days),
+      so that each weather variable is a contiguous, memory-mappable column;
+    - a '.json' header with the site variables (lon, lat), the column names,
+      the first day of the series, the cache format version and the name of
+      its data file.
+Every file is written under a unique temporary name and renamed when complete
+(see 'write_atomic'), so that processes writing the same entry do not clash.
+The data file of a columnar entry has a unique name and the header, written
+last, names the data file it belongs to: readers never pair a header with the
+data of another write, and an entry is only complete when its header exists.
+"""
+import glob
+import json
+import os
+import pickle
+import tempfile
+import time
+import numpy as np
+
+# Version of the layout of the cache files. Bump it whenever the layout or
+# the content of the cache changes, to invalidate older files.
+CACHE_FORMAT_VERSION = 5
+
+# Weather variables stored in the cache, in this order, after the 'DAY'
+# column (days since the first day of the series)
+CACHE_COLUMNS = ["TMAX", "TMIN", "IRRAD", "VAP", "WIND", "RAIN", "SNOWDEPTH"]
+CACHE_DTYPE = np.float32
+
+# Age in seconds after which a data file not named by its header is removed
+# (see write_header_and_files)
+STALE_DATA_FILE_AGE = 3600
+
+
+def source_identity(source_fname):
+    """
+    Identity of the source file of a cache entry: file name, size in bytes
+    and modification time in nanoseconds.
+    """
+    r = os.stat(source_fname)
+    return {"file": os.path.basename(source_fname), "size": r.st_size, "mtime_ns": r.st_mtime_ns}
+
+
+def is_cache_valid(header, source_fname):
+    """
+    A cache entry is valid if it was written with the current cache format
+    version from a source file identical (see 'source_identity') to
+    'source_fname'.
+    """
+    try:
+        return (header.get("format_version") == CACHE_FORMAT_VERSION and
+                header.get("source") == source_identity(source_fname))
+    except (OSError, AttributeError):
+        return False
+
+
+def _mkstemp(fname, suffix):
+    """
+    Create a file with a unique name in the directory of 'fname', named
+    after it. Returns a tuple (file descriptor, file name).
+    """
+    directory, basename = os.path.split(os.path.abspath(fname))
+    return tempfile.mkstemp(prefix=basename + ".", suffix=suffix, dir=directory)
+
+
+def write_atomic(fname, write, suffix=".tmp"):
+    """
+    Write a file through a temporary file with a unique name in the same
+    directory, which replaces 'fname' once complete. Readers never see a
+    partially written file, and processes writing the same file at the same
+    time do not overwrite each other's temporary files.
+
+    :param fname: name of the file
+    :param write: function writing the content to an open binary file object
+    :param suffix: suffix of the temporary file
+    """
+    fd, tmp_fname = _mkstemp(fname, suffix)
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            write(fp)
+        # temporary files are only readable by their owner
+        os.chmod(tmp_fname, 0o644)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise
+
+
+def data_file(header_fname, header, key="data_file"):
+    """Return the name of a data file named by the header of files written by
+    'write_header_and_files'"""
+    return os.path.join(os.path.dirname(header_fname), header[key])
+
+
+def write_header_and_files(header_fname, header, files):
+    """
+    Write data files and a '.json' header naming them. Each data file has a
+    unique name, so that writers in other processes never replace it, and the
+    header replaces the previous one once all the files are complete: readers
+    never pair a header with the data of another write. The data files of
+    the replaced headers are then removed.
+
+    :param header_fname: name of the '.json' header file
+    :param header: dictionary with the items of the header
+    :param files: dictionary {header item: (file name, function writing the
+           content to an open binary file object)}. A file named '<root>.<ext>'
+           is written as '<root>.<unique id>.<ext>', whose name is stored in
+           the header item
+    :return: dictionary {header item: name of the file written}
+    """
+    try:
+        with open(header_fname, "r") as fp:
+            previous = json.load(fp)
+        previous = [data_file(header_fname, previous, key) for key in files]
+    except (OSError, KeyError, TypeError, ValueError):
+        previous = []
+
+    written = {}
+    try:
+        for key, (fname, write) in files.items():
+            root, ext = os.path.splitext(fname)
+            fd, written[key] = _mkstemp(root, ext)
+            with os.fdopen(fd, "wb") as fp:
+                write(fp)
+            os.chmod(written[key], 0o644)
+        header = dict(header, **{key: os.path.basename(fname) for key, fname in written.items()})
+        write_atomic(header_fname, lambda fp: fp.write(json.dumps(header).encode("utf-8")))
+    except BaseException:
+        for fname in written.values():
+            if os.path.exists(fname):
+                os.remove(fname)
+        raise
+
+    # data files of replaced headers: those named by the previous header, and
+    # those left by writers racing on the same header, once no writer can still
+    # be about to name them
+    stale = [fname for fname in previous if fname not in written.values()]
+    for fname, _ in files.values():
+        root, ext = os.path.splitext(fname)
+        for old in glob.glob(glob.escape(root) + ".*" + ext):
+            try:
+                if old not in written.values() and os.path.getmtime(old) < time.time() - STALE_DATA_FILE_AGE:
+                    stale.append(old)
+            except OSError:
+                pass
+    for fname in stale:
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+    return written
+
+
+def write_header_and_data(header_fname, header, data):
+    """
+    Write an array to a '.npy' data file and a '.json' header naming it
+    (item 'data_file'), see 'write_header_and_files'. Returns the name of
+    the data file.
+    """
+    data_fname = os.path.splitext(header_fname)[0] + ".npy"
+    files = {"data_file": (data_fname, lambda fp: np.save(fp, data))}
+    return write_header_and_files(header_fname, header, files)["data_file"]
+
+
+def write_pickle_cache(cache_fname, header, payload):
+    """
+    Write a pickle cache entry: the header (with the cache format version)
+    is pickled first, so that it can be read without loading the payload.
+    """
+    header = dict(header, format_version=CACHE_FORMAT_VERSION)
+
+    def write(fp):
+        pickle.dump(header, fp, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(payload, fp, pickle.HIGHEST_PROTOCOL)
+
+    write_atomic(cache_fname, write)
+
+
+def read_pickle_cache_header(cache_fname):
+    """Read the header of a pickle cache entry"""
+    with open(cache_fname, "rb") as fp:
+        header = pickle.load(fp)
+    if not isinstance(header, dict):
+        msg = "Cache file '%s' has no header" % cache_fname
+        raise ValueError(msg)
+    return header
+
+
+def read_pickle_cache(cache_fname):
+    """
+    Read a pickle cache entry. Raises ValueError if the entry was written
+    with a different cache format version. Returns a tuple (header, payload)
+    """
+    with open(cache_fname, "rb") as fp:
+        header = pickle.load(fp)
+        if not isinstance(header, dict) or header.get("format_version") != CACHE_FORMAT_VERSION:
+            msg = "Cache file '%s' has no header or a different format version" % cache_fname
+            raise ValueError(msg)
+        payload = pickle.load(fp)
+    return header, payload
+
+
+def read_cache_header(cache_fname, cache_format):
+    """Read the header of a cache entry in format 'pickle' or 'columnar'"""
+    if cache_format == "columnar":
+        return read_columnar_cache_header(cache_fname)
+    return read_pickle_cache_header(cache_fname)
+
+
+def write_columnar_cache(header_fname, columns, header):
+    """
+    Write the weather series of a cell to a columnar cache entry.
+
+    :param header_fname: name of the '.json' header file of the entry
+    :param columns: dictionary with the 'DAY' sequence of dates and one
+           array per weather variable in CACHE_COLUMNS
+    :param header: dictionary of additional items to store in the header
+           (e.g. 'source', 'longitude', 'latitude')
+    """
+    days = np.asarray(columns["DAY"], dtype="datetime64[D]")
+    data = np.empty((len(CACHE_COLUMNS) + 1, len(days)), dtype=CACHE_DTYPE)
+    data[0] = (days - days[0]).astype(int)
+    for i, label in enumerate(CACHE_COLUMNS, start=1):
+        data[i] = columns[label]
+
+    header = dict(header)
+    header.update({
+        "format_version": CACHE_FORMAT_VERSION,
+        "columns": ["DAY"] + CACHE_COLUMNS,
+        "dtype": np.dtype(CACHE_DTYPE).name,
+        "first_day": str(days[0]),
+        "n_days": len(days)
+    })
+
+    write_header_and_data(header_fname, header, data)
+
+
+def read_columnar_cache_header(header_fname):
+    """Read the header of a columnar cache entry"""
+    with open(header_fname, "r") as fp:
+        return json.load(fp)
+
+
+def read_columnar_cache(header_fname, mmap_mode="r"):
+    """
+    Read a columnar cache entry. The data file is memory-mapped by default,
+    so columns are only read from disk when accessed. Raises ValueError if
+    the entry was written with a different cache format version.
+
+    Returns a tuple (header, columns), where columns is a dictionary with
+    the 'DAY' datetime64[D] array and one array per weather variable.
+    """
+    header = read_columnar_cache_header(header_fname)
+    if header.get("format_version") != CACHE_FORMAT_VERSION:
+        msg = "Cache format version %s, expected %s" % (header.get("format_version"), CACHE_FORMAT_VERSION)
+        raise ValueError(msg)
+    data_fname = data_file(header_fname, header)
+    data = np.load(data_fname, mmap_mode=mmap_mode)
+    if data.shape != (len(header["columns"]), header["n_days"]):
+        msg = "Unexpected shape %s of cache data file '%s'" % (data.shape, data_fname)
+        raise ValueError(msg)
+
+    columns = {label: data[i] for i, label in enumerate(header["columns"])}
+    columns["DAY"] = np.datetime64(header["first_day"], "D") + columns["DAY"].astype(int)
+    return header, columns
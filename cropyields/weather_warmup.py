@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+WEATHER CACHE WARM-UP
+=====================
+
+Pre-build the cache files of the NetCDFWeatherDataProvider for a set of
+parcels, rcps and ensembles before a bulk WOFOST run, so that weather
+extraction is not paid inside the simulation loop.
+
+Cache files are written per 1km cell, hence only one parcel per cell is
+processed. Cells are grouped by 10km tile; each tile is read once (see
+cropyields.chess_scape.TileBatch) and tiles are processed in parallel by
+a pool of processes. Cells whose cache file is already valid are skipped.
+"""
+import multiprocessing
+import time
+from cropyields.angstrom import preload_angstrom_coefficients
+from cropyields.chess_scape import TileBatch, osgrid_to_1km, osgrid_to_10km
+from cropyields.WeatherManager import NetCDFWeatherDataProvider
+
+
+def group_cells_by_tile(osgrid_codes):
+    """
+    Keep one OS grid code per 1km cell and group them by 10km tile.
+    Returns a dictionary {osgrid_10km: [osgrid_code, ...]}
+    """
+    cells = {}
+    for code in osgrid_codes:
+        cells.setdefault(osgrid_to_1km(code), code)
+    tiles = {}
+    for code in cells.values():
+        tiles.setdefault(osgrid_to_10km(code), []).append(code)
+    return tiles
+
+
+def _warm_up_tile(args):
+    """
+    Build the cache files of the cells of one tile, for one rcp and ensemble.
+    Runs in a worker process.
+    """
+    codes, rcp, ensemble, cache_format, force_update = args
+    result = {"built": 0, "skipped": 0, "failed": [], "nbytes": 0}
+    if not force_update:
+        todo = [code for code in codes
+                if not NetCDFWeatherDataProvider.has_valid_cache(code, rcp, ensemble, cache_format)]
+        result["skipped"] = len(codes) - len(todo)
+    else:
+        todo = list(codes)
+
+    tile_batch = TileBatch(todo, rcp, ensemble)
+    for code in todo:
+        try:
+            NetCDFWeatherDataProvider(code, rcp, ensemble, force_update=force_update,
+                                      tile_batch=tile_batch, cache_format=cache_format)
+            result["built"] += 1
+        except Exception as e:
+            result["failed"].append((code, rcp, ensemble, str(e)))
+    result["nbytes"] = tile_batch.nbytes
+    return result
+
+
+def warm_up_weather_cache(osgrid_codes, rcps, ensembles, processes=None, cache_format=None,
+                          force_update=False, verbose=True):
+    """
+    Build the weather cache files of all the 1km cells of 'osgrid_codes' for
+    every combination of 'rcps' and 'ensembles'.
+
+    :param osgrid_codes: list of parcel OS grid codes (e.g. from the 'parcels' table)
+    :param rcps: list of rcp scenarios, e.g. ['rcp26', 'rcp85']
+    :param ensembles: list of ensemble numbers, e.g. [1, 4]
+    :param processes: number of worker processes, by default the number of CPUs
+    :param cache_format: 'pickle' or 'columnar' (see NetCDFWeatherDataProvider)
+    :param force_update: rebuild the cache files even when they are valid
+    :param verbose: print progress and throughput
+
+    Returns a dictionary with the number of cells built, skipped and failed,
+    the MB of Chess-Scape data read, the elapsed time and the throughput in
+    cells/s.
+    """
+    tiles = group_cells_by_tile(osgrid_codes)
+    jobs = [(codes, rcp, ensemble, cache_format, force_update)
+            for codes in tiles.values() for rcp in rcps for ensemble in ensembles]
+
+    summary = {"built": 0, "skipped": 0, "failed": [], "nbytes": 0}
+    start = time.time()
+    # loaded once here and inherited by the workers
+    preload_angstrom_coefficients()
+    with multiprocessing.Pool(processes=processes) as pool:
+        for counter, result in enumerate(pool.imap_unordered(_warm_up_tile, jobs), start=1):
+            summary["built"] += result["built"]
+            summary["skipped"] += result["skipped"]
+            summary["failed"] += result["failed"]
+            summary["nbytes"] += result["nbytes"]
+            if verbose:
+                elapsed = time.time() - start
+                print(f'\rTile {counter} of {len(jobs)}: {summary["built"]} cells built, '
+                      f'{summary["skipped"]} skipped, {len(summary["failed"])} failed, '
+                      f'{summary["built"]/elapsed:.1f} cells/s, {summary["nbytes"]/1e6:.1f} MB read',
+                      end='')
+    if verbose:
+        print()
+
+    summary["elapsed"] = time.time() - start
+    summary["cells_per_second"] = summary["built"] / summary["elapsed"] if summary["elapsed"] > 0 else 0.
+    summary["MB_read"] = summary.pop("nbytes") / 1e6
+    return summary
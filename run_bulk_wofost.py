@@ -10,6 +10,8 @@ from pcse.base import ParameterProvider
 from pcse.models import Wofost71_WLP_FD
 import pandas as pd
 from cropyields.utils import printProgressBar
+from cropyields.prefetch import prefetch
+from cropyields.soil_cache import soil_parameter_cache
 
 # INPUT PARAMETERS
 rcp_list = ['rcp85']
@@ -18,6 +20,27 @@ year_list = [year for year in range(2020, 2051)]
 #                 'Winter_wheat_104', 'Winter_wheat_105', 'Winter_wheat_106',
 #                 'Winter_wheat_107']
 variety_list = ['Winter_wheat_101']
+# soil and weather providers of the next parcels are built in the background
+# by 'prefetch_workers' threads, at most 'prefetch_depth' parcels ahead
+prefetch_depth = 8
+prefetch_workers = 2
+
+
+def build_providers(parcel, soilsource, rcp, ensemble, start_date, end_date):
+    """
+    Build the soil and weather providers of a parcel (run by the prefetch
+    threads). The weather provider is None if its data cannot be retrieved.
+    """
+    if soilsource == 'SoilGrids':
+        soildata = SoilGridsDataProvider(parcel)
+    else:
+        soildata = WHSDDataProvider(parcel)
+    try:
+        wdp = NetCDFWeatherDataProvider(parcel, rcp, ensemble, force_update=False,
+                                        start_date=start_date, end_date=end_date)
+    except Exception:
+        wdp = None
+    return soildata, wdp
 
 
 for rcp in rcp_list:
@@ -68,16 +91,16 @@ for rcp in rcp_list:
             agromanagement.change_year(year)
             if agromanagement.retrieve_variety != variety:
                 agromanagement.change_variety(variety)
-            for parcel in parcel_os_code:
+            # only the weather of the simulated campaign is loaded
+            start_date, end_date = agromanagement.campaign_window
+            build = lambda parcel: build_providers(parcel, soilsource, rcp, ensemble, start_date, end_date)
+            for parcel, providers, error in prefetch(parcel_os_code, build, prefetch_depth, prefetch_workers):
                 printProgressBar(counter, total)
                 parcel_yield = {}
-                if soilsource == 'SoilGrids':
-                    soildata = SoilGridsDataProvider(parcel)
-                else:
-                    soildata = WHSDDataProvider(parcel)
-                try:
-                    wdp = NetCDFWeatherDataProvider(parcel, rcp, ensemble, force_update=False)
-                except:
+                if error is not None:
+                    raise error
+                soildata, wdp = providers
+                if wdp is None:
                     print(f'failed to retrieve weather data for parcel at \'{parcel}\'')
                     failed_parcels.append(parcel)
                     continue
@@ -104,6 +127,7 @@ for rcp in rcp_list:
                 }
                 wheat_yields[parcel] = parcel_yield
                 counter += 1
+            print(f'soil parameter cache: {soil_parameter_cache.stats()}')
 
             df = pd.DataFrame(wheat_yields).T
             parcelset = df.index.to_list()
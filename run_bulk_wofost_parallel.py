@@ -6,6 +6,8 @@ import psycopg2
 from cropyields.SoilManager import SoilGridsDataProvider, WHSDDataProvider
 from cropyields.WeatherManager import NetCDFWeatherDataProvider
 from cropyields.crop_manager import SingleRotationAgroManager
+from cropyields.angstrom import preload_angstrom_coefficients
+from cropyields.seer import preload_seer_soil_table
 from pcse.base import ParameterProvider
 from pcse.models import Wofost71_WLP_FD
 import pandas as pd
@@ -24,6 +26,8 @@ def run_wofost(args):
     sitedata = arg_dict['sitedata']
     
     agromanagement.change_year(year)
+    # only the weather of the simulated campaign is loaded
+    start_date, end_date = agromanagement.campaign_window
     parcel_yield = {}
     print(f'Running WOFOST for parcel \'{parcel}\'')
     if soilsource == 'SoilGrids':
@@ -31,7 +35,8 @@ def run_wofost(args):
     else:
         soildata = WHSDDataProvider(parcel)
     try:
-        wdp = NetCDFWeatherDataProvider(parcel, rcp, ensemble, force_update=False)
+        wdp = NetCDFWeatherDataProvider(parcel, rcp, ensemble, force_update=False,
+                                        start_date=start_date, end_date=end_date)
     except:
         print(f'failed to retrieve weather data for parcel at \'{parcel}\'')
     parameters = ParameterProvider(cropdata=cropd, soildata=soildata, sitedata=sitedata)
@@ -103,6 +108,11 @@ if __name__ == "__main__":
     if conn is not None:
         conn.close()
     
+    # load the Angstrom coefficients once, before the workers are forked
+    preload_angstrom_coefficients()
+    if input_params['soilsource'] == 'WHSD':
+        preload_seer_soil_table()
+
     # start parallel pool
     pool = multiprocessing.Pool(processes=2)
     
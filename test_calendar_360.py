@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check that the array conversion of 360-day Chess-Scape dates in
+cropyields.utils (calc_doy_array) returns the same dates as the scalar
+'calc_doy' function, on every day of leap, common and century years,
+including the days around the missing 29th of February and the last
+day of the 360 day year.
+"""
+import cftime
+import numpy as np
+from cropyields.utils import calc_doy, calc_doy_array
+
+# common, leap, century common and century leap years
+YEARS = [2019, 2020, 2100, 2000, 1981]
+
+
+def test_calc_doy_array():
+    years, dayofyr = np.meshgrid(YEARS, np.arange(1, 361), indexing='ij')
+    days = calc_doy_array(years.ravel(), dayofyr.ravel())
+    expected = np.array([calc_doy(cftime.Datetime360Day(year, month, day))
+                         for year in YEARS for month in range(1, 13) for day in range(1, 31)],
+                        dtype='datetime64[D]')
+    np.testing.assert_array_equal(days, expected)
+
+
+def test_calendar_edges():
+    days = calc_doy_array([2020, 2020, 2019, 2019, 2020, 2100], [59, 60, 59, 60, 360, 60])
+    expected = np.array(['2020-02-28', '2020-03-01', '2019-02-28', '2019-03-01', '2020-12-26', '2100-03-01'],
+                        dtype='datetime64[D]')
+    np.testing.assert_array_equal(days, expected)
+    # the 29th of February and the last 5 days of December are missing
+    year = calc_doy_array(np.full(360, 2020), np.arange(1, 361))
+    assert np.datetime64('2020-02-29') not in year
+    assert year[-1] == np.datetime64('2020-12-26')
+    assert np.all(np.diff(year) >= np.timedelta64(1, 'D'))
+
+
+if __name__ == '__main__':
+    test_calc_doy_array()
+    test_calendar_edges()
+    print('calc_doy_array matches calc_doy')
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check the selection of the closest cell with data of a Chess-Scape tile
+(cropyields.chess_scape.ValidCells) on small synthetic tiles: cells with
+missing values on any day are not selected, and ties between cells at the
+same distance are resolved towards the first cell in the order of the tile.
+
+The TilePool does not close a tile evicted while it is being read.
+"""
+import tempfile
+import numpy as np
+import xarray as xr
+from cropyields import data_dirs
+from cropyields.chess_scape import TilePool, ValidCells, WEATHER_VARIABLES, tile_filename
+
+
+def synthetic_tile(valid, ndays=20, seed=1):
+    """Tile with data on the cells where 'valid' (ny, nx) is True and NaN elsewhere"""
+    rng = np.random.default_rng(seed)
+    ny, nx = valid.shape
+    x = 250500. + 1000. * np.arange(nx)
+    y = 40500. + 1000. * np.arange(ny)
+    data = {}
+    for var in WEATHER_VARIABLES:
+        values = rng.uniform(1., 2., (ndays, ny, nx))
+        values[:, ~valid] = np.nan
+        data[var] = (('time', 'y', 'x'), values)
+    return xr.Dataset(data, coords={'time': np.arange(ndays), 'y': y, 'x': x})
+
+
+def test_cells_with_missing_days():
+    valid = np.zeros((3, 3), dtype=bool)
+    valid[1, 0] = valid[1, 2] = True
+    ds = synthetic_tile(valid)
+    # the closest cell to the centre in tile order has a missing value on a later day
+    ds['pr'][15, 1, 0] = np.nan
+    cells = ValidCells(ds)
+    assert len(cells.x) == 1
+    assert cells.nearest(ds['x'][1].item(), ds['y'][1].item()) == (ds['x'][2].item(), ds['y'][1].item())
+
+
+def test_ties_to_first_cell():
+    # the 8 cells at distance sqrt(5) from the centre of a 5x5 tile
+    valid = np.zeros((5, 5), dtype=bool)
+    for dy, dx in [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]:
+        valid[2 + dy, 2 + dx] = True
+    ds = synthetic_tile(valid)
+    x, y = ds['x'].to_numpy(), ds['y'].to_numpy()
+    cells = ValidCells(ds)
+    assert cells.nearest(x[2], y[2]) == (x[1], y[0])
+    # a point slightly closer to another cell selects that cell
+    assert cells.nearest(x[2] + 1., y[2] + 2.) == (x[3], y[4])
+
+
+def test_eviction_while_reading():
+    osgb_dir = data_dirs['OSGB_dir']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dirs['OSGB_dir'] = tmp_dir + '/'
+        try:
+            for tile in ['SX54', 'SX64']:
+                synthetic_tile(np.ones((3, 3), dtype=bool)).to_netcdf(tile_filename(tile, 'rcp26', 1))
+            pool = TilePool(maxsize=1)
+            with pool.tile('SX54', 'rcp26', 1) as dataset:
+                # opening another tile evicts SX54, which is still checked out
+                with pool.tile('SX64', 'rcp26', 1):
+                    pass
+                assert pool.stats()['evictions'] == 1
+                assert np.isfinite(dataset['pr'].to_numpy()).all()
+            assert pool.stats()['in_use'] == 0
+            pool.clear()
+        finally:
+            data_dirs['OSGB_dir'] = osgb_dir
+
+
+if __name__ == '__main__':
+    test_cells_with_missing_days()
+    test_ties_to_first_cell()
+    test_eviction_while_reading()
+    print('ValidCells selects the closest cell with data')
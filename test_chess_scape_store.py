@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check the packing of the series of a cell of the national Chess-Scape store
+(cropyields.chess_scape_store.pack_cell): values are restored within half a
+packing step, missing values are kept and values out of range are rejected.
+"""
+import numpy as np
+from cropyields.chess_scape_store import STORE_COLUMNS, STORE_SCALE_FACTORS, pack_cell, unpack_cell
+
+# typical ranges of the columns of the store, in WOFOST units
+RANGES = {"TMAX": (-20., 40.), "TMIN": (-30., 30.), "IRRAD": (0., 3.2e7), "VAP": (0., 40.), "WIND": (0., 30.),
+          "RAIN": (0., 20.)}
+
+
+def synthetic_cell(ndays=730, seed=1):
+    rng = np.random.default_rng(seed)
+    return np.array([rng.uniform(*RANGES[label], ndays) for label in STORE_COLUMNS])
+
+
+def test_round_trip():
+    columns = synthetic_cell()
+    columns[:, 100] = np.nan
+    columns[STORE_COLUMNS.index("RAIN"), 200] = 0.
+    restored = unpack_cell(pack_cell(columns), columns.shape[1])
+    assert np.array_equal(np.isnan(restored), np.isnan(columns))
+    for k, label in enumerate(STORE_COLUMNS):
+        error = np.nanmax(np.abs(restored[k] - columns[k]))
+        assert error <= STORE_SCALE_FACTORS[label] * 0.5 * (1 + 1e-3)
+
+
+def test_out_of_range():
+    columns = synthetic_cell()
+    columns[STORE_COLUMNS.index("RAIN"), 10] = 100.
+    try:
+        pack_cell(columns)
+    except ValueError:
+        return
+    raise AssertionError("Values out of the range of the store were packed")
+
+
+if __name__ == '__main__':
+    test_round_trip()
+    test_out_of_range()
+    print('The store packs the series of a cell within its precision')
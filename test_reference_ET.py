@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check that the array implementation of the reference evapotranspiration
+in cropyields.evapotranspiration returns the same E0, ES0 and ET0 as the
+scalar 'reference_ET' function in PCSE, on synthetic weather series
+spanning several years.
+"""
+import datetime as dt
+import numpy as np
+from pcse.util import reference_ET as pcse_reference_ET
+from cropyields.evapotranspiration import reference_ET
+
+
+def synthetic_weather(ndays, seed=1):
+    rng = np.random.default_rng(seed)
+    days = [dt.date(2020, 1, 1) + dt.timedelta(days=i) for i in range(ndays)]
+    doy = np.array([day.timetuple().tm_yday for day in days])
+    season = np.sin(2 * np.pi * (doy - 110) / 365.)
+    tmin = 5 + 7 * season + rng.normal(0, 3, ndays)
+    tmax = tmin + rng.uniform(0.5, 16, ndays)
+    irrad = np.clip(12e6 + 10e6 * season + rng.normal(0, 3e6, ndays), 2e5, None)
+    vap = rng.uniform(2, 25, ndays)
+    wind = rng.uniform(0, 12, ndays)
+    return days, tmin, tmax, irrad, vap, wind
+
+
+def test_reference_ET():
+    days, tmin, tmax, irrad, vap, wind = synthetic_weather(3 * 366)
+    for lat, elev, angstA, angstB in [(50.3, 45., 0.25, 0.5), (57.9, 310., 0.18, 0.55)]:
+        for etmodel in ["PM", "P"]:
+            e0, es0, et0 = reference_ET(DAY=days, LAT=lat, ELEV=elev, TMIN=tmin, TMAX=tmax,
+                                        IRRAD=irrad, VAP=vap, WIND=wind, ANGSTA=angstA,
+                                        ANGSTB=angstB, ETMODEL=etmodel)
+            expected = np.array([
+                pcse_reference_ET(DAY=day, LAT=lat, ELEV=elev, TMIN=a, TMAX=b, IRRAD=c,
+                                  VAP=d, WIND=e, ANGSTA=angstA, ANGSTB=angstB, ETMODEL=etmodel)
+                for day, a, b, c, d, e in zip(days, tmin, tmax, irrad, vap, wind)
+            ])
+            np.testing.assert_allclose(e0, expected[:, 0], rtol=1e-10, atol=1e-12)
+            np.testing.assert_allclose(es0, expected[:, 1], rtol=1e-10, atol=1e-12)
+            np.testing.assert_allclose(et0, expected[:, 2], rtol=1e-10, atol=1e-12)
+
+
+if __name__ == '__main__':
+    test_reference_ET()
+    print('Array reference ET matches pcse.util.reference_ET')
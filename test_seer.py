@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check that the SeerSoilTable assigns points to the cell whose centre is
+closest to them, with the regular grid index and with the KD-tree fallback,
+on a small synthetic table with missing cells: points inside the cells, on
+the edges between cells and outside the grid.
+"""
+import numpy as np
+from cropyields.seer import SEER_CELL_SIZE, SeerSoilTable
+
+
+def synthetic_table(nx=6, ny=5, seed=1):
+    """Table of a regular grid of nx*ny cells with a few cells missing"""
+    rng = np.random.default_rng(seed)
+    ix, iy = np.meshgrid(np.arange(nx), np.arange(ny))
+    keep = np.ones(ix.shape, dtype=bool)
+    keep[0, 0] = keep[2, 3] = keep[4, 5] = False
+    xmn = 250000. + SEER_CELL_SIZE * ix[keep]
+    ymn = 40000. + SEER_CELL_SIZE * iy[keep]
+    textures = rng.uniform(0., 100., (len(xmn), 3))
+    return SeerSoilTable(np.arange(len(xmn)) + 100, xmn, ymn, textures)
+
+
+def nearest_centres(table, x, y):
+    """Distance of each point to the closest cell centre, by brute force"""
+    cx, cy = table.xmn + SEER_CELL_SIZE/2., table.ymn + SEER_CELL_SIZE/2.
+    return np.sqrt((x[:, None] - cx)**2 + (y[:, None] - cy)**2).min(axis=1)
+
+
+def check_rows(table, x, y):
+    rows = table.rows(x, y)
+    cx, cy = table.xmn[rows] + SEER_CELL_SIZE/2., table.ymn[rows] + SEER_CELL_SIZE/2.
+    np.testing.assert_allclose(np.sqrt((x - cx)**2 + (y - cy)**2), nearest_centres(table, x, y))
+
+
+def test_points_inside():
+    table = synthetic_table()
+    rng = np.random.default_rng(2)
+    x = rng.uniform(250000., 262000., 500)
+    y = rng.uniform(40000., 50000., 500)
+    check_rows(table, x, y)
+
+
+def test_points_on_edges():
+    table = synthetic_table()
+    # vertical edges, then horizontal edges, including the corners of the cells
+    x, y = np.meshgrid(250000. + SEER_CELL_SIZE * np.arange(7), 40000. + 500. * np.arange(21))
+    check_rows(table, x.ravel(), y.ravel())
+    x, y = np.meshgrid(250000. + 500. * np.arange(25), 40000. + SEER_CELL_SIZE * np.arange(6))
+    check_rows(table, x.ravel(), y.ravel())
+
+
+def test_points_outside():
+    table = synthetic_table()
+    x = np.array([240000., 249999., 262000., 270000., 255000., 255000., 230000.])
+    y = np.array([45000., 40000., 49999., 52000., 30000., 60000., 20000.])
+    check_rows(table, x, y)
+
+
+def test_irregular_cells():
+    # cells not aligned to a regular grid are only found with the KD-tree
+    table = synthetic_table()
+    table = SeerSoilTable(table.new2kid, table.xmn + np.where(table.xmn > 255000., 500., 0.), table.ymn,
+                          table.textures)
+    assert table.grid is None
+    rng = np.random.default_rng(3)
+    check_rows(table, rng.uniform(245000., 267000., 500), rng.uniform(35000., 55000., 500))
+
+
+if __name__ == '__main__':
+    test_points_inside()
+    test_points_on_edges()
+    test_points_outside()
+    test_irregular_cells()
+    print('SeerSoilTable assigns the closest cell')
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check that the array solar geometry in cropyields.utils (sun_array) returns
+the same day length, sunrise and sunset as the scalar 'sun' class, on the
+days of several years over the latitudes of Great Britain, and that the
+cached day length table (daylength) stays within a few minutes of it.
+"""
+import datetime as dt
+import numpy as np
+from cropyields.utils import daylength, sun, sun_array
+
+LATITUDES = np.array([49.9, 50.726, 52.5, 55.0, 58.6, 60.8])
+
+
+def series(first=dt.date(2019, 1, 1), last=dt.date(2021, 12, 31)):
+    return np.arange(first, last + dt.timedelta(days=1), dtype='datetime64[D]')
+
+
+def seconds(when):
+    return when.hour * 3600 + when.minute * 60 + when.second
+
+
+def test_daylength():
+    days = series()
+    result = sun_array(days[:, None], LATITUDES, 3.5275)
+    assert result['daylength'].shape == (len(days), len(LATITUDES))
+    for j, lat in enumerate(LATITUDES):
+        s = sun(lat=lat, long=3.5275)
+        expected = np.array([s.daylength(day) for day in days.astype(dt.date)])
+        np.testing.assert_allclose(result['daylength'][:, j], expected, rtol=1e-10)
+
+
+def test_sunrise_sunset():
+    days = series(dt.date(2020, 1, 1), dt.date(2020, 12, 31))[::7]
+    s = sun(lat=50.726, long=-3.5275)
+    result = sun_array(days, 50.726, -3.5275)
+    for key, method in [('sunrise', s.sunrise), ('sunset', s.sunset), ('noon', s.noon)]:
+        # the scalar times are truncated to the second
+        expected = np.array([seconds(method(day)) for day in days.astype(dt.date)])
+        assert np.all(np.abs(result[key] * 86400 - expected - 0.5) <= 0.5 + 1e-6)
+
+
+def test_polar_days():
+    result = sun_array(np.array(['2020-06-21', '2020-12-21'], dtype='datetime64[D]'), 80.)
+    np.testing.assert_allclose(result['daylength'], [24., 0.])
+
+
+def test_daylength_table():
+    days = series()
+    for lat in LATITUDES:
+        exact = sun_array(days, lat)['daylength']
+        # the table ignores the shift of the solar position within the leap year
+        # cycle, i.e. less than one day of change of the day length (about 6
+        # minutes around the equinoxes in the north of Scotland)
+        assert np.abs(daylength(days, lat) - exact).max() < 6/60.
+
+
+if __name__ == '__main__':
+    test_daylength()
+    test_sunrise_sunset()
+    test_polar_days()
+    test_daylength_table()
+    print('sun_array matches the sun class')
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check that the array conversion of relative humidity to vapour pressure in
+cropyields.utils (rh_to_vpress_array) returns the same values as the scalar
+'rh_to_vpress' function, on random temperatures and on the breakpoints of
+the table of the latent heat of vaporization, the midpoints between them
+and temperatures outside the table.
+"""
+import numpy as np
+import xarray as xr
+from cropyields.utils import _HVAP_T, rh_to_vpress, rh_to_vpress_array
+
+
+def check_vpress(rh, temp):
+    expected = np.array([rh_to_vpress(a, b) for a, b in zip(rh, temp)])
+    np.testing.assert_allclose(rh_to_vpress_array(rh, temp), expected, rtol=1e-12)
+
+
+def test_random_values():
+    rng = np.random.default_rng(1)
+    temp = rng.uniform(-20., 45., 5000)
+    check_vpress(rng.uniform(20., 100., len(temp)), temp)
+
+
+def test_table_breakpoints():
+    breakpoints = np.array(_HVAP_T)
+    # ties between two breakpoints are resolved towards the lower one
+    midpoints = (breakpoints[1:] + breakpoints[:-1])/2.
+    temp = np.concatenate([breakpoints, midpoints, np.nextafter(midpoints, np.inf),
+                           np.nextafter(midpoints, -np.inf), [-30., 0., 60.]])
+    check_vpress(np.full(len(temp), 75.), temp)
+
+
+def test_data_arrays():
+    rng = np.random.default_rng(2)
+    rh = xr.DataArray(rng.uniform(20., 100., (30, 4, 5)), dims=('time', 'y', 'x'))
+    temp = xr.DataArray(rng.uniform(-5., 30., (30, 4, 5)), dims=('time', 'y', 'x'))
+    vp = rh_to_vpress_array(rh, temp)
+    assert vp.dims == ('time', 'y', 'x')
+    check_vpress(rh.values.ravel(), temp.values.ravel())
+    np.testing.assert_allclose(vp.values.ravel(), rh_to_vpress_array(rh.values.ravel(), temp.values.ravel()))
+
+
+if __name__ == '__main__':
+    test_random_values()
+    test_table_breakpoints()
+    test_data_arrays()
+    print('rh_to_vpress_array matches rh_to_vpress')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Check that the ScenarioWeatherCube returns, for each scenario, the same weather
+as the NetCDFWeatherDataProvider of its rcp and ensemble, on small synthetic
+Chess-Scape tiles with one missing (-999) day.
+"""
+import tempfile
+import cftime
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pcse.settings import settings
+from cropyields import data_dirs
+from cropyields.chess_scape import WEATHER_VARIABLES, osgrid_to_1km, osgrid_to_10km, tile_filename
+from cropyields.utils import osgrid2lonlat
+from cropyields.WeatherManager import NetCDFWeatherDataProvider, ScenarioWeatherCube
+
+OSGRID_CODE = 'SX5941249334'
+SITE = (50., 0.25, 0.5)
+SCENARIOS = [('rcp26', 1), ('rcp45', 1)]
+
+
+class SiteWeatherDataProvider(NetCDFWeatherDataProvider):
+    """Provider with fixed site parameters, which need no database"""
+
+    @staticmethod
+    def site_parameters(osgrid_code):
+        return SITE
+
+
+def synthetic_tile(fname, seed, years=(2019, 2021)):
+    """Tile of 3x3 cells around the cell of OSGRID_CODE, with random weather"""
+    rng = np.random.default_rng(seed)
+    x0, y0 = osgrid2lonlat(osgrid_to_1km(OSGRID_CODE))
+    x, y = x0 + 1000. * np.arange(-1, 2), y0 + 1000. * np.arange(-1, 2)
+    time = [cftime.Datetime360Day(year, month, day) for year in range(*years)
+            for month in range(1, 13) for day in range(1, 31)]
+    shape = (len(time), len(y), len(x))
+    tasmin = rng.uniform(268., 285., shape)
+    ranges = {'pr': (0., 15.), 'rsds': (20., 250.), 'sfcWind': (0., 8.), 'rds': (0., 1.),
+              'rlds': (200., 300.), 'hurs': (40., 100.)}
+    data = {var: rng.uniform(*ranges[var], shape) for var in WEATHER_VARIABLES if var in ranges}
+    data.update(tasmin=tasmin, tasmax=tasmin + rng.uniform(1., 12., shape), tas=tasmin + 3.)
+    data['pr'][10] = -999.
+    ds = xr.Dataset({var: (('time', 'y', 'x'), values) for var, values in data.items()},
+                    coords={'time': time, 'y': y, 'x': x})
+    ds.to_netcdf(fname)
+
+
+def test_cube_as_provider():
+    osgb_dir, cache_dir = data_dirs['OSGB_dir'], settings.METEO_CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dirs['OSGB_dir'] = tmp_dir + '/'
+        settings.METEO_CACHE_DIR = tmp_dir
+        try:
+            for seed, (rcp, ensemble) in enumerate(SCENARIOS):
+                synthetic_tile(tile_filename(osgrid_to_10km(OSGRID_CODE), rcp, ensemble), seed)
+            cube = ScenarioWeatherCube(OSGRID_CODE, SCENARIOS, provider_class=SiteWeatherDataProvider,
+                                       force_update=True)
+            for (rcp, ensemble), wdp in cube.items():
+                reference = SiteWeatherDataProvider(OSGRID_CODE, rcp, ensemble, site=SITE, force_update=True)
+                pd.testing.assert_frame_equal(pd.DataFrame(wdp.export()), pd.DataFrame(reference.export()))
+        finally:
+            data_dirs['OSGB_dir'], settings.METEO_CACHE_DIR = osgb_dir, cache_dir
+
+
+if __name__ == '__main__':
+    test_cube_as_provider()
+    print('The scenario cube matches the weather providers')
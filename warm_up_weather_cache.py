@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 LEEP, University of Exeter (UK)
+# Mattia Mancini (m.c.mancini@exeter.ac.uk), June 2023
+# ====================================================
+"""
+Pre-build the weather cache files of every 1km cell containing a parcel
+of the 'parcels' table, for the chosen rcps and ensembles, before running
+a bulk WOFOST campaign (see run_bulk_wofost.py).
+
+Example:
+    python warm_up_weather_cache.py --rcp rcp26 rcp85 --ensemble 1 4 --processes 8
+"""
+import argparse
+import psycopg2
+from cropyields import db_parameters
+from cropyields.weather_warmup import warm_up_weather_cache
+
+
+def get_parcel_os_codes():
+    """Return the OS grid codes of all the parcels in the 'parcels' table"""
+    conn = None
+    try:
+        conn = psycopg2.connect(user=db_parameters['db_user'],
+                                password=db_parameters['db_password'],
+                                database=db_parameters['db_name'],
+                                host='127.0.0.1',
+                                port='5432')
+        cur = conn.cursor()
+        cur.execute('SELECT nat_grid_ref FROM parcels;')
+        return [row[0] for row in cur.fetchall()]
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pre-build the weather cache files of all parcels')
+    parser.add_argument('--rcp', nargs='+', default=['rcp26'], help='rcp scenarios, e.g. rcp26 rcp85')
+    parser.add_argument('--ensemble', nargs='+', type=int, default=[1], help='ensemble numbers, e.g. 1 4')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--cache-format', choices=['pickle', 'columnar'], default=None,
+                        help='format of the cache files')
+    parser.add_argument('--force', action='store_true', help='rebuild valid cache files too')
+    args = parser.parse_args()
+
+    parcel_os_code = get_parcel_os_codes()
+    summary = warm_up_weather_cache(parcel_os_code, args.rcp, args.ensemble,
+                                    processes=args.processes,
+                                    cache_format=args.cache_format,
+                                    force_update=args.force)
+    print(f'{summary["built"]} cells built, {summary["skipped"]} skipped, '
+          f'{len(summary["failed"])} failed in {summary["elapsed"]:.1f} s '
+          f'({summary["cells_per_second"]:.1f} cells/s, {summary["MB_read"]:.1f} MB read)')
+    for code, rcp, ensemble, error in summary["failed"]:
+        print(f'Failed {code} {rcp} ensemble {ensemble}: {error}')